@@ -1,16 +1,27 @@
-from flask import Flask, request, jsonify
-from simple_bot import SimpleBot
+import os
+import sys
 
-app = Flask(__name__)
-bot = SimpleBot('小助手')
+# Vercel 把所有请求交给这里：直接使用 app.py 的 Flask 应用，页面调用的 /api/bot、/api/bot/stream 等接口与本地一致
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 无服务器实例内存较小、存活时间较短，默认少保留一些会话
+os.environ.setdefault('BOT_MAX_SESSIONS', '200')
+os.environ.setdefault('BOT_SESSION_IDLE_TIMEOUT', '900')
 
-@app.route('/', methods=['POST'])
+from flask import request, jsonify
+from app import app, sessions
+from session_store import SESSION_COOKIE, resolve_session_id, new_session_id
+
+# 早期客户端使用的接口
+@app.route('/', methods=['POST'], endpoint='root_chat')
 def chat():
     try:
         data = request.json
         message = data.get('message', '')
-        response = bot.respond(message)
-        return jsonify({'response': response})
+        session_id = resolve_session_id(request.headers, request.cookies) or new_session_id()
+        response = sessions.get(session_id).respond(message)
+        result = jsonify({'response': response, 'session_id': session_id})
+        result.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite='Lax')
+        return result
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
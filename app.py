@@ -1,45 +1,126 @@
-from flask import Flask, request, jsonify
+from dotenv import load_dotenv
+
+# 加载环境变量：必须在导入机器人模块之前，llm_gateway、scheduler 等模块在导入时读取
+# OPENAI_API_KEY、OPENAI_BASE_URL、BOT_LLM_* 等配置
+load_dotenv()
+
+from flask import Flask, Response, request, jsonify, send_from_directory
 from flask_cors import CORS
 from simple_bot import SimpleBot
+from session_store import SessionStore, SESSION_COOKIE, is_valid_session_id, resolve_session_id, new_session_id
+from batch import BatchProcessor, BatchError, SessionMovedError
+from scheduler import SCHEDULER
+import metrics
+import tracing
+import tokenizer
+import json
 import os
-from dotenv import load_dotenv
+import sys
 
 app = Flask(__name__)
 CORS(app)  # 启用跨域请求
 
-# 加载环境变量
-load_dotenv()
+# gunicorn 预加载模式（见 gunicorn.conf.py）：master 进程只构建以读为主的共享数据
+# （知识库、问答索引、长期记忆、意图路由、jieba 词典），fork 之后各 worker 再启动后台线程
+PRELOAD = os.environ.get('BOT_PRELOAD') == '1'
 
 # 创建机器人实例
-bot = SimpleBot('小助手')
+bot = SimpleBot('小助手', background=not PRELOAD)
+if PRELOAD:
+    tokenizer.preload()
+
+# 每个用户一个会话：对话历史、情感状态和短期记忆互相隔离，知识库等组件共用
+# （使用状态服务时会话保存在服务中，同一用户的请求可以由任意 worker 处理）
+sessions = SessionStore.from_env(bot.new_session, state=bot.state)
+
+metrics.REGISTRY.gauge('bot_sessions_active', '内存中的会话数').set_function(lambda: len(sessions))
+
+# 批量接口：在请求线程中逐个会话回放消息
+batches = BatchProcessor(sessions)
+
+def post_fork():
+    """gunicorn worker fork 之后调用：重新设置随机种子，启动后台线程"""
+    if 'numpy' in sys.modules:
+        # numpy 的全局随机状态不会在 fork 后重新设置，否则各 worker 的随机回复完全相同
+        sys.modules['numpy'].random.seed()
+    bot.start_background()
 
 @app.route('/')
 def home():
-    return app.send_static_file('index.html')
+    # 仓库根目录的 index.html 只在直接运行 app.py 时移动到 static 目录（gunicorn、Vercel 等直接使用根目录的）
+    if os.path.exists(os.path.join(app.static_folder, 'index.html')):
+        return app.send_static_file('index.html')
+    return send_from_directory(os.path.dirname(os.path.abspath(__file__)), 'index.html')
+
+# 以下三个函数与 Web 框架无关，asgi_app.py 的异步接口也使用它们
+
+def open_session(headers, cookies):
+    """获取请求对应的会话，并应用请求中携带的API密钥；会话已交给其他节点时返回 (会话ID, None)"""
+    session_id = resolve_session_id(headers, cookies) or new_session_id()
+    if sessions.is_moved(session_id):
+        return session_id, None
+    session = sessions.get(session_id)
+    
+    # 如果提供了API密钥，只用于当前会话发起的大模型调用
+    openai_key = headers.get('X-OpenAI-Key')
+    if openai_key:
+        session.openai_api_key = openai_key
+    return session_id, session
+
+def parse_message(data):
+    """取出请求体中的 message，返回 (消息, 错误信息)，格式不对时消息为 None"""
+    if data is None:
+        return None, '请求体不是合法的JSON'
+    message = data.get('message') if isinstance(data, dict) else None
+    if not isinstance(message, str):
+        return None, '缺少 message 字段'
+    return message, None
+
+def moved_payload(session_id):
+    """会话已经交给其他节点（多节点部署时由 session_router.py 迁移），返回 409 让路由层重新选择节点"""
+    return {'status': 'error', 'message': '会话已迁移到其他节点', 'session_id': session_id}
+
+def _get_session():
+    return open_session(request.headers, request.cookies)
+
+def _read_message():
+    """返回 (消息, 错误响应)"""
+    message, error = parse_message(request.get_json(silent=True))
+    if error:
+        return None, (jsonify({'status': 'error', 'message': error}), 400)
+    return message, None
+
+def _moved_response(session_id):
+    return jsonify(moved_payload(session_id)), 409
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus 指标"""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
 
 @app.route('/api/bot', methods=['POST'])
 def chat():
     try:
-        data = request.json
-        message = data.get('message')
-        
-        # 获取API密钥
-        openai_key = request.headers.get('X-OpenAI-Key')
-        serper_key = request.headers.get('X-Serper-Key')
-        
-        # 如果提供了API密钥，更新机器人的配置
-        if openai_key:
-            bot.openai_api_key = openai_key
-        if serper_key:
-            bot.serper_api_key = serper_key
+        message, error = _read_message()
+        if error:
+            return error
+        session_id, session = _get_session()
+        if session is None:
+            return _moved_response(session_id)
+        payload = {'status': 'success', 'session_id': session_id}
             
-        # 获取机器人响应
-        response = bot.respond(message)
+        # 获取机器人响应，带有追踪调试头时同时返回各阶段耗时
+        if tracing.trace_requested(request.headers):
+            with tracing.start_trace('respond') as trace:
+                payload['response'] = session.respond(message)
+            payload['trace'] = trace.to_dict()
+        else:
+            payload['response'] = session.respond(message)
+        sessions.save(session_id)
         
-        return jsonify({
-            'status': 'success',
-            'response': response
-        })
+        result = jsonify(payload)
+        result.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite='Lax')
+        return result
         
     except Exception as e:
         return jsonify({
@@ -47,6 +128,162 @@ def chat():
             'message': str(e)
         }), 500
 
+@app.route('/api/bot/stream', methods=['POST'])
+def chat_stream():
+    """以 Server-Sent Events 逐段返回回复"""
+    message, error = _read_message()
+    if error:
+        return error
+    session_id, session = _get_session()
+    if session is None:
+        return _moved_response(session_id)
+    
+    def generate():
+        try:
+            for chunk in session.respond_stream(message):
+                yield f"data: {json.dumps({'delta': chunk}, ensure_ascii=False)}\n\n"
+            sessions.save(session_id)
+            yield f"event: done\ndata: {json.dumps({'session_id': session_id})}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'message': str(e)}, ensure_ascii=False)}\n\n"
+            
+    result = Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+    result.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite='Lax')
+    return result
+
+@app.route('/api/bot/batch', methods=['POST'])
+def chat_batch():
+    """批量处理 {"items": [{"session_id": ..., "message": ...}], "stream": false}
+
+    stream 为 true 时以 NDJSON 逐行返回，每个会话处理完就输出该会话的结果。
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'status': 'error', 'message': '请求体不是合法的JSON'}), 400
+    items = data.get('items')
+    
+    try:
+        if data.get('stream'):
+            # 先取出第一批结果，让格式错误在返回响应之前暴露
+            results = batches.iter_results(items)
+            first = next(results, None)
+            
+            def generate():
+                if first is not None:
+                    yield json.dumps(first, ensure_ascii=False) + '\n'
+                for result in results:
+                    yield json.dumps(result, ensure_ascii=False) + '\n'
+                    
+            return Response(generate(), mimetype='application/x-ndjson')
+            
+        return jsonify({
+            'status': 'success',
+            'results': batches.run(items)
+        })
+    except SessionMovedError as e:
+        return _moved_response(e.session_id)
+    except BatchError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+def _admin_error():
+    """管理接口的鉴权，通过时返回 None"""
+    if not os.environ.get('BOT_ADMIN_TOKEN'):
+        return jsonify({'status': 'error', 'message': '接口不存在'}), 404
+    if not tracing.admin_authorized(request.headers):
+        return jsonify({'status': 'error', 'message': '无权访问'}), 403
+    return None
+
+@app.route('/admin/profile')
+def admin_profile():
+    """对整个进程采样若干秒，返回折叠栈（可直接交给 flamegraph.pl 或 speedscope）
+
+    需要设置环境变量 BOT_ADMIN_TOKEN，并在请求头 X-Admin-Token 中提供相同的值。
+    参数：seconds（默认 10，最多 60）、interval（采样间隔秒数，默认 0.005）、idle=1 包含空闲线程
+    """
+    error = _admin_error()
+    if error:
+        return error
+    try:
+        seconds = min(float(request.args.get('seconds', 10)), 60.0)
+        interval = max(float(request.args.get('interval', 0.005)), 0.001)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': '参数不合法'}), 400
+        
+    collapsed = tracing.profile(seconds, interval, include_idle=request.args.get('idle') == '1')
+    if collapsed is None:
+        return jsonify({'status': 'error', 'message': '已有采样正在进行'}), 409
+    return Response(collapsed, mimetype='text/plain')
+
+@app.route('/admin/hotspots')
+def admin_hotspots():
+    """对线上流量采样若干秒，返回按自身耗时排序的热点函数，并计入自我优化的分析结果
+
+    鉴权同 /admin/profile。参数：seconds（默认 10，最多 60）、memory=1 同时统计内存分配、top（默认 20）
+    """
+    error = _admin_error()
+    if error:
+        return error
+    try:
+        seconds = min(float(request.args.get('seconds', 10)), 60.0)
+        top = int(request.args.get('top', 20))
+    except ValueError:
+        return jsonify({'status': 'error', 'message': '参数不合法'}), 400
+        
+    profile = bot.self_improvement.profile_window(seconds, memory=request.args.get('memory') == '1')
+    if profile is None:
+        return jsonify({'status': 'error', 'message': '已有采样正在进行'}), 409
+    return jsonify(dict(bot.self_improvement.hotspot_report(profile, top), status='success'))
+
+@app.route('/admin/tasks')
+def admin_tasks():
+    """后台任务：排队和运行中的任务，以及各类任务的统计（鉴权同 /admin/profile）"""
+    error = _admin_error()
+    if error:
+        return error
+    return jsonify(dict(SCHEDULER.snapshot(), status='success'))
+
+@app.route('/admin/sessions')
+def admin_sessions():
+    """本节点内存中的会话ID（多节点迁移会话时使用，鉴权同 /admin/profile）"""
+    error = _admin_error()
+    if error:
+        return error
+    return jsonify({'status': 'success', 'sessions': sessions.ids(), 'stats': sessions.get_stats()})
+
+@app.route('/admin/sessions/<session_id>', methods=['GET', 'PUT'])
+def admin_session(session_id):
+    """GET 导出会话状态，PUT 导入其他节点交来的会话状态"""
+    error = _admin_error()
+    if error:
+        return error
+    if not is_valid_session_id(session_id):
+        return jsonify({'status': 'error', 'message': '会话ID不合法'}), 400
+    if request.method == 'PUT':
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get('state'), dict):
+            return jsonify({'status': 'error', 'message': '缺少 state 字段'}), 400
+        sessions.put(session_id, data['state'])
+        return jsonify({'status': 'success'})
+    state = sessions.export(session_id)
+    if state is None:
+        return jsonify({'status': 'error', 'message': '会话不存在'}), 404
+    return jsonify({'status': 'success', 'state': state})
+
+@app.route('/admin/sessions/<session_id>/handoff', methods=['POST'])
+def admin_session_handoff(session_id):
+    """导出会话状态并从本节点删除，之后本节点对该会话的请求返回 409"""
+    error = _admin_error()
+    if error:
+        return error
+    if not is_valid_session_id(session_id):
+        return jsonify({'status': 'error', 'message': '会话ID不合法'}), 400
+    state = sessions.handoff(session_id)
+    if state is None:
+        return jsonify({'status': 'error', 'message': '会话不存在'}), 404
+    return jsonify({'status': 'success', 'state': state})
+
 if __name__ == '__main__':
     # 确保static文件夹存在
     os.makedirs('static', exist_ok=True)
@@ -0,0 +1,171 @@
+"""异步（ASGI）服务入口，接口与 app.py 完全相同
+
+运行方式：
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+
+POST /api/bot 和 POST /api/bot/stream 在事件循环中处理：大模型的响应用 await 等待（见
+SimpleBot.respond_async），等待期间不占用线程。其余接口（页面、批量、指标、管理接口）直接交给
+app.py 的 Flask 应用，在线程池中执行；会话的取得、消息的校验和迁移检查也与 Flask 共用 app.py 的函数。
+"""
+import asyncio
+import json
+import os
+from http.cookies import SimpleCookie
+from a2wsgi import WSGIMiddleware
+from app import app as flask_app, sessions, open_session, parse_message, moved_payload
+from session_store import SESSION_COOKIE
+import tracing
+
+# 其余接口在线程池中执行；/admin/profile 等会运行数秒，线程数不宜太少
+wsgi = WSGIMiddleware(flask_app, workers=int(os.environ.get('BOT_WSGI_WORKERS', 10)))
+
+CORS_HEADERS = [(b'access-control-allow-origin', b'*')]
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, payload):
+        super().__init__(payload.get('message'))
+        self.status = status
+        self.payload = payload
+
+
+class Headers(dict):
+    """请求头，按名称查找时不区分大小写（与 Flask 的 request.headers 一致）"""
+    def __getitem__(self, key):
+        return super().__getitem__(key.lower())
+
+    def __contains__(self, key):
+        return super().__contains__(key.lower())
+
+    def get(self, key, default=None):
+        return super().get(key.lower(), default)
+
+
+def _parse_headers(scope):
+    headers = Headers()
+    for key, value in scope['headers']:
+        dict.__setitem__(headers, key.decode('latin-1').lower(), value.decode('latin-1'))
+    cookies = {}
+    if 'Cookie' in headers:
+        cookies = {k: morsel.value for k, morsel in SimpleCookie(headers['Cookie']).items()}
+    return headers, cookies
+
+
+async def _read_json(receive):
+    """读取请求体并解析 JSON，不是合法的 JSON 时返回 None（同 Flask 的 get_json(silent=True)）"""
+    body = b''
+    while True:
+        event = await receive()
+        if event['type'] == 'http.disconnect':
+            raise HTTPError(499, {'status': 'error', 'message': '客户端已断开'})
+        body += event.get('body', b'')
+        if not event.get('more_body'):
+            break
+    try:
+        return json.loads(body)
+    except ValueError:
+        return None
+
+
+async def _send_json(send, status: int, payload, extra_headers=()):
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json; charset=utf-8'),
+                    (b'content-length', str(len(body)).encode())] + CORS_HEADERS + list(extra_headers)
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def _sse_event(data, event: str = None) -> bytes:
+    lines = f'event: {event}\n' if event else ''
+    lines += f'data: {json.dumps(data, ensure_ascii=False)}\n\n'
+    return lines.encode('utf-8')
+
+
+def _session_cookie(session_id: str):
+    return (b'set-cookie', f'{SESSION_COOKIE}={session_id}; HttpOnly; Path=/; SameSite=Lax'.encode())
+
+
+async def _load_chat_request(scope, receive):
+    """解析聊天请求，返回 (请求头, 会话ID, 会话对象, 消息)，校验规则同 app.py"""
+    message, error = parse_message(await _read_json(receive))
+    if error:
+        raise HTTPError(400, {'status': 'error', 'message': error})
+    headers, cookies = _parse_headers(scope)
+    # 取得会话可能要从状态服务读取，不在事件循环中等待
+    session_id, session = await asyncio.to_thread(open_session, headers, cookies)
+    if session is None:
+        raise HTTPError(409, moved_payload(session_id))
+    return headers, session_id, session, message
+
+
+async def chat(scope, receive, send):
+    headers, session_id, session, message = await _load_chat_request(scope, receive)
+    payload = {'status': 'success', 'session_id': session_id}
+    if tracing.trace_requested(headers):
+        # respond_async 在线程池中执行时会复制当前上下文，追踪可以跟随过去
+        with tracing.start_trace('respond') as trace:
+            payload['response'] = await session.respond_async(message)
+        payload['trace'] = trace.to_dict()
+    else:
+        payload['response'] = await session.respond_async(message)
+    await asyncio.to_thread(sessions.save, session_id)
+    await _send_json(send, 200, payload, [_session_cookie(session_id)])
+
+
+async def chat_stream(scope, receive, send):
+    """以 Server-Sent Events 逐段返回回复"""
+    _, session_id, session, message = await _load_chat_request(scope, receive)
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', b'text/event-stream; charset=utf-8'),
+                    (b'cache-control', b'no-cache'),
+                    _session_cookie(session_id)] + CORS_HEADERS
+    })
+    try:
+        async for chunk in session.respond_stream_async(message):
+            await send({'type': 'http.response.body', 'body': _sse_event({'delta': chunk}),
+                        'more_body': True})
+        await asyncio.to_thread(sessions.save, session_id)
+        done = _sse_event({'session_id': session_id}, event='done')
+    except Exception as e:
+        done = _sse_event({'message': str(e)}, event='error')
+    await send({'type': 'http.response.body', 'body': done})
+
+
+ROUTES = {
+    ('POST', '/api/bot'): chat,
+    ('POST', '/api/bot/stream'): chat_stream,
+}
+
+
+async def _lifespan(receive, send):
+    while True:
+        event = await receive()
+        if event['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif event['type'] == 'lifespan.shutdown':
+            # 退出前保存会话
+            await asyncio.to_thread(sessions.flush)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    handler = ROUTES.get((scope.get('method'), scope.get('path'))) if scope['type'] == 'http' else None
+    if handler is None:
+        await wsgi(scope, receive, send)
+        return
+    try:
+        await handler(scope, receive, send)
+    except HTTPError as e:
+        if e.status != 499:
+            await _send_json(send, e.status, e.payload)
+    except Exception as e:
+        await _send_json(send, 500, {'status': 'error', 'message': str(e)})
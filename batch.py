@@ -0,0 +1,88 @@
+"""批量对话：一次提交大量 (会话, 消息)，用于评估和回放任务
+
+只是省去每条消息一次 HTTP 往返的回放接口：消息在当前请求中逐个会话、按提交顺序处理，
+结果与逐条调用 /api/bot 相同，消息之间不共享计算（回复依赖各会话的状态）。
+同时处理多个批量请求时由各 worker 分担。
+"""
+import os
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional
+
+from session_store import is_valid_session_id, new_session_id
+
+
+class BatchError(ValueError):
+    """批量请求格式不正确"""
+
+
+class SessionMovedError(BatchError):
+    """批量请求中的会话已经交给其他节点"""
+    def __init__(self, session_id: str):
+        super().__init__(f'会话 {session_id} 已迁移到其他节点')
+        self.session_id = session_id
+
+
+class BatchProcessor:
+    """批量处理器：按会话分组，依次处理各会话的消息"""
+    def __init__(self, sessions, max_items: int = None):
+        self.sessions = sessions
+        self.max_items = max_items or int(os.environ.get('BOT_MAX_BATCH', 10000))
+
+    def _normalize(self, items) -> List[Dict[str, Any]]:
+        """校验请求条目，没有会话ID的条目共用一个新会话；有会话已交给其他节点时整批拒绝"""
+        if not isinstance(items, list):
+            raise BatchError('items 必须是数组')
+        if len(items) > self.max_items:
+            raise BatchError(f'单次最多 {self.max_items} 条消息')
+
+        shared_session_id: Optional[str] = None
+        normalized = []
+        for index, item in enumerate(items):
+            if isinstance(item, str):
+                item = {'message': item}
+            if not isinstance(item, dict) or not isinstance(item.get('message'), str):
+                raise BatchError(f'第 {index} 条缺少 message 字段')
+            session_id = item.get('session_id')
+            if not session_id:
+                shared_session_id = shared_session_id or new_session_id()
+                session_id = shared_session_id
+            elif not is_valid_session_id(session_id):
+                raise BatchError(f'第 {index} 条的 session_id 不合法')
+            elif self.sessions.is_moved(session_id):
+                raise SessionMovedError(session_id)
+            normalized.append({'index': index, 'session_id': session_id, 'message': item['message']})
+        return normalized
+
+    def _run_session(self, session_id: str, entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """依次处理同一会话的消息"""
+        if self.sessions.is_moved(session_id):
+            # 处理到这个会话之前被迁移走了
+            return [{'index': entry['index'], 'session_id': session_id, 'error': '会话已迁移到其他节点'}
+                    for entry in entries]
+        session = self.sessions.get(session_id)
+        results = []
+        for entry in entries:
+            try:
+                response = session.respond(entry['message'])
+                results.append({'index': entry['index'], 'session_id': session_id, 'response': response})
+            except Exception as e:
+                results.append({'index': entry['index'], 'session_id': session_id, 'error': str(e)})
+        self.sessions.save(session_id)
+        return results
+
+    def iter_results(self, items) -> Iterator[Dict[str, Any]]:
+        """处理一批消息，每个会话处理完后产出该会话的结果"""
+        entries = self._normalize(items)
+
+        groups = OrderedDict()
+        for entry in entries:
+            groups.setdefault(entry['session_id'], []).append(entry)
+
+        for session_id, group in groups.items():
+            yield from self._run_session(session_id, group)
+
+    def run(self, items) -> List[Dict[str, Any]]:
+        """处理一批消息，按提交顺序返回结果"""
+        results = list(self.iter_results(items))
+        results.sort(key=lambda result: result['index'])
+        return results
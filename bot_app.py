@@ -7,6 +7,7 @@ from PyQt6.QtCore import Qt, QTimer
 from PyQt6.QtGui import QFont, QIcon, QAction
 import json
 from simple_bot import SimpleBot
+import llm_gateway
 
 class ApiKeyDialog(QDialog):
     def __init__(self, parent=None):
@@ -61,6 +62,8 @@ class ChatbotWindow(QMainWindow):
                 keys = json.load(f)
                 self.bot.openai_api_key = keys.get('openai', '')
                 self.bot.serper_api_key = keys.get('serper', '')
+                if self.bot.openai_api_key:
+                    llm_gateway.configure(api_key=self.bot.openai_api_key)
         except:
             pass
         
@@ -121,6 +124,7 @@ class ChatbotWindow(QMainWindow):
             # 更新机器人的API密钥
             self.bot.openai_api_key = keys['openai']
             self.bot.serper_api_key = keys['serper']
+            llm_gateway.configure(api_key=keys['openai'])
             self.status_label.setText('API密钥已更新')
             
     def display_bot_message(self, message):
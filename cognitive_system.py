@@ -1,17 +1,117 @@
 import json
 import datetime
+import os
 import re
+import threading
 from collections import defaultdict
-import numpy as np
+from itertools import chain
 from typing import List, Dict, Any
+from tokenizer import word_set
+from metrics import timed
 
-class Memory:
+def merge_exported(saved: Dict[str, Any], state: Dict[str, Any]) -> Dict[str, Any]:
+    """合并两份 LongTermStore.export() 的结果：记忆按 (内容, 时间) 去重，概念关联取并集"""
+    memories = {k: list(v) for k, v in saved.get('long_term_memory', {}).items()}
+    for category, items in state['long_term_memory'].items():
+        existing = memories.setdefault(category, [])
+        seen = {(m['content'], m.get('timestamp')) for m in existing}
+        existing.extend(m for m in items if (m['content'], m.get('timestamp')) not in seen)
+    associations = {k: set(v) for k, v in saved.get('associations', {}).items()}
+    for word, related in state['associations'].items():
+        associations.setdefault(word, set()).update(related)
+    return {'long_term_memory': memories, 'associations': {k: list(v) for k, v in associations.items()}}
+
+def _entry(memory: Dict[str, Any]) -> tuple:
+    """快照中的一条记忆：(记忆, 词集合)，词集合在写入时计算一次"""
+    return memory, frozenset(memory['content'].split())
+
+class LongTermStore:
+    """长期记忆存储：多个会话共享，写入时加锁，读取使用写时复制的快照"""
+    max_recall_cache = 4096  # 每个快照最多缓存的召回结果数
+    
     def __init__(self):
-        self.short_term = []  # 短期记忆
-        self.long_term = defaultdict(list)  # 长期记忆
+        self.lock = threading.Lock()
+        self.memories = defaultdict(list)     # 长期记忆
         self.associations = defaultdict(set)  # 概念关联
+        self._entries = defaultdict(list)     # 类别 -> [(记忆, 词集合)]，与 memories 一一对应
+        # (类别 -> (记忆, 词集合) 元组, 召回结果缓存)：快照和缓存总是一起整体替换，读取时无需加锁
+        self.view = ({}, {})
+        
+    @property
+    def snapshot(self) -> Dict[str, tuple]:
+        return self.view[0]
+        
+    def add(self, memories: List[Dict[str, Any]]) -> None:
+        """写入一批长期记忆并更新快照"""
+        if not memories:
+            return
+        with self.lock:
+            changed = set()
+            for memory in memories:
+                category = memory['category'] or '通用'
+                entry = _entry(memory)
+                self.memories[category].append(memory)
+                self._entries[category].append(entry)
+                changed.add(category)
+                
+                # 建立概念关联
+                words = entry[1]
+                for word in words:
+                    self.associations[word].update(words - {word})
+                    
+            snapshot = dict(self.snapshot)
+            for category in changed:
+                snapshot[category] = tuple(self._entries[category])
+            self.view = (snapshot, {})
+            
+    def replace(self, memories: Dict[str, list] = None, associations: Dict[str, set] = None) -> None:
+        """整体替换存储内容（用于加载状态）"""
+        with self.lock:
+            if memories is not None:
+                self.memories = defaultdict(list, memories)
+                self._entries = defaultdict(list, {k: [_entry(m) for m in v] for k, v in self.memories.items()})
+                self.view = ({k: tuple(v) for k, v in self._entries.items()}, {})
+            if associations is not None:
+                self.associations = defaultdict(set, associations)
+                
+    def export(self) -> Dict[str, Any]:
+        """在锁内复制一份可序列化的状态"""
+        with self.lock:
+            return {
+                'long_term_memory': {k: list(v) for k, v in self.memories.items()},
+                'associations': {k: list(v) for k, v in self.associations.items()}
+            }
+
+class Memory:
+    def __init__(self, store: LongTermStore = None):
+        self.short_term = []  # 短期记忆
+        self.store = store or LongTermStore()  # 长期记忆和概念关联
         self.max_short_term = 10  # 短期记忆容量
+        self._lock = threading.Lock()
+        
+    @property
+    def long_term(self):
+        return self.store.memories
+        
+    @long_term.setter
+    def long_term(self, memories):
+        self.store.replace(memories=memories)
+        
+    @property
+    def associations(self):
+        return self.store.associations
+        
+    @associations.setter
+    def associations(self, associations):
+        self.store.replace(associations=associations)
         
+    def fork(self) -> 'Memory':
+        """创建一个共享长期记忆和概念关联、但短期记忆独立的副本"""
+        memory = Memory(self.store)
+        memory.max_short_term = self.max_short_term
+        return memory
+        
+    @timed('add_memory')
     def add_memory(self, content: str, category: str = None):
         """添加新记忆"""
         # 添加到短期记忆
@@ -22,11 +122,12 @@ class Memory:
             'importance': self._evaluate_importance(content)
         }
         
-        self.short_term.append(memory_item)
-        
-        # 如果短期记忆满了，进行记忆整合
-        if len(self.short_term) > self.max_short_term:
-            self._consolidate_memories()
+        with self._lock:
+            self.short_term.append(memory_item)
+            
+            # 如果短期记忆满了，进行记忆整合
+            if len(self.short_term) > self.max_short_term:
+                self._consolidate_memories()
             
     def _evaluate_importance(self, content: str) -> float:
         """评估记忆的重要性"""
@@ -47,32 +148,34 @@ class Memory:
         return min(importance, 1.0)
         
     def _consolidate_memories(self):
-        """整合记忆：将短期记忆转化为长期记忆"""
-        for memory in self.short_term:
-            if memory['importance'] > 0.6:  # 重要的记忆转入长期记忆
-                category = memory['category'] or '通用'
-                self.long_term[category].append(memory)
-                
-                # 建立概念关联
-                words = set(memory['content'].split())
-                for word in words:
-                    self.associations[word].update(words - {word})
-                
-        # 清空短期记忆
-        self.short_term = []
+        """整合记忆：将短期记忆转化为长期记忆（调用方需持有 self._lock）"""
+        # 先换出短期记忆再写入，写入长期记忆时不阻塞新的短期记忆
+        batch, self.short_term = self.short_term, []
+        
+        # 重要的记忆转入长期记忆
+        self.store.add([memory for memory in batch if memory['importance'] > 0.6])
         
+    @timed('recall')
     def recall(self, query: str, category: str = None) -> List[Dict[str, Any]]:
         """根据查询召回相关记忆"""
-        query_words = set(query.split())
+        query_words = frozenset(query.split())
+        if not query_words:
+            return []
+            
+        # 同一快照下相同的查询直接复用结果
+        snapshot, cache = self.store.view
+        cached = cache.get((query, category))
+        if cached is not None:
+            return list(cached)
+            
         relevant_memories = []
         
-        # 搜索长期记忆
-        memories_to_search = self.long_term[category] if category else [
-            m for memories in self.long_term.values() for m in memories
-        ]
+        # 搜索长期记忆（使用快照，不需要加锁）
+        memories_to_search = snapshot.get(category, ()) if category else chain.from_iterable(
+            snapshot.values()
+        )
         
-        for memory in memories_to_search:
-            memory_words = set(memory['content'].split())
+        for memory, memory_words in memories_to_search:
             # 计算相关性
             relevance = len(query_words & memory_words) / len(query_words)
             if relevance > 0.3:  # 相关性阈值
@@ -83,7 +186,10 @@ class Memory:
                 })
                 
         # 按相关性排序
-        return sorted(relevant_memories, key=lambda x: x['relevance'], reverse=True)
+        relevant_memories.sort(key=lambda x: x['relevance'], reverse=True)
+        if len(cache) < self.store.max_recall_cache:
+            cache[(query, category)] = tuple(relevant_memories)
+        return relevant_memories
 
 class Reasoning:
     def __init__(self, memory: Memory):
@@ -106,6 +212,7 @@ class Reasoning:
             }
         ]
         
+    @timed('analyze')
     def analyze(self, statement: str) -> Dict[str, Any]:
         """分析陈述中的逻辑关系"""
         analysis = {
@@ -140,6 +247,7 @@ class Reasoning:
                         
         return analysis
         
+    @timed('infer')
     def infer(self, context: str) -> Dict[str, Any]:
         """根据上下文进行推理"""
         # 获取相关记忆
@@ -201,8 +309,8 @@ class Reasoning:
         
     def _text_similarity(self, text1: str, text2: str) -> float:
         """计算两段文本的相似度"""
-        words1 = set(text1.split())
-        words2 = set(text2.split())
+        words1 = word_set(text1)
+        words2 = word_set(text2)
         intersection = words1 & words2
         union = words1 | words2
         return len(intersection) / len(union) if union else 0.0
@@ -218,6 +326,7 @@ class DecisionMaking:
             'novelty': 0.2    # 创新性权重
         }
         
+    @timed('make_decision')
     def make_decision(self, situation: str, options: List[str]) -> Dict[str, Any]:
         """在给定情况下做出决策"""
         decision = {
@@ -301,8 +410,7 @@ class DecisionMaking:
         risk_words = {'危险', '伤害', '损失', '风险', '不安全'}
         safety_words = {'安全', '保护', '稳妥', '可靠'}
         
-        text = f"{option} {situation}"
-        words = set(text.split())
+        words = word_set(option) | word_set(situation)
         
         risk_score = len(risk_words & words) * 0.2
         safety_score = len(safety_words & words) * 0.2
@@ -326,7 +434,7 @@ class DecisionMaking:
         unethical_words = {'欺骗', '伤害', '不当', '违规', '非法'}
         ethical_words = {'诚实', '公平', '正当', '合规', '合法'}
         
-        words = set(option.split())
+        words = word_set(option)
         
         unethical_score = len(unethical_words & words) * 0.3
         ethical_score = len(ethical_words & words) * 0.3
@@ -386,11 +494,16 @@ class DecisionMaking:
         return similarity
 
 class CognitiveSystem:
-    def __init__(self):
-        self.memory = Memory()
+    def __init__(self, memory: Memory = None):
+        self.memory = memory or Memory()
         self.reasoning = Reasoning(self.memory)
         self.decision_making = DecisionMaking(self.memory, self.reasoning)
         
+    def fork(self) -> 'CognitiveSystem':
+        """创建共享长期记忆的认知系统，用于独立的对话会话"""
+        return CognitiveSystem(self.memory.fork())
+        
+    @timed('process_input')
     def process_input(self, input_text: str) -> Dict[str, Any]:
         """处理输入并产生认知响应"""
         # 记录输入
@@ -439,23 +552,32 @@ class CognitiveSystem:
                 
         return options
         
-    def save_state(self, filename: str):
-        """保存认知系统状态"""
-        state = {
-            'long_term_memory': dict(self.memory.long_term),
-            'associations': {k: list(v) for k, v in self.memory.associations.items()}
-        }
-        with open(filename, 'w', encoding='utf-8') as f:
+    def save_state(self, filename: str, merge: bool = False):
+        """保存认知系统状态
+
+        merge=True 时与文件中已有的长期记忆合并，多个进程先后保存时不会覆盖其他进程写入的记忆
+        （进程之间的互斥由调用方负责）。
+        """
+        state = self.memory.store.export()
+        if merge:
+            try:
+                with open(filename, 'r', encoding='utf-8') as f:
+                    state = merge_exported(json.load(f), state)
+            except (FileNotFoundError, ValueError, KeyError, TypeError, AttributeError):
+                pass  # 文件不存在或已损坏时只写入本进程的状态
+        tmp = f'{filename}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
             json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, filename)
             
     def load_state(self, filename: str):
         """加载认知系统状态"""
         try:
             with open(filename, 'r', encoding='utf-8') as f:
                 state = json.load(f)
-                self.memory.long_term = defaultdict(list, state['long_term_memory'])
-                self.memory.associations = defaultdict(set, {
-                    k: set(v) for k, v in state['associations'].items()
-                })
+                self.memory.store.replace(
+                    memories=state['long_term_memory'],
+                    associations={k: set(v) for k, v in state['associations'].items()}
+                )
         except FileNotFoundError:
             pass  # 如果文件不存在，使用空白状态 
\ No newline at end of file
@@ -1,8 +1,167 @@
 import numpy as np
-from typing import Dict, List, Any, Tuple
+from typing import Dict, List, Any, Tuple, Iterable
 import datetime
 import json
-from collections import defaultdict
+import os
+import time
+from collections import defaultdict, deque
+from retention import RingLog, KeyedLog
+from tokenizer import word_set
+from metrics import timed
+
+DIMENSIONS = ('pleasure', 'arousal', 'dominance')
+
+# 情感词典
+EMOTION_DICT = {
+    '开心': {'pleasure': 0.8, 'arousal': 0.5, 'dominance': 0.6},
+    '难过': {'pleasure': -0.7, 'arousal': -0.3, 'dominance': -0.4},
+    '生气': {'pleasure': -0.6, 'arousal': 0.8, 'dominance': 0.7},
+    '害怕': {'pleasure': -0.7, 'arousal': 0.7, 'dominance': -0.8},
+    '惊讶': {'pleasure': 0.2, 'arousal': 0.8, 'dominance': 0.0},
+    '平静': {'pleasure': 0.3, 'arousal': -0.4, 'dominance': 0.2},
+}
+
+# 情感响应模板
+RESPONSE_TEMPLATES = {
+    'high_pleasure': [
+        '我现在感觉很愉快！',
+        '这真是太棒了！',
+        '我很高兴能和你交流！'
+    ],
+    'low_pleasure': [
+        '这确实让人有点难过...',
+        '我能理解这种感受',
+        '让我们一起面对这个问题'
+    ],
+    'high_arousal': [
+        '这太令人兴奋了！',
+        '我现在充满干劲！',
+        '让我们积极行动起来！'
+    ],
+    'low_arousal': [
+        '我们需要冷静下来想想',
+        '让我们慢慢来',
+        '保持平和的心态很重要'
+    ]
+}
+
+class EmotionalMemory:
+    """情感记忆环形缓冲区：定长数组存储，增量维护趋势统计"""
+    def __init__(self, capacity: int = 100, trend_window: int = 10):
+        if capacity <= trend_window:
+            raise ValueError('capacity 必须大于 trend_window')
+        self.capacity = capacity
+        self.trend_window = trend_window
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.values = np.zeros((capacity, len(DIMENSIONS)), dtype=np.float32)
+        self.triggers = [None] * capacity
+        self._head = 0   # 下一个写入位置
+        self._size = 0
+        self._total = 0  # 累计写入次数
+        
+        # 最近 trend_window 个状态的滚动统计（float64 累加以减少误差）
+        self._value_sum = np.zeros(len(DIMENSIONS))
+        self._delta_sum = np.zeros(len(DIMENSIONS))
+        self._delta_sq_sum = np.zeros(len(DIMENSIONS))
+        
+    def __len__(self) -> int:
+        return self._size
+        
+    def _index(self, offset: int) -> int:
+        """倒数第 offset 个状态在数组中的位置（offset=1 为最新）"""
+        return (self._head - offset) % self.capacity
+        
+    def append(self, timestamp: float, dimensions: Dict[str, float], trigger: str = None) -> None:
+        """写入一个情感状态，O(1)"""
+        new = np.array([dimensions[d] for d in DIMENSIONS], dtype=np.float32)
+        
+        if self._size:
+            delta = new.astype(np.float64) - self.values[self._index(1)]
+            self._delta_sum += delta
+            self._delta_sq_sum += delta * delta
+            
+            # 窗口内的差值个数为 trend_window - 1，移出最旧的一个差值
+            if self._size >= self.trend_window:
+                old = self.values[self._index(self.trend_window)].astype(np.float64)
+                older = self.values[self._index(self.trend_window - 1)].astype(np.float64)
+                old_delta = older - old
+                self._delta_sum -= old_delta
+                self._delta_sq_sum -= old_delta * old_delta
+                
+        self._value_sum += new
+        if self._size >= self.trend_window:
+            self._value_sum -= self.values[self._index(self.trend_window)]
+            
+        self.timestamps[self._head] = timestamp
+        self.values[self._head] = new
+        self.triggers[self._head] = trigger
+        self._head = (self._head + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+        self._total += 1
+        
+        # 每写满一轮重新精确计算一次，避免浮点误差累积
+        if self._head == 0:
+            self._recompute()
+            
+    def extend(self, records: Iterable[Dict[str, Any]]) -> None:
+        """批量写入字典格式的记录（兼容旧版状态文件）"""
+        for record in records:
+            timestamp = record.get('timestamp', 0.0)
+            if isinstance(timestamp, str):
+                timestamp = datetime.datetime.fromisoformat(timestamp).timestamp()
+            self.append(timestamp, record['dimensions'], record.get('trigger'))
+            
+    def _recompute(self) -> None:
+        """根据窗口内的数据重新计算滚动统计"""
+        window = self.recent(self.trend_window).astype(np.float64)
+        self._value_sum = window.sum(axis=0) if len(window) else np.zeros(len(DIMENSIONS))
+        deltas = np.diff(window, axis=0)
+        self._delta_sum = deltas.sum(axis=0) if len(deltas) else np.zeros(len(DIMENSIONS))
+        self._delta_sq_sum = (deltas * deltas).sum(axis=0) if len(deltas) else np.zeros(len(DIMENSIONS))
+        
+    def recent(self, window: int) -> np.ndarray:
+        """按时间顺序返回最近 window 个状态（window x 3）"""
+        window = min(window, self._size)
+        indices = [self._index(offset) for offset in range(window, 0, -1)]
+        return self.values[indices]
+        
+    def trend_statistics(self) -> Dict[str, Dict[str, Any]]:
+        """返回趋势窗口内各维度的变化方向、波动性和均值，O(1)"""
+        if not self._size:
+            return {}
+            
+        value_count = min(self._size, self.trend_window)
+        delta_count = value_count - 1
+        average = self._value_sum / value_count
+        if delta_count:
+            delta_mean = self._delta_sum / delta_count
+            delta_var = np.maximum(self._delta_sq_sum / delta_count - delta_mean * delta_mean, 0.0)
+        else:
+            delta_mean = np.zeros(len(DIMENSIONS))
+            delta_var = np.zeros(len(DIMENSIONS))
+            
+        return {
+            dim: {
+                'direction': 'up' if delta_mean[i] > 0 else 'down',
+                'volatility': float(np.sqrt(delta_var[i])),
+                'average': float(average[i])
+            }
+            for i, dim in enumerate(DIMENSIONS)
+        }
+        
+    def __iter__(self):
+        """按时间顺序遍历字典格式的记录"""
+        for offset in range(self._size, 0, -1):
+            i = self._index(offset)
+            yield {
+                'timestamp': datetime.datetime.fromtimestamp(self.timestamps[i]).isoformat(),
+                'dimensions': {dim: float(v) for dim, v in zip(DIMENSIONS, self.values[i])},
+                'trigger': self.triggers[i]
+            }
+            
+    def to_list(self) -> List[Dict[str, Any]]:
+        """导出为可序列化的列表"""
+        return list(self)
 
 class EmotionalState:
     def __init__(self):
@@ -13,49 +172,15 @@ class EmotionalState:
             'dominance': 0.0,    # 控制度 (-1 到 1)
         }
         
-        # 情感记忆
-        self.emotional_memory = []
+        # 情感记忆（环形缓冲区）
         self.max_memory = 100
+        self.emotional_memory = EmotionalMemory(self.max_memory)
         
-        # 情感词典
-        self.emotion_dict = {
-            '开心': {'pleasure': 0.8, 'arousal': 0.5, 'dominance': 0.6},
-            '难过': {'pleasure': -0.7, 'arousal': -0.3, 'dominance': -0.4},
-            '生气': {'pleasure': -0.6, 'arousal': 0.8, 'dominance': 0.7},
-            '害怕': {'pleasure': -0.7, 'arousal': 0.7, 'dominance': -0.8},
-            '惊讶': {'pleasure': 0.2, 'arousal': 0.8, 'dominance': 0.0},
-            '平静': {'pleasure': 0.3, 'arousal': -0.4, 'dominance': 0.2},
-        }
-        
-        # 情感响应模板
-        self.response_templates = defaultdict(list)
-        self._init_response_templates()
-        
-    def _init_response_templates(self):
-        """初始化情感响应模板"""
-        self.response_templates.update({
-            'high_pleasure': [
-                '我现在感觉很愉快！',
-                '这真是太棒了！',
-                '我很高兴能和你交流！'
-            ],
-            'low_pleasure': [
-                '这确实让人有点难过...',
-                '我能理解这种感受',
-                '让我们一起面对这个问题'
-            ],
-            'high_arousal': [
-                '这太令人兴奋了！',
-                '我现在充满干劲！',
-                '让我们积极行动起来！'
-            ],
-            'low_arousal': [
-                '我们需要冷静下来想想',
-                '让我们慢慢来',
-                '保持平和的心态很重要'
-            ]
-        })
+        # 情感词典和响应模板只读，所有会话共用同一份
+        self.emotion_dict = EMOTION_DICT
+        self.response_templates = RESPONSE_TEMPLATES
         
+    @timed('update_state')
     def update_state(self, input_text: str, context: Dict[str, Any]) -> None:
         """更新情感状态"""
         # 分析输入文本的情感倾向
@@ -128,17 +253,7 @@ class EmotionalState:
         
     def _record_emotional_state(self, trigger: str) -> None:
         """记录情感状态"""
-        state = {
-            'timestamp': datetime.datetime.now().isoformat(),
-            'dimensions': self.dimensions.copy(),
-            'trigger': trigger
-        }
-        
-        self.emotional_memory.append(state)
-        
-        # 限制记忆大小
-        if len(self.emotional_memory) > self.max_memory:
-            self.emotional_memory = self.emotional_memory[-self.max_memory:]
+        self.emotional_memory.append(time.time(), self.dimensions, trigger)
             
     def get_response(self) -> str:
         """根据当前情感状态生成响应"""
@@ -168,25 +283,70 @@ class EmotionalState:
         
     def get_emotional_trend(self, window: int = 10) -> Dict[str, List[float]]:
         """分析情感趋势"""
-        if not self.emotional_memory:
-            return {dim: [] for dim in self.dimensions}
-            
-        recent_states = self.emotional_memory[-window:]
-        trends = {dim: [] for dim in self.dimensions}
+        recent_states = self.emotional_memory.recent(window)
+        return {
+            dim: recent_states[:, i].tolist()
+            for i, dim in enumerate(DIMENSIONS)
+        }
         
-        for state in recent_states:
-            for dim, value in state['dimensions'].items():
-                trends[dim].append(value)
-                
-        return trends
+    def get_trend_statistics(self) -> Dict[str, Dict[str, Any]]:
+        """获取最近情感趋势的统计信息"""
+        return self.emotional_memory.trend_statistics()
+        
+    def export_state(self) -> Dict[str, Any]:
+        """导出情感状态（可序列化为JSON）"""
+        return {
+            'dimensions': dict(self.dimensions),
+            'emotional_memory': self.emotional_memory.to_list()
+        }
+        
+    def import_state(self, state: Dict[str, Any]) -> None:
+        """恢复导出的情感状态"""
+        self.dimensions.update(state.get('dimensions', {}))
+        self.emotional_memory = EmotionalMemory(self.max_memory)
+        self.emotional_memory.extend(state.get('emotional_memory', [])[-self.max_memory:])
+        
+    def save_state(self, filename: str):
+        """保存情感系统状态（先写临时文件再替换，其他进程不会读到写了一半的文件）"""
+        tmp = f'{filename}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.export_state(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp, filename)
+            
+    def load_state(self, filename: str):
+        """加载情感系统状态"""
+        try:
+            with open(filename, 'r', encoding='utf-8') as f:
+                self.import_state(json.load(f))
+        except FileNotFoundError:
+            pass  # 如果文件不存在，使用空白状态
 
 class SelfReflection:
-    def __init__(self, emotional_state: EmotionalState):
+    def __init__(self, emotional_state: EmotionalState, coherence_window: int = None,
+                 log_capacity: int = 200, spill_dir: str = None):
         self.emotional_state = emotional_state
-        self.reflection_log = []
-        self.learning_points = defaultdict(list)
-        self.improvement_suggestions = defaultdict(list)
         
+        # 反思日志只在内存中保留最近的记录，淘汰的记录可选写入 spill_dir
+        def spill_path(name):
+            return os.path.join(spill_dir, name) if spill_dir else None
+        self.reflection_log = RingLog(log_capacity, spill_path=spill_path('reflection_log.jsonl'))
+        self.learning_points = KeyedLog(spill_path=spill_path('learning_points.jsonl'))
+        self.improvement_suggestions = KeyedLog(spill_path=spill_path('improvement_suggestions.jsonl'))
+        
+        # 对话连贯性的流式统计：只处理新增的相邻消息对
+        self.coherence_window = coherence_window  # None 表示统计全部消息对
+        self._reset_coherence()
+        
+    def _reset_coherence(self) -> None:
+        """重置连贯性统计"""
+        self._coherence_sum = 0.0
+        self._coherence_pairs = 0
+        self._coherence_recent = deque()
+        self._coherence_recent_sum = 0.0
+        self._coherence_seen = 0          # 已处理的消息数
+        self._last_words = None           # 上一条消息的词集合缓存
+        
+    @timed('reflect')
     def reflect(self, interaction_data: Dict[str, Any]) -> Dict[str, Any]:
         """进行自我反思"""
         reflection = {
@@ -198,10 +358,7 @@ class SelfReflection:
         }
         
         # 分析情感变化
-        emotional_trend = self.emotional_state.get_emotional_trend()
-        reflection['analysis']['emotional_trend'] = self._analyze_emotional_trend(
-            emotional_trend
-        )
+        reflection['analysis']['emotional_trend'] = self.emotional_state.get_trend_statistics()
         
         # 分析交互质量
         interaction_quality = self._analyze_interaction_quality(interaction_data)
@@ -222,25 +379,6 @@ class SelfReflection:
         
         return reflection
         
-    def _analyze_emotional_trend(self, trend: Dict[str, List[float]]) -> Dict[str, Any]:
-        """分析情感趋势"""
-        analysis = {}
-        
-        for dimension, values in trend.items():
-            if not values:
-                continue
-                
-            # 计算变化率
-            changes = np.diff(values)
-            
-            analysis[dimension] = {
-                'direction': 'up' if np.mean(changes) > 0 else 'down',
-                'volatility': np.std(changes),
-                'average': np.mean(values)
-            }
-            
-        return analysis
-        
     def _analyze_interaction_quality(self, data: Dict[str, Any]) -> Dict[str, float]:
         """分析交互质量"""
         quality = {
@@ -269,23 +407,56 @@ class SelfReflection:
         return quality
         
     def _evaluate_coherence(self, chat_history: List[str]) -> float:
-        """评估对话连贯性"""
-        if len(chat_history) < 2:
-            return 1.0
+        """评估对话连贯性（增量计算，只处理上次之后新增的消息）"""
+        total = getattr(chat_history, 'total', len(chat_history))
+        if total < self._coherence_seen:
+            # 对话历史被清空或替换，重新开始统计
+            self._reset_coherence()
             
-        coherence_scores = []
-        for i in range(1, len(chat_history)):
-            prev = chat_history[i-1]
-            curr = chat_history[i]
+        new_count = total - self._coherence_seen
+        if new_count:
+            for message in chat_history[-new_count:]:
+                self.observe_message(message)
+            self._coherence_seen = total
             
+        return self.get_coherence()
+        
+    def observe_message(self, message: str) -> None:
+        """加入一条新消息，更新与上一条消息的相似度统计"""
+        words = word_set(message)
+        if self._last_words is not None:
+            union = self._last_words | words
             # 简单的文本相似度计算
-            words1 = set(prev.split())
-            words2 = set(curr.split())
-            similarity = len(words1 & words2) / len(words1 | words2) if words1 | words2 else 0
-            
-            coherence_scores.append(similarity)
+            similarity = len(self._last_words & words) / len(union) if union else 0
             
-        return sum(coherence_scores) / len(coherence_scores)
+            self._coherence_sum += similarity
+            self._coherence_pairs += 1
+            if self.coherence_window:
+                self._coherence_recent.append(similarity)
+                self._coherence_recent_sum += similarity
+                if len(self._coherence_recent) > self.coherence_window:
+                    self._coherence_recent_sum -= self._coherence_recent.popleft()
+                    
+        self._last_words = words
+        self._coherence_seen += 1
+        
+    def get_coherence(self) -> float:
+        """获取当前的对话连贯性得分"""
+        if not self._coherence_pairs:
+            return 1.0
+        if self.coherence_window:
+            return self._coherence_recent_sum / len(self._coherence_recent)
+        return self._coherence_sum / self._coherence_pairs
+        
+    def get_improvement_summary(self) -> Dict[str, Dict[str, Any]]:
+        """按改进方面汇总建议次数和最近一条建议"""
+        return self.improvement_suggestions.summary()
+        
+    def flush_logs(self) -> None:
+        """把等待中的淘汰日志写入磁盘"""
+        self.reflection_log.flush()
+        self.learning_points.flush()
+        self.improvement_suggestions.flush()
         
     def _extract_learning_points(self, data: Dict[str, Any]) -> List[Dict[str, Any]]:
         """提取学习点"""
@@ -309,7 +480,7 @@ class SelfReflection:
             
         # 记录学习点
         for learning in learnings:
-            self.learning_points[learning['type']].append(learning)
+            self.learning_points.append(learning['type'], learning)
             
         return learnings
         
@@ -323,7 +494,7 @@ class SelfReflection:
             if score < 0.6:
                 suggestion = self._get_improvement_suggestion(aspect)
                 improvements.append(suggestion)
-                self.improvement_suggestions[aspect].append(suggestion)
+                self.improvement_suggestions.append(aspect, suggestion)
                 
         # 基于学习点生成建议
         for learning in learnings:
@@ -331,7 +502,7 @@ class SelfReflection:
                 learning['type'], learning['context']
             )
             improvements.append(suggestion)
-            self.improvement_suggestions[learning['type']].append(suggestion)
+            self.improvement_suggestions.append(learning['type'], suggestion)
             
         return improvements
         
@@ -0,0 +1,153 @@
+"""网页下载：流式读取正文，跳过非网页内容，限制大小，低成本地确定字符集
+
+    page = fetch(url, max_bytes=1 << 20)
+    page.text, page.url, page.bytes, page.bytes_avoided, page.is_html
+
+- 根据 Content-Type 跳过图片、PDF、压缩包等非网页内容，不下载正文（抛出 SkippedPage）
+- text/plain 按纯文本返回（page.is_html 为 False），调用方不需要再当作 HTML 解析
+- 正文超过 max_bytes 时只保留前 max_bytes 字节并断开连接
+- 字符集依次取自 Content-Type、BOM、前几 KB 中的 <meta>，都没有时才在前 DETECT_BYTES
+  字节上运行字符集检测（requests 的 apparent_encoding 会检测整个正文，大网页上非常慢）
+"""
+import codecs
+import re
+import time
+from typing import Dict, Optional, Tuple
+
+# 会下载的内容类型，没有 Content-Type 时根据内容判断；其中只有 PLAIN_TYPES 不是 HTML
+HTML_TYPES = ('text/html', 'application/xhtml+xml', 'text/plain')
+PLAIN_TYPES = ('text/plain',)
+DEFAULT_MAX_BYTES = 1 << 20
+DETECT_BYTES = 16 * 1024
+META_BYTES = 4096
+CHUNK_SIZE = 16 * 1024
+
+HEADER_CHARSET = re.compile(r'charset\s*=\s*["\']?([\w.:-]+)', re.I)
+META_CHARSET = re.compile(rb'<meta[^>]+?charset\s*=\s*["\']?\s*([\w.:-]+)', re.I)
+BOMS = ((codecs.BOM_UTF8, 'utf-8'), (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16'))
+
+# gb2312/gbk 网页中常混有超出其范围的字符，按超集 gb18030 解码
+ENCODING_ALIASES = {'gb2312': 'gb18030', 'gbk': 'gb18030', 'x-gbk': 'gb18030'}
+
+
+class SkippedPage(Exception):
+    """内容不是网页，没有下载正文"""
+    def __init__(self, url: str, content_type: str, bytes_avoided: int = 0):
+        super().__init__(f'跳过非网页内容 {content_type or "未知类型"}: {url}')
+        self.url = url
+        self.content_type = content_type
+        self.bytes_avoided = bytes_avoided
+
+
+class Page:
+    """下载并解码后的网页"""
+    __slots__ = ('url', 'text', 'encoding', 'charset_source', 'bytes', 'truncated', 'bytes_avoided', 'is_html')
+
+    def __init__(self, url: str, text: str, encoding: str, charset_source: str,
+                 size: int, truncated: bool, bytes_avoided: int, is_html: bool = True):
+        self.url = url
+        self.text = text
+        self.encoding = encoding
+        self.charset_source = charset_source  # header、bom、meta、detect 或 default
+        self.bytes = size
+        self.truncated = truncated
+        self.bytes_avoided = bytes_avoided
+        self.is_html = is_html  # False 表示纯文本，不需要解析标签
+
+
+def _valid_encoding(name: Optional[str]) -> Optional[str]:
+    if not name:
+        return None
+    name = name.strip().lower()
+    name = ENCODING_ALIASES.get(name, name)
+    try:
+        codecs.lookup(name)
+    except LookupError:
+        return None
+    return name
+
+
+def header_charset(content_type: str) -> Optional[str]:
+    """Content-Type 中明确给出的字符集（不使用 HTTP 规范中 text/* 默认的 ISO-8859-1）"""
+    match = HEADER_CHARSET.search(content_type or '')
+    return _valid_encoding(match.group(1)) if match else None
+
+
+def sniff_charset(body: bytes) -> Tuple[str, str]:
+    """根据正文开头确定字符集，返回 (字符集, 来源)"""
+    for bom, encoding in BOMS:
+        if body.startswith(bom):
+            return encoding, 'bom'
+    match = META_CHARSET.search(body[:META_BYTES])
+    encoding = _valid_encoding(match.group(1).decode('ascii', 'ignore')) if match else None
+    if encoding:
+        return encoding, 'meta'
+    prefix = body[:DETECT_BYTES]
+    # 在最后一个标签处截断，避免切开多字节字符（否则检测结果不可靠）
+    cut = prefix.rfind(b'<')
+    if len(prefix) < len(body) and cut > len(prefix) // 2:
+        prefix = prefix[:cut]
+    try:
+        prefix.decode('utf-8')
+        return 'utf-8', 'detect'
+    except UnicodeDecodeError:
+        pass
+    from requests.compat import chardet
+    encoding = _valid_encoding((chardet.detect(prefix) or {}).get('encoding'))
+    return (encoding, 'detect') if encoding else ('utf-8', 'default')
+
+
+def decode(body: bytes, content_type: str = '') -> Tuple[str, str, str]:
+    """解码正文，返回 (文本, 字符集, 来源)"""
+    encoding = header_charset(content_type)
+    source = 'header'
+    if encoding is None:
+        encoding, source = sniff_charset(body)
+    return body.decode(encoding, errors='replace'), encoding, source
+
+
+def _media_type(content_type: str) -> str:
+    return (content_type or '').split(';', 1)[0].strip().lower()
+
+
+def is_html_type(content_type: str) -> bool:
+    media_type = _media_type(content_type)
+    return not media_type or media_type in HTML_TYPES
+
+
+def fetch(url: str, max_bytes: int = DEFAULT_MAX_BYTES, timeout: float = 10.0,
+          headers: Dict[str, str] = None, session=None) -> Page:
+    """下载网页；非网页内容抛出 SkippedPage，HTTP 错误抛出 requests.HTTPError
+
+    timeout 是连接和每次读取的超时，整个下载另外不超过 3 * timeout 秒。
+    """
+    import requests
+    deadline = time.monotonic() + 3 * timeout
+    response = (session or requests).get(url, headers=headers, timeout=timeout, stream=True)
+    try:
+        response.raise_for_status()
+        content_type = response.headers.get('Content-Type', '')
+        length = response.headers.get('Content-Length')
+        length = int(length) if length and length.isdigit() else None
+        if not is_html_type(content_type):
+            raise SkippedPage(response.url, content_type, length or 0)
+
+        chunks, size, truncated = [], 0, False
+        for chunk in response.iter_content(CHUNK_SIZE):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= max_bytes:
+                truncated = size > max_bytes or (length or 0) > max_bytes
+                break
+            if time.monotonic() > deadline:
+                raise requests.Timeout(f'下载超过 {3 * timeout:g} 秒: {url}')
+        body = b''.join(chunks)[:max_bytes]
+        if not content_type and b'\x00' in body[:1024]:
+            raise SkippedPage(response.url, content_type, max(0, (length or 0) - size))
+    finally:
+        response.close()
+
+    text, encoding, source = decode(body, content_type)
+    avoided = max(0, length - len(body)) if truncated and length else 0
+    return Page(response.url, text, encoding, source, size, truncated, avoided,
+                _media_type(content_type) not in PLAIN_TYPES)
@@ -0,0 +1,71 @@
+"""gunicorn 配置：预加载模式
+
+master 进程先导入 app.py，构建以读为主的共享数据（知识库、问答索引、长期记忆、意图路由、
+jieba 词典），然后 fork 出各 worker，这些数据按写时复制在 worker 之间共享；
+自我优化等后台线程在 fork 之后由各 worker 自己启动。
+
+master 中先关闭 GC，fork 前用 gc.freeze() 把已有对象移出 GC 的跟踪范围，
+worker 中的垃圾回收不会再写这些对象的头部，共享的内存页不会因此被复制。
+
+    gunicorn -c gunicorn.conf.py app:app
+    gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi_app:app
+
+设置 BOT_PRELOAD=0 关闭预加载，每个 worker 各自导入 app.py。
+
+设置 BOT_STATE_SOCKET 时，master 在加载应用之前启动本地状态服务（state_service.py，
+已经在运行时直接使用），各 worker 共用同一份长期记忆、知识库和会话状态；gunicorn 退出时停止服务。
+
+worker 退出时关闭后台任务调度器（scheduler.py），运行中的任务结束后保存状态。
+没有状态服务时每个 worker 都会保存：教学问答、长期记忆和自我优化记录在文件锁内与已有内容合并，
+情感状态以最后退出的 worker 为准（见 SimpleBot.flush_state）。
+"""
+import gc
+import os
+import sys
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# 下面的 BOT_PRELOAD、BOT_STATE_SOCKET 以及应用导入时读取的配置都可以写在 .env 中
+load_dotenv()
+
+preload_app = os.environ.get('BOT_PRELOAD', '1') != '0'
+
+if preload_app:
+    # app.py 据此只构建共享数据，不启动后台线程
+    os.environ['BOT_PRELOAD'] = '1'
+    # 加载期间不做垃圾回收，避免在共享的内存页中留下空洞
+    gc.disable()
+
+state_daemon = None
+if os.environ.get('BOT_STATE_SOCKET'):
+    import state_service
+    state_daemon = state_service.spawn(os.environ['BOT_STATE_SOCKET'])
+
+
+def pre_fork(server, worker):
+    if preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    if not preload_app:
+        return
+    gc.enable()
+    # asgi_app.py 也导入了 app.py，两种服务都由 app.post_fork 启动后台线程
+    app_module = sys.modules.get('app')
+    if app_module is not None:
+        app_module.post_fork()
+
+
+def worker_exit(server, worker):
+    # 停止后台任务（学习、自我分析），等待它们在检查点退出后保存状态
+    from scheduler import SCHEDULER
+    SCHEDULER.shutdown()
+
+
+def on_exit(server):
+    if state_daemon is not None:
+        # 状态服务收到 SIGTERM 后写入状态文件再退出
+        state_daemon.terminate()
+        state_daemon.wait(30)
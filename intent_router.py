@@ -0,0 +1,109 @@
+import re
+import time
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from metrics import REGISTRY
+
+INTENT_SECONDS = REGISTRY.histogram('bot_intent_duration_seconds', '各意图处理函数的耗时', ['intent'])
+
+
+class IntentRouter:
+    """意图路由表：启动时构建一次，先查精确匹配哈希表，再用单个合并的正则进行匹配"""
+    def __init__(self):
+        self._exact = {}      # 归一化消息 -> 意图名
+        self._patterns = []   # (意图名, 正则表达式)
+        self._handlers = {}   # 意图名 -> 处理函数或固定回复
+        self._regex = None
+        self._group_spans = {}  # 合并正则中的分组名 -> (意图名, 首个子分组序号, 子分组数量)
+        self._lock = threading.Lock()
+        self.hits = Counter()
+        self.latency = {}   # 意图名 -> 耗时直方图
+
+    def register_exact(self, name: str, keys, handler: Any) -> None:
+        """注册精确匹配意图，handler 可以是固定回复或函数（参数为 route 传入的上下文）"""
+        if isinstance(keys, str):
+            keys = [keys]
+        with self._lock:
+            for key in keys:
+                self._exact[key.lower()] = name
+            self._add_handler(name, handler)
+
+    def register_pattern(self, name: str, pattern: str, handler: Callable[..., str]) -> None:
+        """注册正则意图，handler 依次接收 route 传入的上下文和正则中各捕获分组的内容"""
+        re.compile(pattern)  # 提前暴露错误的正则
+        with self._lock:
+            self._patterns.append((name, pattern))
+            self._add_handler(name, handler)
+            self._compile()
+
+    def _add_handler(self, name: str, handler: Any) -> None:
+        self._handlers[name] = handler
+        self.latency.setdefault(name, INTENT_SECONDS.labels(name))
+
+    def _compile(self) -> None:
+        """把所有正则意图合并为一个交替正则"""
+        parts = []
+        self._group_spans = {}
+        group_index = 1
+        for i, (name, pattern) in enumerate(self._patterns):
+            group_name = f'_intent{i}'
+            inner_groups = re.compile(pattern).groups
+            self._group_spans[group_name] = (name, group_index + 1, inner_groups)
+            parts.append(f'(?P<{group_name}>{pattern})')
+            group_index += inner_groups + 1
+        self._regex = re.compile('|'.join(parts)) if parts else None
+
+    def match(self, message: str) -> Optional[Tuple[str, Tuple[str, ...]]]:
+        """匹配意图，返回 (意图名, 捕获分组)；未命中返回 None
+
+        精确匹配优先；正则意图取消息中最靠左的匹配，位置相同时按注册顺序。
+        """
+        name = self._exact.get(message.lower())
+        if name is not None:
+            return name, ()
+
+        regex = self._regex
+        if regex is None:
+            return None
+        m = regex.search(message)
+        if not m:
+            return None
+        name, first, count = self._group_spans[m.lastgroup]
+        groups = tuple((m.group(i) or '').strip() for i in range(first, first + count))
+        return name, groups
+
+    def route(self, message: str, *context) -> Optional[str]:
+        """分发消息到对应意图，未命中任何意图时返回 None
+
+        context 会作为处理函数的前置参数传入，便于多个会话共用同一张路由表。
+        """
+        matched = self.match(message)
+        if matched is None:
+            return None
+        name, groups = matched
+        handler = self._handlers[name]
+
+        start = time.perf_counter()
+        try:
+            return handler(*context, *groups) if callable(handler) else handler
+        finally:
+            self.latency[name].observe(time.perf_counter() - start)
+            with self._lock:
+                self.hits[name] += 1
+
+    def intents(self) -> List[str]:
+        """列出已注册的意图"""
+        return list(self._handlers)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取各意图的命中次数和延迟分布"""
+        with self._lock:
+            return {
+                name: {
+                    'hits': self.hits[name],
+                    'latency': self.latency[name].to_dict()
+                }
+                for name in self._handlers
+            }
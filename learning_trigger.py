@@ -0,0 +1,224 @@
+"""自主学习的触发层：把“遇到不会的问题就去学习”收敛为按主题调度的学习任务
+
+- 消息先归一化为主题键（全角转半角、去掉标点和“什么是”“吗”等问句成分），
+  “什么是机器学习？”和“机器学习是什么”是同一个主题
+- 同一主题同时只有一个学习任务，后来的触发直接返回“正在学习”（single-flight）
+- 不同主题排队由调度器中的一个学习任务依次学习（见 scheduler.py），队列满时直接拒绝，
+  爬虫负载只与不同主题的数量有关
+- 学习完成后在 BOT_KNOWLEDGE_TTL 内直接用知识库回答；过期后先返回旧知识，同时在后台重新学习
+- 没有学到内容的主题在 BOT_LEARN_NEGATIVE_TTL 内不再重新学习（负缓存）
+
+配置（环境变量）：
+    BOT_KNOWLEDGE_TTL       学到的知识多少秒内视为新鲜（默认 86400）
+    BOT_LEARN_NEGATIVE_TTL  没有学到内容的主题多少秒内不再学习（默认 600）
+    BOT_LEARN_QUEUE         等待学习的主题数上限（默认 16）
+"""
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from metrics import REGISTRY
+from scheduler import SCHEDULER, LEARNING, TaskCancelled
+
+LEARN_TRIGGERS = REGISTRY.counter('bot_learning_triggers_total', '自主学习触发的处理结果', ['outcome'])
+
+# 触发学习的指令前缀，以及问句中不属于主题的成分
+TOPIC_PREFIX = re.compile(r'^(?:请|我想|帮我)*(?:自主学习|告诉我关于|学习一下|学习)')
+QUESTION_PREFIX = re.compile(r'^(?:请问|请|你知道|我想知道|能不能|可以)*(?:什么是|什么叫|啥是)?')
+QUESTION_SUFFIX = re.compile(r'(?:是什么|是啥|是什么意思|什么意思|怎么样|有哪些|的知识|的内容)?'
+                             r'(?:吗|呢|啊|吧|呀)*$')
+NON_WORD = re.compile(r'[\W_]+')
+
+# 负缓存最多保留的主题数，超出时淘汰最早加入的
+MAX_NEGATIVE_TOPICS = 1024
+# 最多记录多少个主题的学习完成时间，超出时淘汰最早学完的；
+# 被淘汰的主题与启动时从文件加载的知识一样视为新鲜，下次学习后重新计时
+MAX_LEARNED_TOPICS = 4096
+
+
+def topic_key(message: str) -> str:
+    """把消息归一化为主题键，无法得到主题时返回空字符串"""
+    text = unicodedata.normalize('NFKC', message).lower()
+    text = TOPIC_PREFIX.sub('', text, count=1)
+    text = NON_WORD.sub('', text)
+    text = QUESTION_PREFIX.sub('', text, count=1)
+    return QUESTION_SUFFIX.sub('', text, count=1)
+
+
+class LearningTrigger:
+    def __init__(self, learner, ttl: float = None, negative_ttl: float = None, max_pending: int = None,
+                 seed_urls: Callable[[str], List[str]] = None, clock: Callable[[], float] = time.monotonic):
+        self.learner = learner
+        self.ttl = float(os.environ.get('BOT_KNOWLEDGE_TTL', 86400)) if ttl is None else ttl
+        self.negative_ttl = (float(os.environ.get('BOT_LEARN_NEGATIVE_TTL', 600))
+                             if negative_ttl is None else negative_ttl)
+        self.max_pending = int(os.environ.get('BOT_LEARN_QUEUE', 16)) if max_pending is None else max_pending
+        self.seed_urls = seed_urls  # 主题 -> 起始网址，默认使用 WebLearner 的搜索引擎
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._pending = OrderedDict()  # 等待学习的主题键 -> (是否为后台刷新, 用户的 OpenAI 密钥)
+        self._current = None           # 正在学习的主题键
+        self._task = None              # 调度器中依次学习排队主题的任务
+        self._learned_at = OrderedDict()  # 主题键 -> 学习完成的时间
+        self._negative = OrderedDict()  # 主题键 -> 负缓存过期时间
+        self.jobs = 0                  # 实际启动的学习任务数
+
+    # ------------------------------------------------------------ 触发
+
+    def request(self, message: str, force: bool = False, api_key: str = None) -> Optional[str]:
+        """处理一次学习触发，返回回复；无法从消息中得到主题时返回 None
+
+        force=True（用户明确要求学习）时忽略知识的新鲜度和负缓存，但仍与进行中的同一主题合并。
+        api_key 为触发学习的会话携带的 OpenAI 密钥，学习该主题时用于生成摘要。
+        """
+        key = topic_key(message)
+        if not key:
+            return None
+        if self.learner.offline:
+            LEARN_TRIGGERS.labels('offline').inc()
+            return f"我现在处于离线模式，暂时无法学习关于{key}的知识。"
+
+        now = self.clock()
+        with self._lock:
+            knowledge = self.learner.knowledge_base.get(key)
+            if knowledge and not force:
+                if now - self._learned_at.get(key, now) < self.ttl:
+                    LEARN_TRIGGERS.labels('fresh').inc()
+                    return knowledge
+                # 知识已过期：先用旧知识回答，同时在后台重新学习
+                self._enqueue(key, refresh=True, api_key=api_key)
+                LEARN_TRIGGERS.labels('stale').inc()
+                return knowledge
+
+            if key == self._current or key in self._pending:
+                LEARN_TRIGGERS.labels('joined').inc()
+                return f"我正在学习{key}，学完后再问我吧。"
+
+            expires = self._negative.get(key)
+            if expires is not None and not force:
+                if now < expires:
+                    LEARN_TRIGGERS.labels('negative').inc()
+                    return f"我最近学习过{key}，但没有找到有用的资料，过一会儿再问我吧。"
+                del self._negative[key]
+
+            if not self._enqueue(key, api_key=api_key):
+                LEARN_TRIGGERS.labels('busy').inc()
+                return "我现在要学的东西太多了，请稍后再问我。"
+            ahead = len(self._pending) - 1 + (self._current is not None)
+        if ahead:
+            LEARN_TRIGGERS.labels('queued').inc()
+            return f"我已经把{key}加入学习计划，前面还有{ahead}个主题。"
+        LEARN_TRIGGERS.labels('started').inc()
+        return f"我开始学习{key}了！我会自动浏览网页并学习相关知识..."
+
+    def status(self, message: str) -> str:
+        """查询某个主题的学习状态"""
+        key = topic_key(message) or message
+        with self._lock:
+            if key == self._current:
+                return f"我正在学习关于{key}的知识，已经访问了{len(self.learner.visited_urls)}个网页..."
+            if key in self._pending:
+                return f"{key}已经在学习计划中，还没有开始学习。"
+            if key in self.learner.knowledge_base:
+                return f"我已经学习完成！以下是我学到的知识：\n\n{self.learner.knowledge_base[key]}"
+            if key in self._negative and self.clock() < self._negative[key]:
+                return f"我学习过{key}，但没有找到有用的资料。"
+        return f"我还没有学习过关于{key}的知识。"
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                'current': self._current,
+                'pending': list(self._pending),
+                'jobs': self.jobs,
+                'learned': len(self._learned_at),
+                'negative': len(self._negative),
+            }
+
+    def wait(self, timeout: float = None) -> bool:
+        """等待所有排队的学习结束，超时返回 False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                task = self._task
+            if task is None or task.done:
+                return True
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            task.wait(remaining)
+
+    # ------------------------------------------------------------ 调度
+
+    def _enqueue(self, key: str, refresh: bool = False, api_key: str = None) -> bool:
+        """把主题加入学习队列（调用方持有锁），队列已满时返回 False"""
+        if key == self._current or key in self._pending:
+            return True
+        if len(self._pending) >= self.max_pending:
+            return False
+        self._pending[key] = (refresh, api_key)
+        if self._task is None or self._task.done:
+            self._task = SCHEDULER.submit(self._run, name='learning-trigger', cls=LEARNING)
+        return True
+
+    def _run(self):
+        """调度器中的学习任务：依次学习排队的主题，队列清空后结束"""
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._task = None
+                    return
+                key, (refresh, api_key) = self._pending.popitem(last=False)
+                self._current = key
+            try:
+                started = self._learn(key, refresh, api_key)
+            except TaskCancelled:
+                with self._lock:
+                    self._current = None
+                    self._task = None
+                raise
+            except Exception as e:
+                started = True
+                print(f"学习{key}时出错: {e}")
+            with self._lock:
+                self._current = None
+                if not started:
+                    # 用户通过“自主学习xxx”直接启动的学习还没结束：放回队首，让出学习任务的名额，稍后再试
+                    self._pending[key] = (refresh, api_key)
+                    self._pending.move_to_end(key, last=False)
+                    self._task = SCHEDULER.submit(self._run, name='learning-trigger', cls=LEARNING, delay=1.0)
+                    return
+
+    def _learn(self, key: str, refresh: bool, api_key: str = None) -> bool:
+        """在当前任务中学习一个主题，有其他学习在进行时返回 False"""
+        learner = self.learner
+        seeds = self.seed_urls(key) if self.seed_urls else None
+        if not learner.try_start_learning(key, seeds, background=False, api_key=api_key):
+            return False
+        self.jobs += 1
+
+        now = self.clock()
+        with self._lock:
+            if learner.stats.get('summarized'):
+                self._set_learned_at(key, now)
+                self._negative.pop(key, None)
+            elif refresh and key in learner.knowledge_base:
+                # 刷新没有学到新内容：保留旧知识，过一段时间再试
+                self._set_learned_at(key, now - self.ttl + self.negative_ttl)
+            else:
+                self._negative[key] = now + self.negative_ttl
+                self._negative.move_to_end(key)
+                while len(self._negative) > MAX_NEGATIVE_TOPICS:
+                    self._negative.popitem(last=False)
+        return True
+
+    def _set_learned_at(self, key: str, when: float):
+        """记录主题的学习完成时间（调用方持有 _lock）"""
+        self._learned_at[key] = when
+        self._learned_at.move_to_end(key)
+        while len(self._learned_at) > MAX_LEARNED_TOPICS:
+            self._learned_at.popitem(last=False)
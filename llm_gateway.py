@@ -0,0 +1,500 @@
+"""大模型调用网关：所有 OpenAI 请求都经过这里
+
+    from llm_gateway import chat, LLMError
+    try:
+        text = chat([{'role': 'user', 'content': '...'}], caller='summary')
+    except LLMError:
+        ...  # 使用降级方案
+
+- 复用同一个客户端和 HTTP 连接池（openai 1.x + httpx）；请求中携带的用户密钥各用一个客户端
+- 全局并发上限和按调用方的并发上限，排队超时后直接失败，不会让后台线程无限期卡住
+- 每次请求有超时，超时、连接错误、429 和 5xx 按带抖动的指数退避重试（429 至少等待 Retry-After），
+  总耗时不超过截止时间
+- 相同参数的请求正在进行时，后来的调用直接等待同一个结果（single-flight）
+- chat_stream 以流式请求逐段返回回复，用于边生成边发送给用户的场景
+- achat_stream 是异步版本（AsyncOpenAI）：在事件循环中 await 大模型的响应，等待期间不占用线程
+- 记录请求耗时、结果、重试、合并次数和 token 用量（见 metrics.REGISTRY）
+
+配置（环境变量）：
+    OPENAI_API_KEY / OPENAI_BASE_URL  API 密钥和地址（base_url 可以指向 tools/llm_stub.py 启动的本地模拟服务）
+    BOT_LLM_TIMEOUT                   单次请求超时秒数（默认 30）
+    BOT_LLM_DEADLINE                  包括排队和重试在内的总时限（默认 90）
+    BOT_LLM_CONCURRENCY               全局并发上限（默认 8）
+    BOT_LLM_RETRIES                   最多重试次数（默认 2）
+"""
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from metrics import REGISTRY, track
+
+DEFAULT_MODEL = 'gpt-3.5-turbo'
+
+# 最多为多少个用户密钥保留客户端（超出时丢弃最久未用的）
+MAX_KEY_CLIENTS = 32
+
+# 按调用方的并发上限（未列出的调用方只受全局上限约束）
+DEFAULT_CALLER_LIMITS = {
+    'summary': 4,   # WebLearner 生成学习摘要
+    'optimize': 1,  # 自我优化生成优化代码（后台线程）
+    'feature': 2,   # 用户请求生成新功能
+}
+
+LLM_SECONDS = REGISTRY.histogram('bot_llm_request_duration_seconds', '大模型请求耗时（含重试）',
+                                 ['caller', 'outcome'])
+LLM_RETRIES = REGISTRY.counter('bot_llm_retries_total', '大模型请求的重试次数', ['caller'])
+LLM_COALESCED = REGISTRY.counter('bot_llm_coalesced_total', '与进行中的相同请求合并的次数', ['caller'])
+LLM_TOKENS = REGISTRY.counter('bot_llm_tokens_total', '大模型 token 用量', ['caller', 'kind'])
+LLM_IN_FLIGHT = REGISTRY.gauge('bot_llm_in_flight', '正在进行的大模型请求数', ['caller'])
+
+
+class LLMError(Exception):
+    """大模型请求失败
+
+    kind：unavailable（未配置或离线）、busy（排队超时）、timeout（请求超时）、error（其他错误）
+    """
+    def __init__(self, message: str, kind: str = 'error', retryable: bool = False, retry_after: float = None):
+        super().__init__(message)
+        self.kind = kind
+        self.retryable = retryable
+        self.retry_after = retry_after  # 服务端要求的最短等待秒数（429 的 Retry-After）
+
+
+class _Call:
+    """一次进行中的请求，相同参数的调用共享它的结果"""
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class LLMGateway:
+    def __init__(self, api_key: str = None, base_url: str = None, model: str = DEFAULT_MODEL,
+                 timeout: float = 30.0, deadline: float = 90.0, max_concurrency: int = 8,
+                 caller_limits: Dict[str, int] = None, max_retries: int = 2,
+                 backoff: float = 0.5, max_backoff: float = 8.0):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._caller_slots = {caller: threading.BoundedSemaphore(limit)
+                              for caller, limit in (caller_limits or DEFAULT_CALLER_LIMITS).items()}
+        self._lock = threading.Lock()
+        self._client = None
+        self._key_clients = OrderedDict()  # 用户密钥 -> 客户端
+        # 异步客户端的连接池属于创建它的事件循环：事件循环 -> {密钥: 异步客户端}
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._in_flight = {}  # 请求摘要 -> _Call
+
+    @classmethod
+    def from_env(cls) -> 'LLMGateway':
+        return cls(
+            api_key=os.environ.get('OPENAI_API_KEY') or None,
+            base_url=os.environ.get('OPENAI_BASE_URL') or None,
+            timeout=float(os.environ.get('BOT_LLM_TIMEOUT', 30)),
+            deadline=float(os.environ.get('BOT_LLM_DEADLINE', 90)),
+            max_concurrency=int(os.environ.get('BOT_LLM_CONCURRENCY', 8)),
+            max_retries=int(os.environ.get('BOT_LLM_RETRIES', 2)),
+        )
+
+    def configure(self, api_key: str = None, base_url: str = None) -> None:
+        """更换 API 密钥或地址，下一次请求时重新创建客户端
+
+        旧客户端不在这里关闭：其他线程可能还在用它发送请求，请求结束后没有引用时由垃圾回收关闭连接。
+        """
+        with self._lock:
+            if api_key is not None:
+                self.api_key = api_key
+            if base_url is not None:
+                self.base_url = base_url
+                self._key_clients = OrderedDict()
+            self._client = None
+            self._async_clients = weakref.WeakKeyDictionary()
+
+    @property
+    def available(self) -> bool:
+        """是否可以发出请求（已配置密钥且没有处于离线模式）"""
+        return bool(self.api_key) and os.environ.get('BOT_OFFLINE') != '1'
+
+    def _new_client(self, api_key: str, asynchronous: bool = False):
+        import httpx
+        import openai
+        # 连接池大小与并发上限一致；重试由网关自己处理
+        limits = httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency)
+        if asynchronous:
+            return openai.AsyncOpenAI(api_key=api_key, base_url=self.base_url, timeout=self.timeout,
+                                      max_retries=0, http_client=httpx.AsyncClient(limits=limits))
+        return openai.OpenAI(api_key=api_key, base_url=self.base_url,
+                             timeout=self.timeout, max_retries=0, http_client=httpx.Client(limits=limits))
+
+    def _get_client(self, api_key: str = None):
+        with self._lock:
+            if not api_key or api_key == self.api_key:
+                if self._client is None:
+                    self._client = self._new_client(self.api_key)
+                return self._client
+            client = self._key_clients.get(api_key)
+            if client is None:
+                client = self._key_clients[api_key] = self._new_client(api_key)
+                while len(self._key_clients) > MAX_KEY_CLIENTS:
+                    self._key_clients.popitem(last=False)
+            else:
+                self._key_clients.move_to_end(api_key)
+            return client
+
+    def _get_async_client(self, api_key: str = None):
+        """当前事件循环使用的异步客户端（在事件循环中调用）"""
+        loop = asyncio.get_running_loop()
+        api_key = api_key or self.api_key
+        with self._lock:
+            clients = self._async_clients.get(loop)
+            if clients is None:
+                clients = self._async_clients[loop] = OrderedDict()
+            client = clients.get(api_key)
+            if client is None:
+                client = clients[api_key] = self._new_client(api_key, asynchronous=True)
+                while len(clients) > MAX_KEY_CLIENTS:
+                    clients.popitem(last=False)
+            else:
+                clients.move_to_end(api_key)
+            return client
+
+    def chat(self, messages: List[Dict[str, str]], caller: str = 'default', model: str = None,
+             timeout: float = None, api_key: str = None, **params) -> str:
+        """发送对话请求并返回回复文本，失败时抛出 LLMError
+
+        api_key 为请求中携带的用户密钥，为空时使用网关配置的密钥。
+        """
+        self._check_available(api_key)
+        model = model or self.model
+        # 不同密钥的请求不合并：一个用户的密钥无效时不影响其他用户
+        key = hashlib.sha1(json.dumps([model, messages, params, api_key or ''], sort_keys=True,
+                                      ensure_ascii=False).encode('utf-8')).hexdigest()
+        deadline = time.monotonic() + self.deadline
+
+        with self._lock:
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = self._in_flight[key] = _Call()
+        if not leader:
+            LLM_COALESCED.labels(caller).inc()
+            if not call.done.wait(max(0.0, deadline - time.monotonic())):
+                raise LLMError('等待相同请求的结果超时', 'timeout')
+            if call.error is not None:
+                raise LLMError(str(call.error), call.error.kind)
+            return call.result
+
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            call.result = self._request(messages, caller, model, timeout, deadline, params, api_key)
+            outcome = 'ok'
+            return call.result
+        except LLMError as e:
+            call.error = e
+            outcome = e.kind
+            raise
+        except Exception as e:
+            call.error = LLMError(f'{type(e).__name__}: {e}')
+            raise call.error from e
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            call.done.set()
+            LLM_SECONDS.labels(caller, outcome).observe(time.perf_counter() - started)
+
+    def chat_stream(self, messages: List[Dict[str, str]], caller: str = 'default', model: str = None,
+                    timeout: float = None, api_key: str = None, **params) -> Iterator[str]:
+        """发送流式对话请求，收到一段回复就返回一段，失败时抛出 LLMError
+
+        只在收到第一段之前重试；流式请求不与其他请求合并。调用方提前关闭生成器时断开连接。
+        """
+        self._check_available(api_key)
+        model = model or self.model
+        deadline = time.monotonic() + self.deadline
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            with self._slot(caller, deadline):
+                client = self._get_client(api_key)
+                attempt = 0
+                received = False
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise LLMError('大模型请求超时（超过总时限）', 'timeout')
+                    try:
+                        with track('openai'):
+                            stream = client.chat.completions.create(
+                                model=model, messages=messages, stream=True,
+                                timeout=min(timeout or self.timeout, remaining), **params
+                            )
+                        with contextlib.closing(stream):
+                            for chunk in stream:
+                                delta = chunk.choices[0].delta.content if chunk.choices else None
+                                if delta:
+                                    received = True
+                                    yield delta
+                        break
+                    except Exception as e:
+                        error = self._classify(e)
+                        if received or not error.retryable or attempt >= self.max_retries:
+                            raise error from e
+                        delay = self._retry_delay(attempt, error)
+                        if time.monotonic() + delay >= deadline:
+                            raise error from e
+                        attempt += 1
+                        LLM_RETRIES.labels(caller).inc()
+                        time.sleep(delay)
+            outcome = 'ok'
+        except LLMError as e:
+            outcome = e.kind
+            raise
+        except GeneratorExit:
+            outcome = 'closed'
+            raise
+        finally:
+            LLM_SECONDS.labels(caller, outcome).observe(time.perf_counter() - started)
+
+    async def achat_stream(self, messages: List[Dict[str, str]], caller: str = 'default', model: str = None,
+                           timeout: float = None, api_key: str = None, **params) -> AsyncIterator[str]:
+        """chat_stream 的异步版本：在事件循环中 await 流式响应，并发上限、重试和时限与 chat_stream 相同"""
+        self._check_available(api_key)
+        model = model or self.model
+        deadline = time.monotonic() + self.deadline
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            async with self._aslot(caller, deadline):
+                client = self._get_async_client(api_key)
+                attempt = 0
+                received = False
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise LLMError('大模型请求超时（超过总时限）', 'timeout')
+                    try:
+                        with track('openai'):
+                            stream = await client.chat.completions.create(
+                                model=model, messages=messages, stream=True,
+                                timeout=min(timeout or self.timeout, remaining), **params
+                            )
+                        try:
+                            async for chunk in stream:
+                                delta = chunk.choices[0].delta.content if chunk.choices else None
+                                if delta:
+                                    received = True
+                                    yield delta
+                        finally:
+                            await stream.close()
+                        break
+                    except Exception as e:
+                        error = self._classify(e)
+                        if received or not error.retryable or attempt >= self.max_retries:
+                            raise error from e
+                        delay = self._retry_delay(attempt, error)
+                        if time.monotonic() + delay >= deadline:
+                            raise error from e
+                        attempt += 1
+                        LLM_RETRIES.labels(caller).inc()
+                        await asyncio.sleep(delay)
+            outcome = 'ok'
+        except LLMError as e:
+            outcome = e.kind
+            raise
+        except (GeneratorExit, asyncio.CancelledError):
+            outcome = 'closed'
+            raise
+        finally:
+            LLM_SECONDS.labels(caller, outcome).observe(time.perf_counter() - started)
+
+    def _check_available(self, api_key: str = None) -> None:
+        if os.environ.get('BOT_OFFLINE') == '1':
+            raise LLMError('离线模式', 'unavailable')
+        if not (api_key or self.api_key):
+            raise LLMError('未配置 OpenAI API 密钥', 'unavailable')
+
+    def _acquire(self, semaphore: Optional[threading.BoundedSemaphore], deadline: float) -> bool:
+        if semaphore is None:
+            return True
+        return semaphore.acquire(timeout=max(0.0, deadline - time.monotonic()))
+
+    @contextlib.contextmanager
+    def _slot(self, caller: str, deadline: float):
+        """占用调用方和全局的并发名额，排队超过截止时间时抛出 LLMError"""
+        caller_slot = self._caller_slots.get(caller)
+        if not self._acquire(caller_slot, deadline):
+            raise LLMError(f'{caller} 的并发请求过多，排队超时', 'busy')
+        try:
+            if not self._acquire(self._slots, deadline):
+                raise LLMError('大模型并发请求过多，排队超时', 'busy')
+            in_flight = LLM_IN_FLIGHT.labels(caller)
+            in_flight.inc()
+            try:
+                yield
+            finally:
+                in_flight.dec()
+                self._slots.release()
+        finally:
+            if caller_slot is not None:
+                caller_slot.release()
+
+    async def _aacquire(self, semaphore: Optional[threading.BoundedSemaphore], deadline: float) -> bool:
+        """异步等待并发名额：名额已满时轮询等待，不阻塞事件循环，也不占用线程"""
+        if semaphore is None:
+            return True
+        delay = 0.001
+        while not semaphore.acquire(blocking=False):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.05)
+        return True
+
+    @contextlib.asynccontextmanager
+    async def _aslot(self, caller: str, deadline: float):
+        """_slot 的异步版本，与同步请求共用同一组并发名额"""
+        caller_slot = self._caller_slots.get(caller)
+        if not await self._aacquire(caller_slot, deadline):
+            raise LLMError(f'{caller} 的并发请求过多，排队超时', 'busy')
+        try:
+            if not await self._aacquire(self._slots, deadline):
+                raise LLMError('大模型并发请求过多，排队超时', 'busy')
+            in_flight = LLM_IN_FLIGHT.labels(caller)
+            in_flight.inc()
+            try:
+                yield
+            finally:
+                in_flight.dec()
+                self._slots.release()
+        finally:
+            if caller_slot is not None:
+                caller_slot.release()
+
+    def _request(self, messages, caller: str, model: str, timeout: Optional[float],
+                 deadline: float, params: Dict[str, Any], api_key: str = None) -> str:
+        with self._slot(caller, deadline):
+            return self._request_with_retries(messages, caller, model, timeout, deadline, params, api_key)
+
+    def _request_with_retries(self, messages, caller: str, model: str, timeout: Optional[float],
+                              deadline: float, params: Dict[str, Any], api_key: str = None) -> str:
+        client = self._get_client(api_key)
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise LLMError('大模型请求超时（超过总时限）', 'timeout')
+            try:
+                with track('openai'):
+                    response = client.chat.completions.create(
+                        model=model, messages=messages,
+                        timeout=min(timeout or self.timeout, remaining), **params
+                    )
+            except Exception as e:
+                error = self._classify(e)
+                if not error.retryable or attempt >= self.max_retries:
+                    raise error from e
+                delay = self._retry_delay(attempt, error)
+                if time.monotonic() + delay >= deadline:
+                    raise error from e
+                attempt += 1
+                LLM_RETRIES.labels(caller).inc()
+                time.sleep(delay)
+                continue
+
+            usage = getattr(response, 'usage', None)
+            if usage is not None:
+                LLM_TOKENS.labels(caller, 'prompt').inc(usage.prompt_tokens or 0)
+                LLM_TOKENS.labels(caller, 'completion').inc(usage.completion_tokens or 0)
+            return response.choices[0].message.content or ''
+
+    def _retry_delay(self, attempt: int, error: LLMError) -> float:
+        """全抖动指数退避：在 [0, backoff * 2^attempt] 中随机等待；服务端给出 Retry-After 时以它为下限"""
+        return (error.retry_after or 0.0) + random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    @staticmethod
+    def _classify(error: Exception) -> LLMError:
+        """把 openai 的异常转换为 LLMError，并判断是否值得重试"""
+        import openai
+        if isinstance(error, openai.APITimeoutError):
+            return LLMError('大模型请求超时', 'timeout', retryable=True)
+        if isinstance(error, openai.APIConnectionError):
+            return LLMError(f'无法连接大模型服务: {error}', retryable=True)
+        if isinstance(error, openai.APIStatusError):
+            retryable = error.status_code == 429 or error.status_code >= 500
+            retry_after = _retry_after(error.response.headers) if error.status_code == 429 else None
+            return LLMError(f'大模型服务返回 {error.status_code}', retryable=retryable, retry_after=retry_after)
+        return LLMError(f'{type(error).__name__}: {error}')
+
+    def close(self) -> None:
+        """关闭所有客户端的连接（进程退出或测试结束时调用，调用方保证没有进行中的请求）
+
+        异步客户端只能在各自的事件循环中关闭，这里只是丢弃，由垃圾回收关闭连接。
+        """
+        with self._lock:
+            clients = [self._client] + list(self._key_clients.values())
+            self._client = None
+            self._key_clients = OrderedDict()
+            self._async_clients = weakref.WeakKeyDictionary()
+        for client in clients:
+            if client is not None:
+                client.close()
+
+
+def _retry_after(headers) -> Optional[float]:
+    """解析 retry-after-ms 或 Retry-After（秒数或 HTTP 日期），没有或无法解析时返回 None"""
+    try:
+        if headers.get('retry-after-ms'):
+            return max(0.0, float(headers['retry-after-ms']) / 1000)
+        value = headers.get('retry-after')
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            from email.utils import parsedate_to_datetime
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+# 进程内共用的网关
+GATEWAY = LLMGateway.from_env()
+
+
+def chat(messages: List[Dict[str, str]], caller: str = 'default', **kwargs) -> str:
+    """使用共用网关发送对话请求"""
+    return GATEWAY.chat(messages, caller=caller, **kwargs)
+
+
+def chat_stream(messages: List[Dict[str, str]], caller: str = 'default', **kwargs) -> Iterator[str]:
+    """使用共用网关发送流式对话请求"""
+    return GATEWAY.chat_stream(messages, caller=caller, **kwargs)
+
+
+def achat_stream(messages: List[Dict[str, str]], caller: str = 'default', **kwargs) -> AsyncIterator[str]:
+    """使用共用网关发送异步流式对话请求"""
+    return GATEWAY.achat_stream(messages, caller=caller, **kwargs)
+
+
+def configure(api_key: str = None, base_url: str = None) -> None:
+    """更换共用网关的 API 密钥或地址"""
+    GATEWAY.configure(api_key=api_key, base_url=base_url)
@@ -0,0 +1,332 @@
+"""运行指标：计数器、仪表盘和直方图，按 Prometheus 文本格式导出
+
+处理阶段的耗时统计：
+    @timed('recall')
+    def recall(...): ...
+
+    with track('crawl_fetch'):
+        ...
+
+开启请求追踪（tracing.start_trace）时，统计的每个阶段同时记录为追踪中的 span。
+设置环境变量 BOT_METRICS=0 可以关闭阶段统计（装饰器直接返回原函数）。
+"""
+import bisect
+import functools
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+from tracing import enter_span, exit_span
+
+ENABLED = os.environ.get('BOT_METRICS', '1') != '0'
+
+# 默认分桶（单位：秒）
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(pairs) -> str:
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _CounterValue:
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    def get(self) -> float:
+        return self._value
+
+
+class _GaugeValue(_CounterValue):
+    def __init__(self):
+        super().__init__()
+        self._function = None
+
+    def dec(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value -= amount
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self._value = value
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """导出时调用 function 取值"""
+        self._function = function
+
+    def get(self) -> float:
+        if self._function is not None:
+            return float(self._function())
+        return self._value
+
+
+class _HistogramValue:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)  # 最后一个桶为 +Inf
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def get(self) -> Tuple[List[int], float]:
+        """返回 (各桶计数, 总和)，桶计数不累加"""
+        with self._lock:
+            return list(self._counts), self._sum
+
+    def to_dict(self) -> Dict[str, Any]:
+        """导出直方图数据"""
+        counts, total = self.get()
+        count = sum(counts)
+        buckets = {_format_value(float(bound)): n for bound, n in zip(self.buckets, counts)}
+        buckets['+Inf'] = counts[-1]
+        return {
+            'count': count,
+            'sum': total,
+            'avg': total / count if count else 0.0,
+            'buckets': buckets
+        }
+
+
+class _Metric:
+    """指标族：按标签值区分多个子指标"""
+    type = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **kwargs):
+        """取得（不存在时创建）某组标签值对应的子指标"""
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        values = tuple(str(v) for v in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f'{self.name} 需要标签 {self.labelnames}')
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _children_items(self):
+        with self._lock:
+            return list(self._children.items())
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for values, child in self._children_items():
+            labels = _format_labels(list(zip(self.labelnames, values)))
+            lines.append(f'{self.name}{labels} {_format_value(child.get())}')
+        return lines
+
+    def collect(self) -> List[str]:
+        """按 Prometheus 文本格式输出"""
+        return [
+            f'# HELP {self.name} {_escape(self.documentation)}',
+            f'# TYPE {self.name} {self.type}',
+        ] + self._samples()
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def _new_child(self):
+        return _CounterValue()
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def _new_child(self):
+        return _GaugeValue()
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1) -> None:
+        self.labels().dec(amount)
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self.labels().set_function(function)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for values, child in self._children_items():
+            pairs = list(zip(self.labelnames, values))
+            counts, total = child.get()
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                labels = _format_labels(pairs + [('le', _format_value(float(bound)))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(pairs)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Registry:
+    """指标注册表：同名指标只创建一次"""
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f'指标 {name} 已注册为 {metric.type}')
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets)
+
+    def render(self) -> str:
+        """导出所有指标（Prometheus 文本格式）"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+STAGE_SECONDS = REGISTRY.histogram('bot_stage_duration_seconds', '各处理阶段的耗时', ['stage'])
+STAGE_ERRORS = REGISTRY.counter('bot_stage_errors_total', '各处理阶段抛出异常的次数', ['stage'])
+STAGE_IN_PROGRESS = REGISTRY.gauge('bot_stage_in_progress', '正在执行的各处理阶段数量', ['stage'])
+
+
+class _StageTimer:
+    __slots__ = ('_stage', '_seconds', '_errors', '_in_progress', '_start', '_span')
+
+    def __init__(self, stage: str):
+        self._stage = stage
+        self._seconds = STAGE_SECONDS.labels(stage)
+        self._errors = STAGE_ERRORS.labels(stage)
+        self._in_progress = STAGE_IN_PROGRESS.labels(stage)
+
+    def __enter__(self):
+        self._in_progress.inc()
+        self._span = enter_span(self._stage)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._seconds.observe(time.perf_counter() - self._start)
+        self._in_progress.dec()
+        if self._span is not None:
+            exit_span(self._span, exc_type)
+        if exc_type is not None:
+            self._errors.inc()
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def track(stage: str):
+    """with 语句形式的阶段统计：with track('crawl_fetch'): ..."""
+    return _StageTimer(stage) if ENABLED else _NULL_TIMER
+
+
+def timed(stage: str):
+    """装饰器：统计函数的耗时、异常次数和正在执行的数量"""
+    def decorator(func):
+        if not ENABLED:
+            return func
+        seconds = STAGE_SECONDS.labels(stage)
+        errors = STAGE_ERRORS.labels(stage)
+        in_progress = STAGE_IN_PROGRESS.labels(stage)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            in_progress.inc()
+            span = enter_span(stage)  # 开启请求追踪时同时记录 span
+            start = time.perf_counter()
+            exc_type = None
+            try:
+                return func(*args, **kwargs)
+            except BaseException as e:
+                exc_type = type(e)
+                errors.inc()
+                raise
+            finally:
+                seconds.observe(time.perf_counter() - start)
+                in_progress.dec()
+                if span is not None:
+                    exit_span(span, exc_type)
+        return wrapper
+    return decorator
@@ -0,0 +1,163 @@
+"""教学问答的模糊匹配索引：用户教过的问题换个说法也能找到答案
+
+    index = QAIndex({'你喜欢什么颜色': '蓝色'})
+    index.add('天空为什么是蓝的', '因为瑞利散射')
+    index.lookup('你喜欢什么颜色呢？')   # -> '蓝色'
+
+- 问题先归一化（全角转半角、小写、去掉标点和句末语气词），归一化后相同的问题直接命中
+- 否则用字符二元组倒排索引给候选打分（共享的二元组数），跳过出现在太多问题中的常见二元组
+  （如“什么”），查询的代价与问答总数基本无关
+- 得分最高的若干个候选按长度过滤后用带上界的编辑距离验证，
+  相似度 1 - 距离 / 较长的长度 不低于阈值时返回答案
+- 支持增量添加和更新；同一个问题再次添加时只更新答案
+"""
+import re
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from metrics import REGISTRY
+
+QA_LOOKUPS = REGISTRY.counter('bot_qa_lookups_total', '教学问答索引的查询结果', ['outcome'])
+
+DEFAULT_THRESHOLD = 0.75
+# 出现在超过这么多个问题（且超过总数的 COMMON_FRACTION）中的二元组不用于找候选
+COMMON_MIN = 256
+COMMON_FRACTION = 0.01
+# 每次查询最多验证的候选数
+MAX_CANDIDATES = 24
+NON_WORD = re.compile(r'[\W_]+')
+PARTICLES = re.compile(r'(?:吗|呢|啊|吧|呀|嘛)+$')
+
+
+def normalize(question: str) -> str:
+    text = NON_WORD.sub('', unicodedata.normalize('NFKC', question).lower())
+    return PARTICLES.sub('', text) or text
+
+
+def bigrams(text: str) -> set:
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def bounded_levenshtein(a: str, b: str, limit: int) -> int:
+    """编辑距离，超过 limit 时提前返回 limit + 1（只计算宽度为 2 * limit + 1 的对角带）"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if len(a) > len(b):
+        a, b = b, a
+    big = limit + 1
+    previous = [j if j <= limit else big for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        lo, hi = max(1, i - limit), min(len(b), i + limit)
+        current = [big] * (len(b) + 1)
+        current[0] = i if i <= limit else big
+        ca = a[i - 1]
+        best = current[0]
+        for j in range(lo, hi + 1):
+            cost = previous[j - 1] + (ca != b[j - 1])
+            if previous[j] + 1 < cost:
+                cost = previous[j] + 1
+            if current[j - 1] + 1 < cost:
+                cost = current[j - 1] + 1
+            current[j] = cost if cost < big else big
+            if cost < best:
+                best = cost
+        if best > limit:
+            return big
+        previous = current
+    return previous[len(b)]
+
+
+class QAIndex:
+    def __init__(self, pairs: Dict[str, str] = None, threshold: float = DEFAULT_THRESHOLD):
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._ids = {}        # 归一化问题 -> 编号
+        self._keys = []       # 编号 -> 归一化问题
+        self._questions = []  # 编号 -> 原始问题
+        self._answers = []    # 编号 -> 答案
+        self._postings = {}   # 二元组 -> 包含它的问题编号列表
+        if pairs:
+            self.update(pairs.items())
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, question: str, answer: str) -> None:
+        """添加问答；归一化后相同的问题只更新答案"""
+        key = normalize(question)
+        if not key:
+            return
+        with self._lock:
+            qid = self._ids.get(key)
+            if qid is not None:
+                self._questions[qid] = question
+                self._answers[qid] = answer
+                return
+            qid = len(self._keys)
+            self._keys.append(key)
+            self._questions.append(question)
+            self._answers.append(answer)
+            for gram in bigrams(key):
+                self._postings.setdefault(gram, []).append(qid)
+            # 最后登记，其他线程查到编号时问题和答案都已经就绪
+            self._ids[key] = qid
+
+    def update(self, pairs: Iterable[Tuple[str, str]]) -> None:
+        for question, answer in pairs:
+            self.add(question, answer)
+
+    def _candidates(self, key: str) -> List[int]:
+        """按共享的二元组数给候选打分，返回得分最高的 MAX_CANDIDATES 个问题编号"""
+        lists = sorted((self._postings.get(gram, ()) for gram in bigrams(key)), key=len)
+        common = max(COMMON_MIN, int(len(self._keys) * COMMON_FRACTION))
+        selected = [postings for postings in lists if len(postings) <= common]
+        if not selected:
+            # 全部是常见二元组时只用最罕见的两个
+            selected = lists[:2]
+        counts = Counter()
+        for postings in selected:
+            counts.update(postings)
+        return [qid for qid, _ in counts.most_common(MAX_CANDIDATES)]
+
+    def match(self, question: str) -> Optional[Tuple[str, str, float]]:
+        """返回最相似的 (问题, 答案, 相似度)，没有达到阈值时返回 None"""
+        key = normalize(question)
+        if not key:
+            return None
+        qid = self._ids.get(key)
+        if qid is not None:
+            return self._questions[qid], self._answers[qid], 1.0
+
+        # 相似度达到阈值时，编辑距离不超过 (1 - t) * 较长的长度
+        tolerance = 1.0 - self.threshold
+        keys = self._keys
+        best, best_score = None, self.threshold
+        for qid in self._candidates(key):
+            candidate = keys[qid]
+            longest = max(len(key), len(candidate))
+            allowed = int(tolerance * longest + 1e-9)
+            if abs(len(candidate) - len(key)) > allowed:
+                continue
+            distance = bounded_levenshtein(key, candidate, allowed)
+            if distance > allowed:
+                continue
+            score = 1.0 - distance / longest
+            # 相似度相同时选择较新的问答
+            if score > best_score or (score == best_score and (best is None or qid > best)):
+                best, best_score = qid, score
+        if best is None:
+            return None
+        return self._questions[best], self._answers[best], best_score
+
+    def lookup(self, question: str) -> Optional[str]:
+        """返回匹配问题的答案，没有时返回 None"""
+        result = self.match(question)
+        if result is None:
+            QA_LOOKUPS.labels('miss').inc()
+            return None
+        QA_LOOKUPS.labels('exact' if result[2] == 1.0 else 'fuzzy').inc()
+        return result[1]
@@ -0,0 +1,178 @@
+import json
+import os
+import threading
+import time
+from collections import Counter, deque
+from itertools import islice
+from typing import Any, Callable, Dict, Iterator, List
+
+
+class RingLog:
+    """定长日志：内存中只保留最近 capacity 条记录，淘汰的记录可选写入磁盘"""
+    def __init__(self, capacity: int = 200, spill_path: str = None, spill_batch: int = 50,
+                 spill_key: str = None):
+        self.capacity = capacity
+        self.spill_path = spill_path
+        self.spill_key = spill_key  # 多个日志共用一个磁盘文件时用于区分记录
+        self.spill_batch = spill_batch
+        self.total = 0  # 累计写入条数（包括已淘汰的）
+        self._items = deque(maxlen=capacity)
+        self._pending = []  # 等待写入磁盘的淘汰记录
+        self._lock = threading.Lock()
+
+    def append(self, record: Any) -> None:
+        """追加一条记录，超出容量时淘汰最旧的记录"""
+        with self._lock:
+            if len(self._items) == self.capacity and self.spill_path:
+                self._pending.append(self._items[0])
+                if len(self._pending) >= self.spill_batch:
+                    self._flush_locked()
+            self._items.append(record)
+            self.total += 1
+
+    def extend(self, records) -> None:
+        for record in records:
+            self.append(record)
+
+    def clear(self) -> None:
+        """清空内存中的记录"""
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __bool__(self) -> bool:
+        return bool(self._items)
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self.snapshot())
+
+    def snapshot(self) -> List[Any]:
+        """复制一份当前内存中的记录"""
+        with self._lock:
+            return list(self._items)
+
+    def __getitem__(self, index):
+        """支持下标和切片访问；从尾部取少量记录时不复制整个缓冲区"""
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self._items))
+            if step == 1 and stop == len(self._items):
+                return self.tail(stop - start)
+            return self.snapshot()[index]
+        return self._items[index]
+
+    def tail(self, n: int) -> List[Any]:
+        """按时间顺序返回最近 n 条记录"""
+        if n <= 0:
+            return []
+        with self._lock:
+            recent = list(islice(reversed(self._items), n))
+        recent.reverse()
+        return recent
+
+    def query(self, predicate: Callable[[Any], bool] = None, limit: int = None,
+              include_spilled: bool = False) -> List[Any]:
+        """按条件查询记录（最新的在前）"""
+        results = []
+        for record in reversed(self.snapshot()):
+            if predicate is None or predicate(record):
+                results.append(record)
+                if limit and len(results) >= limit:
+                    return results
+        if include_spilled:
+            for record in reversed(list(self.read_spilled())):
+                if predicate is None or predicate(record):
+                    results.append(record)
+                    if limit and len(results) >= limit:
+                        break
+        return results
+
+    def flush(self) -> None:
+        """把等待中的淘汰记录写入磁盘"""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        if not self._pending or not self.spill_path:
+            return
+        if self.spill_key is not None:
+            records = [{'key': self.spill_key, 'record': r} for r in self._pending]
+        else:
+            records = self._pending
+        chunk = ''.join(
+            json.dumps(r, ensure_ascii=False, separators=(',', ':'), default=str) + '\n'
+            for r in records
+        )
+        # 整块写入，避免多个日志共用文件时行内容交错
+        with open(self.spill_path, 'a', encoding='utf-8') as f:
+            f.write(chunk)
+        self._pending = []
+
+    def read_spilled(self) -> Iterator[Any]:
+        """按时间顺序读取已写入磁盘的记录"""
+        self.flush()
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            return
+        with open(self.spill_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if self.spill_key is None:
+                    yield record
+                elif record.get('key') == self.spill_key:
+                    yield record['record']
+
+
+class KeyedLog:
+    """按键分组的定长日志，并为每个键维护聚合计数"""
+    def __init__(self, capacity_per_key: int = 20, spill_path: str = None):
+        self.capacity_per_key = capacity_per_key
+        self.spill_path = spill_path
+        self.counts = Counter()
+        self.last_seen = {}
+        self._logs = {}
+        self._lock = threading.Lock()
+
+    def _log(self, key: str) -> RingLog:
+        log = self._logs.get(key)
+        if log is None:
+            with self._lock:
+                log = self._logs.setdefault(
+                    key, RingLog(self.capacity_per_key, spill_path=self.spill_path, spill_key=key)
+                )
+        return log
+
+    def append(self, key: str, record: Any) -> None:
+        """记录一条数据并更新该键的计数"""
+        self._log(key).append(record)
+        with self._lock:
+            self.counts[key] += 1
+            self.last_seen[key] = time.time()
+
+    def __getitem__(self, key: str) -> List[Any]:
+        """返回某个键最近的记录"""
+        log = self._logs.get(key)
+        return list(log) if log is not None else []
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._logs
+
+    def keys(self):
+        return list(self._logs)
+
+    def flush(self) -> None:
+        for log in list(self._logs.values()):
+            log.flush()
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """返回每个键的累计次数、最近时间和最近一条记录"""
+        return {
+            key: {
+                'count': self.counts[key],
+                'last_seen': self.last_seen.get(key),
+                'latest': (self[key] or [None])[-1]
+            }
+            for key in self.keys()
+        }
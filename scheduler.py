@@ -0,0 +1,432 @@
+"""后台任务调度：自主学习、自我分析、状态保存等后台工作统一由有上限的工作线程池执行
+
+    from scheduler import SCHEDULER, LEARNING, ANALYSIS
+    task = SCHEDULER.submit(learn, (topic,), name=f'learn:{topic}', cls=LEARNING)
+    SCHEDULER.every('self-improvement', 3600, analyze, cls=ANALYSIS, delay=600)
+
+- 任务分三类，优先级从高到低：request（替请求做的后台工作，如保存教学问答）、
+  learning（自主学习）、analysis（自我分析和采样）；空闲的工作线程总是先取优先级最高的任务
+- 工作线程数有上限（BOT_SCHED_WORKERS），learning 和 analysis 各自同时只运行一个任务，
+  总有工作线程留给 request 类任务
+- 每类任务有 CPU 份额（按线程 CPU 时间计的令牌桶）和单次运行时限：用完份额的任务在检查点暂停，
+  超出时限的任务在下一个检查点被取消
+- 有请求正在处理（SCHEDULER.serving()）或刚处理完时，learning 和 analysis 任务在检查点暂停，
+  每个检查点最多暂停 BOT_SCHED_MAX_DEFER 秒：不和请求争抢 GIL，请求不断时也能继续前进
+- 周期任务在每次运行结束后，按间隔加减随机抖动安排下一次，多个 worker 的周期任务不会同时开始
+- shutdown() 取消排队的任务和周期任务，等待运行中的任务在检查点退出，再调用 on_shutdown
+  注册的函数保存状态；进程正常退出时自动调用
+- snapshot() 列出排队和运行中的任务以及各类任务的统计（GET /admin/tasks）
+
+长时间运行的任务应当在每个工作单元之间调用 checkpoint()；不在调度器中运行时它什么也不做。
+
+配置（环境变量）：
+    BOT_SCHED_WORKERS       工作线程数（默认 3）
+    BOT_SCHED_LEARNING_CPU  自主学习最多使用的 CPU 份额（默认 0.5，即半个核）
+    BOT_SCHED_ANALYSIS_CPU  自我分析最多使用的 CPU 份额（默认 0.1）
+    BOT_SCHED_MAX_DEFER     有请求时后台任务在一个检查点最多暂停的秒数（默认 2）
+"""
+import atexit
+import contextlib
+import itertools
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from metrics import REGISTRY
+
+REQUEST = 'request'
+LEARNING = 'learning'
+ANALYSIS = 'analysis'
+
+# CPU 份额默认按这么长的窗口积累（秒），即一类任务最多可以连续使用 份额 * 窗口 秒的 CPU
+BUDGET_WINDOW = 10.0
+# 最后一个请求结束后这么久（秒）没有新请求，让出的任务才继续：请求之间的短暂空隙不足以运行一个工作单元
+QUIET_PERIOD = 0.05
+
+TASKS = REGISTRY.counter('bot_tasks_total', '后台任务的运行结果', ['cls', 'outcome'])
+TASK_SECONDS = REGISTRY.histogram('bot_task_duration_seconds', '后台任务每次运行的耗时', ['cls'])
+TASK_DEFERRED = REGISTRY.counter('bot_task_deferred_total', '后台任务在检查点暂停的次数', ['cls', 'reason'])
+
+# 当前线程正在运行的任务及其调度器
+_current = threading.local()
+
+
+class TaskCancelled(Exception):
+    """任务被取消（调度器关闭、超出运行时限或调用了 Task.cancel）"""
+
+
+class TaskClass:
+    """一类任务的优先级、并发上限和预算"""
+    def __init__(self, name: str, priority: int, concurrency: int = None, cpu_share: float = None,
+                 time_limit: float = None, yields: bool = False, window: float = BUDGET_WINDOW):
+        self.name = name
+        self.priority = priority        # 越小越优先
+        self.concurrency = concurrency  # 同时运行的任务数上限，None 表示只受工作线程数限制
+        self.cpu_share = cpu_share      # 最多使用的 CPU 份额，None 表示不限制
+        self.time_limit = time_limit    # 单次运行的时限（秒），None 表示不限制
+        self.yields = yields            # 有请求正在处理时是否在检查点暂停
+        self.window = window            # CPU 份额的积累窗口（秒）
+        self.running = 0
+        self.tokens = cpu_share * window if cpu_share else 0.0
+        self._refilled = time.monotonic()
+        self.stats = {'completed': 0, 'failed': 0, 'cancelled': 0, 'deferred': 0, 'cpu_seconds': 0.0}
+
+    def charge(self, cpu: float) -> None:
+        self.stats['cpu_seconds'] += cpu
+        if self.cpu_share:
+            self.tokens -= cpu
+
+    def budget_wait(self, now: float) -> float:
+        """CPU 份额用完时还需要等待的秒数"""
+        if not self.cpu_share:
+            return 0.0
+        self.tokens = min(self.cpu_share * self.window, self.tokens + (now - self._refilled) * self.cpu_share)
+        self._refilled = now
+        return -self.tokens / self.cpu_share if self.tokens < 0 else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.stats, priority=self.priority, running=self.running, concurrency=self.concurrency,
+                    cpu_share=self.cpu_share, time_limit=self.time_limit,
+                    cpu_tokens=round(self.tokens, 3) if self.cpu_share else None)
+
+
+def default_classes() -> Dict[str, TaskClass]:
+    return {
+        REQUEST: TaskClass(REQUEST, 0, time_limit=60),
+        LEARNING: TaskClass(LEARNING, 1, concurrency=1, time_limit=900, yields=True,
+                            cpu_share=float(os.environ.get('BOT_SCHED_LEARNING_CPU', 0.5))),
+        ANALYSIS: TaskClass(ANALYSIS, 2, concurrency=1, time_limit=600, yields=True,
+                            cpu_share=float(os.environ.get('BOT_SCHED_ANALYSIS_CPU', 0.1))),
+    }
+
+
+class Task:
+    """一个提交给调度器的任务；周期任务每次运行共用同一个 Task"""
+    def __init__(self, fn: Callable, args: Tuple, name: str, cls: str, key: str = None,
+                 interval: float = None, jitter: float = 0.0, retry: float = None):
+        self.fn = fn
+        self.args = args
+        self.name = name
+        self.cls = cls
+        self.key = key
+        self.interval = interval
+        self.jitter = jitter
+        self.retry = retry
+        self.due = 0.0
+        self.seq = 0
+        self.started = None
+        self.thread = None
+        self.runs = 0
+        self.cpu = 0.0
+        self.result = None
+        self.error = None
+        self.cancelled = False
+        self._cpu_mark = 0.0
+        self._done = threading.Event()
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout: float = None) -> bool:
+        """等待任务结束（周期任务等待它被取消），超时返回 False"""
+        return self._done.wait(timeout)
+
+    def cancel(self) -> None:
+        """取消任务：排队中的不再运行，运行中的在下一个检查点退出，周期任务不再安排下一次"""
+        self.cancelled = True
+
+    def to_dict(self, now: float) -> Dict[str, Any]:
+        info = {'name': self.name, 'cls': self.cls, 'runs': self.runs, 'cpu_seconds': round(self.cpu, 3)}
+        if self.interval:
+            info['interval'] = self.interval
+        if self.started is not None:
+            info.update(thread=self.thread, running_seconds=round(now - self.started, 3))
+        else:
+            info['due_in'] = round(max(0.0, self.due - now), 3)
+        return info
+
+
+class Scheduler:
+    def __init__(self, workers: int = 3, classes: Dict[str, TaskClass] = None, max_defer: float = 2.0):
+        self.max_workers = workers
+        self.classes = classes or default_classes()
+        self.max_defer = max_defer
+        self._cond = threading.Condition()
+        self._queue: List[Task] = []
+        self._keys: Dict[str, Task] = {}  # 排队中的任务键 -> 任务（相同键只排一个）
+        self._running: Dict[int, Task] = {}
+        self._threads: List[threading.Thread] = []
+        self._seq = itertools.count()
+        self._serving = 0
+        self._last_served = 0.0
+        self._stopping = False
+        self._hooks: List[Callable[[], None]] = []
+        self._pid = None
+        self._atexit = False
+
+    @classmethod
+    def from_env(cls) -> 'Scheduler':
+        return cls(workers=int(os.environ.get('BOT_SCHED_WORKERS', 3)),
+                   max_defer=float(os.environ.get('BOT_SCHED_MAX_DEFER', 2)))
+
+    # ------------------------------------------------------------ 提交
+
+    def submit(self, fn: Callable, args: Tuple = (), name: str = None, cls: str = REQUEST,
+               delay: float = 0.0, key: str = None) -> Task:
+        """提交任务，返回 Task；key 相同的任务还在排队时不重复提交，直接返回排队中的任务"""
+        task = Task(fn, tuple(args), name or getattr(fn, '__name__', 'task'), cls, key=key)
+        return self._schedule(task, delay)
+
+    def every(self, name: str, interval: float, fn: Callable, args: Tuple = (), cls: str = ANALYSIS,
+              delay: float = None, jitter: float = 0.1, retry: float = None) -> Task:
+        """周期任务：delay 秒后第一次运行（默认一个间隔），之后每次结束后再过 interval 秒
+        （加减 jitter 比例的随机抖动）运行；出错时 retry 秒后重试（默认同 interval）"""
+        task = Task(fn, tuple(args), name, cls, interval=interval, jitter=jitter, retry=retry)
+        return self._schedule(task, interval if delay is None else delay, jittered=True)
+
+    def _schedule(self, task: Task, delay: float, jittered: bool = False) -> Task:
+        if task.cls not in self.classes:
+            raise ValueError(f'未知的任务类别: {task.cls}')
+        with self._cond:
+            if self._stopping:
+                task.cancelled = True
+                task._done.set()
+                return task
+            if task.key is not None and task.key in self._keys:
+                return self._keys[task.key]
+            self._ensure_workers_locked()
+            if jittered and task.jitter:
+                delay *= 1 + random.uniform(-task.jitter, task.jitter)
+            task.due = time.monotonic() + max(0.0, delay)
+            task.seq = next(self._seq)
+            self._queue.append(task)
+            if task.key is not None:
+                self._keys[task.key] = task
+            self._cond.notify()
+        return task
+
+    def _ensure_workers_locked(self):
+        """按需启动工作线程；fork 之后的子进程重新启动自己的工作线程"""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._threads = []
+            self._running = {}
+            for task_class in self.classes.values():
+                task_class.running = 0
+        if not self._atexit:
+            self._atexit = True
+            atexit.register(self.shutdown)
+        while len(self._threads) < self.max_workers:
+            thread = threading.Thread(target=self._work, name=f'scheduler-{len(self._threads)}', daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    # ------------------------------------------------------------ 执行
+
+    def _pick_locked(self, now: float) -> Tuple[Optional[Task], Optional[float]]:
+        """选出可以运行的优先级最高的任务；没有时返回下一次需要检查的等待秒数"""
+        best, wait = None, None
+        for task in self._queue:
+            task_class = self.classes[task.cls]
+            if task.cancelled:
+                return task, None
+            if task.due > now:
+                ready_in = task.due - now
+            elif task_class.concurrency is not None and task_class.running >= task_class.concurrency:
+                continue  # 同类任务结束时会唤醒
+            else:
+                ready_in = task_class.budget_wait(now)
+            if ready_in > 0:
+                wait = ready_in if wait is None else min(wait, ready_in)
+            elif best is None or (task_class.priority, task.due, task.seq) < (
+                    self.classes[best.cls].priority, best.due, best.seq):
+                best = task
+        return best, wait
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopping:
+                        return
+                    task, wait = self._pick_locked(time.monotonic())
+                    if task is not None:
+                        break
+                    self._cond.wait(wait)
+                self._queue.remove(task)
+                if task.key is not None:
+                    self._keys.pop(task.key, None)
+                if task.cancelled:
+                    self.classes[task.cls].stats['cancelled'] += 1
+                    task._done.set()
+                    continue
+                self.classes[task.cls].running += 1
+                self._running[threading.get_ident()] = task
+            self._run(task)
+
+    def _run(self, task: Task):
+        task_class = self.classes[task.cls]
+        task.started = time.monotonic()
+        task.thread = threading.current_thread().name
+        task._cpu_mark = time.thread_time()
+        task.runs += 1
+        _current.task, _current.scheduler = task, self
+        outcome = 'completed'
+        try:
+            # 开始之前先为请求和 CPU 份额让出
+            self.checkpoint()
+            task.result = task.fn(*task.args)
+            task.error = None
+        except TaskCancelled as e:
+            outcome = 'cancelled'
+            print(f"[调度] 任务{task.name}已取消: {e}")
+        except Exception as e:
+            outcome = 'failed'
+            task.error = e
+            print(f"[调度] 任务{task.name}出错: {e}")
+        finally:
+            _current.task = _current.scheduler = None
+            elapsed = time.monotonic() - task.started
+            with self._cond:
+                self._charge_locked(task)
+                task.started = None
+                task_class.running -= 1
+                task_class.stats[outcome] += 1
+                self._running.pop(threading.get_ident(), None)
+                if task.interval and not task.cancelled and not self._stopping:
+                    delay = task.retry if outcome == 'failed' and task.retry else task.interval
+                    if task.jitter:
+                        delay *= 1 + random.uniform(-task.jitter, task.jitter)
+                    task.due = time.monotonic() + delay
+                    task.seq = next(self._seq)
+                    self._queue.append(task)
+                else:
+                    task._done.set()
+                self._cond.notify_all()
+            TASKS.labels(task.cls, outcome).inc()
+            TASK_SECONDS.labels(task.cls).observe(elapsed)
+
+    def _charge_locked(self, task: Task):
+        cpu = time.thread_time()
+        used, task._cpu_mark = cpu - task._cpu_mark, cpu
+        task.cpu += used
+        self.classes[task.cls].charge(used)
+
+    def _check(self, task: Task, now: float):
+        if self._stopping:
+            raise TaskCancelled('调度器正在关闭')
+        if task.cancelled:
+            raise TaskCancelled('任务被取消')
+        limit = self.classes[task.cls].time_limit
+        if limit and now - task.started > limit:
+            raise TaskCancelled(f'超出运行时限 {limit:g} 秒')
+
+    def checkpoint(self):
+        """长时间运行的任务在工作单元之间调用：检查取消和时限，结算 CPU 时间，
+        必要时为正在处理的请求或用完的 CPU 份额暂停"""
+        task = getattr(_current, 'task', None)
+        if task is None or _current.scheduler is not self:
+            return
+        task_class = self.classes[task.cls]
+        defer_until = time.monotonic() + self.max_defer
+        reason = None
+        with self._cond:
+            self._charge_locked(task)
+            while True:
+                now = time.monotonic()
+                self._check(task, now)
+                wait, why = task_class.budget_wait(now), 'budget'
+                if not wait and task_class.yields and now < defer_until:
+                    if self._serving:
+                        wait, why = defer_until - now, 'serving'
+                    elif now - self._last_served < QUIET_PERIOD:
+                        wait, why = min(defer_until, self._last_served + QUIET_PERIOD) - now, 'serving'
+                if wait <= 0:
+                    break
+                if reason is None:
+                    reason = why
+                    task_class.stats['deferred'] += 1
+                    TASK_DEFERRED.labels(task.cls, why).inc()
+                self._cond.wait(wait)
+            # 暂停期间的 CPU 时间不计入任务
+            task._cpu_mark = time.thread_time()
+
+    @contextlib.contextmanager
+    def serving(self):
+        """请求处理期间进入，learning 和 analysis 任务在检查点让出"""
+        with self._cond:
+            self._serving += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._serving -= 1
+                self._last_served = time.monotonic()
+                if not self._serving:
+                    self._cond.notify_all()
+
+    # ------------------------------------------------------------ 关闭和查看
+
+    def on_shutdown(self, hook: Callable[[], None]) -> None:
+        """注册关闭时调用的函数（保存状态），按注册顺序调用"""
+        with self._cond:
+            self._hooks.append(hook)
+            if not self._atexit:
+                self._atexit = True
+                atexit.register(self.shutdown)
+
+    def shutdown(self, timeout: float = 10.0) -> bool:
+        """停止调度：取消排队的任务和周期任务，等待运行中的任务在检查点退出（最多 timeout 秒），
+        再调用 on_shutdown 注册的函数；返回运行中的任务是否都已结束。重复调用时直接返回"""
+        with self._cond:
+            if self._stopping:
+                return not self._running
+            self._stopping = True
+            for task in self._queue:
+                task.cancelled = True
+                self.classes[task.cls].stats['cancelled'] += 1
+                task._done.set()
+            self._queue.clear()
+            self._keys.clear()
+            self._cond.notify_all()
+            deadline = time.monotonic() + timeout
+            while self._running and time.monotonic() < deadline:
+                self._cond.wait(deadline - time.monotonic())
+            finished = not self._running
+            hooks, self._hooks = self._hooks, []
+        if not finished:
+            print(f"[调度] 关闭时仍有任务在运行: {', '.join(t.name for t in list(self._running.values()))}")
+        for hook in hooks:
+            try:
+                hook()
+            except Exception as e:
+                print(f"[调度] 关闭时保存状态出错: {e}")
+        return finished
+
+    def snapshot(self) -> Dict[str, Any]:
+        """排队和运行中的任务，以及各类任务的统计"""
+        now = time.monotonic()
+        with self._cond:
+            queued = sorted(self._queue, key=lambda t: (self.classes[t.cls].priority, t.due, t.seq))
+            return {
+                'workers': len(self._threads) if self._pid == os.getpid() else 0,
+                'max_workers': self.max_workers,
+                'serving': self._serving,
+                'stopping': self._stopping,
+                'running': [task.to_dict(now) for task in self._running.values()],
+                'queued': [task.to_dict(now) for task in queued],
+                'classes': {name: task_class.to_dict() for name, task_class in self.classes.items()},
+            }
+
+
+SCHEDULER = Scheduler.from_env()
+
+
+def checkpoint():
+    """在当前任务的工作单元之间调用（见 Scheduler.checkpoint），不在任务中时什么也不做"""
+    scheduler = getattr(_current, 'scheduler', None)
+    if scheduler is not None:
+        scheduler.checkpoint()
@@ -1,97 +1,259 @@
 import ast
-import inspect
+import hashlib
 import textwrap
 import importlib
+import importlib.util
 import os
 import json
+import datetime
+import subprocess
+import sys
+import threading
 from typing import Dict, List, Any, Tuple
-import openai
 from collections import defaultdict
+import llm_gateway
+import tracing
 
-class CodeAnalyzer:
-    """代码分析器：分析代码结构和性能"""
+# 计入复杂度的节点类型
+COMPLEXITY_NODES = (ast.If, ast.While, ast.For, ast.FunctionDef,
+                    ast.ClassDef, ast.Try, ast.ExceptHandler)
+
+
+def merge_counts(saved: Dict[str, Dict[str, float]], current: Dict[str, Dict[str, float]],
+                 baseline: Dict[str, Dict[str, float]]) -> Dict[str, Dict[str, float]]:
+    """合并按函数累计的统计：文件中的值加上本进程在 baseline（上次读写文件时的值）之后新增的部分"""
+    merged = {function: dict(stats) for function, stats in saved.items()}
+    for function, stats in current.items():
+        base = baseline.get(function, {})
+        total = merged.setdefault(function, {})
+        for name, value in stats.items():
+            total[name] = total.get(name, 0) + value - base.get(name, 0)
+    return merged
+
+
+def _merge_logs(saved: List[Dict[str, Any]], current: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """合并两份日志，按内容去重，保持时间顺序"""
+    seen = {json.dumps(entry, sort_keys=True, ensure_ascii=False) for entry in saved}
+    merged = list(saved)
+    merged.extend(entry for entry in current if json.dumps(entry, sort_keys=True, ensure_ascii=False) not in seen)
+    merged.sort(key=lambda entry: entry.get('timestamp', ''))
+    return merged
+
+
+class _Scope:
+    """正在访问的类或函数"""
+    __slots__ = ('info', 'complexity', 'returns')
+
+    def __init__(self, info: Dict[str, Any], returns: List[str] = None):
+        self.info = info
+        self.complexity = 1
+        self.returns = returns
+
+
+class _ModuleVisitor(ast.NodeVisitor):
+    """一次遍历语法树，同时统计类、函数、复杂度和度量指标"""
     def __init__(self):
+        self.classes = []
+        self.functions = []
+        self.imports = 0
+        self.module = _Scope({})
+        self._scopes = [self.module]
+
+    def generic_visit(self, node: ast.AST):
+        if isinstance(node, COMPLEXITY_NODES):
+            # 复杂度包括节点自身，外层的每个类和函数都要计入
+            for scope in self._scopes:
+                scope.complexity += 1
+        super().generic_visit(node)
+
+    def _visit_scope(self, node: ast.AST, scope: _Scope):
+        self._scopes.append(scope)
+        self.generic_visit(node)
+        self._scopes.pop()
+        scope.info['complexity'] = scope.complexity
+
+    def visit_ClassDef(self, node: ast.ClassDef):
+        info = {
+            'name': node.name,
+            'methods': [m.name for m in node.body if isinstance(m, ast.FunctionDef)],
+            'attributes': [a.targets[0].id for a in node.body
+                           if isinstance(a, ast.Assign) and isinstance(a.targets[0], ast.Name)],
+        }
+        self.classes.append(info)
+        self._visit_scope(node, _Scope(info))
+
+    def visit_FunctionDef(self, node: ast.FunctionDef):
+        info = {'name': node.name, 'args': [a.arg for a in node.args.args]}
+        self.functions.append(info)
+        scope = _Scope(info, returns=[])
+        self._visit_scope(node, scope)
+        info['returns'] = scope.returns
+
+    def visit_Return(self, node: ast.Return):
+        if node.value:
+            value = ast.unparse(node.value)
+            # 外层函数的返回值也包括嵌套函数中的 return
+            for scope in self._scopes:
+                if scope.returns is not None:
+                    scope.returns.append(value)
+        self.generic_visit(node)
+
+    def visit_Import(self, node: ast.Import):
+        self.imports += 1
+        self.generic_visit(node)
+
+
+def analyze_source(source: bytes) -> Dict[str, Any]:
+    """分析一个模块的源码"""
+    tree = ast.parse(source)
+    visitor = _ModuleVisitor()
+    visitor.visit(tree)
+    lines = importlib.util.decode_source(source).splitlines()
+    return {
+        'classes': visitor.classes,
+        'functions': visitor.functions,
+        'complexity': visitor.module.complexity,
+        'metrics': {
+            # 不计空行和注释行
+            'lines': sum(1 for line in lines if line.strip() and not line.lstrip().startswith('#')),
+            'classes': len(visitor.classes),
+            'functions': len(visitor.functions),
+            'imports': visitor.imports
+        }
+    }
+
+
+def analyze_files(paths: List[str]) -> Dict[str, Any]:
+    """分析一组源文件，返回 {路径: 分析结果}，无法分析的文件返回 {'error': 原因}"""
+    results = {}
+    for path in paths:
+        try:
+            with open(path, 'rb') as f:
+                results[path] = analyze_source(f.read())
+        except (OSError, SyntaxError, ValueError) as e:
+            results[path] = {'error': f"{path}: {e}"}
+    return results
+
+
+class CodeAnalyzer:
+    """代码分析器：分析代码结构和性能
+    
+    分析结果按文件路径缓存：修改时间和大小不变时只需要一次 stat，
+    内容摘要不变时（例如文件被重新检出）也不会重新解析。
+    use_subprocess 为 True 时在子进程中解析，不占用服务进程的 CPU 和 GIL。
+    """
+    def __init__(self, use_subprocess: bool = None):
         self.code_metrics = defaultdict(dict)
         self.performance_logs = []
         self.optimization_history = []
+        if use_subprocess is None:
+            use_subprocess = os.environ.get('BOT_ANALYZE_SUBPROCESS') == '1'
+        self.use_subprocess = use_subprocess
+        self._cache = {}  # 路径 -> (修改时间和大小, 内容摘要, 分析结果)
+        self.parse_count = 0
+        self.function_stats = {}  # 函数 -> 各采样窗口累计的运行时统计（见 tracing.FunctionProfiler）
+        self.profile_time = 0.0  # 累计的采样时长（秒）
+        
+    @staticmethod
+    def module_path(module_name: str) -> str:
+        """模块的源文件路径（不导入模块）"""
+        spec = importlib.util.find_spec(module_name)
+        if spec is None or not spec.origin or not spec.origin.endswith('.py'):
+            raise ImportError(f"找不到模块 {module_name} 的源文件")
+        return spec.origin
         
     def analyze_code(self, module_name: str) -> Dict[str, Any]:
         """分析模块代码"""
-        try:
-            module = importlib.import_module(module_name)
-            source = inspect.getsource(module)
-            tree = ast.parse(source)
-            
-            analysis = {
-                'module': module_name,
-                'classes': self._analyze_classes(tree),
-                'functions': self._analyze_functions(tree),
-                'complexity': self._calculate_complexity(tree),
-                'metrics': self._calculate_metrics(tree)
-            }
-            
-            self.code_metrics[module_name] = analysis
-            return analysis
-            
-        except Exception as e:
-            print(f"代码分析错误: {e}")
-            return {}
-            
-    def _analyze_classes(self, tree: ast.AST) -> List[Dict[str, Any]]:
-        """分析类定义"""
-        classes = []
-        for node in ast.walk(tree):
-            if isinstance(node, ast.ClassDef):
-                class_info = {
-                    'name': node.name,
-                    'methods': [m.name for m in node.body if isinstance(m, ast.FunctionDef)],
-                    'attributes': [a.targets[0].id for a in node.body 
-                                 if isinstance(a, ast.Assign)],
-                    'complexity': self._calculate_complexity(node)
-                }
-                classes.append(class_info)
-        return classes
+        return self.analyze_modules([module_name]).get(module_name, {})
         
-    def _analyze_functions(self, tree: ast.AST) -> List[Dict[str, Any]]:
-        """分析函数定义"""
-        functions = []
-        for node in ast.walk(tree):
-            if isinstance(node, ast.FunctionDef):
-                func_info = {
-                    'name': node.name,
-                    'args': [a.arg for a in node.args.args],
-                    'complexity': self._calculate_complexity(node),
-                    'returns': self._analyze_returns(node)
-                }
-                functions.append(func_info)
-        return functions
+    def analyze_modules(self, module_names: List[str]) -> Dict[str, Dict[str, Any]]:
+        """分析一组模块，只重新解析有变化的文件"""
+        results = {}
+        stale = {}
+        for module_name in module_names:
+            try:
+                path = self.module_path(module_name)
+                st = os.stat(path)
+            except Exception as e:
+                print(f"代码分析错误: {e}")
+                results[module_name] = {}
+                continue
+            key = (st.st_mtime_ns, st.st_size)
+            cached = self._cache.get(path)
+            if cached and cached[0] == key:
+                results[module_name] = cached[2]
+            else:
+                stale[path] = (module_name, key)
+                
+        # 修改时间变了但内容没变（例如文件被重新检出）时不重新解析
+        changed = {}
+        for path, (module_name, key) in stale.items():
+            try:
+                with open(path, 'rb') as f:
+                    digest = hashlib.sha1(f.read()).hexdigest()
+            except OSError as e:
+                print(f"代码分析错误: {e}")
+                results[module_name] = {}
+                continue
+            cached = self._cache.get(path)
+            if cached and cached[1] == digest:
+                self._cache[path] = (key, digest, cached[2])
+                results[module_name] = cached[2]
+            else:
+                changed[path] = (module_name, key, digest)
+                
+        if changed:
+            try:
+                parsed = self._parse(list(changed))
+            except Exception as e:
+                print(f"代码分析错误: {e}")
+                parsed = {}
+            for path, (module_name, key, digest) in changed.items():
+                if path not in parsed or 'error' in parsed[path]:
+                    if path in parsed:
+                        print(f"代码分析错误: {parsed[path]['error']}")
+                    results[module_name] = {}
+                    continue
+                analysis = dict(parsed[path], module=module_name)
+                self._cache[path] = (key, digest, analysis)
+                results[module_name] = analysis
+                
+        for module_name, analysis in results.items():
+            if analysis:
+                self.code_metrics[module_name] = analysis
+        return {module_name: results[module_name] for module_name in module_names}
         
-    def _calculate_complexity(self, node: ast.AST) -> int:
-        """计算代码复杂度"""
-        complexity = 1
-        for child in ast.walk(node):
-            if isinstance(child, (ast.If, ast.While, ast.For, ast.FunctionDef,
-                                ast.ClassDef, ast.Try, ast.ExceptHandler)):
-                complexity += 1
-        return complexity
+    def _parse(self, paths: List[str]) -> Dict[str, Any]:
+        self.parse_count += len(paths)
+        if not self.use_subprocess:
+            return analyze_files(paths)
+        result = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), *paths],
+            capture_output=True, text=True, timeout=120
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"分析子进程退出码 {result.returncode}: {result.stderr.strip()[-200:]}")
+        return json.loads(result.stdout)
         
-    def _calculate_metrics(self, tree: ast.AST) -> Dict[str, int]:
-        """计算代码度量指标"""
-        metrics = {
-            'lines': len(ast.unparse(tree).split('\n')),
-            'classes': len([n for n in ast.walk(tree) if isinstance(n, ast.ClassDef)]),
-            'functions': len([n for n in ast.walk(tree) if isinstance(n, ast.FunctionDef)]),
-            'imports': len([n for n in ast.walk(tree) if isinstance(n, ast.Import)])
-        }
-        return metrics
+    def record_profile(self, profile: Dict[str, Any]):
+        """合并一个采样窗口的按函数统计"""
+        for function, stats in profile['functions'].items():
+            total = self.function_stats.setdefault(function, dict.fromkeys(stats, 0))
+            for name, value in stats.items():
+                total[name] = total.get(name, 0) + value
+        self.profile_time += profile['duration']
         
-    def _analyze_returns(self, node: ast.FunctionDef) -> List[str]:
-        """分析函数返回值"""
-        returns = []
-        for child in ast.walk(node):
-            if isinstance(child, ast.Return) and child.value:
-                returns.append(ast.unparse(child.value))
-        return returns
+    def hot_functions(self, module_name: str = None) -> List[Dict[str, Any]]:
+        """按自身耗时从高到低排列的函数，share 为占机器人代码总耗时的比例"""
+        total = sum(stats['self_wall'] for stats in self.function_stats.values())
+        prefix = f'{module_name}.' if module_name else ''
+        ranked = [
+            dict(stats, function=function, share=stats['self_wall'] / total if total else 0.0)
+            for function, stats in self.function_stats.items()
+            if function.startswith(prefix) and not function.endswith('.<module>')
+        ]
+        ranked.sort(key=lambda item: item['self_wall'], reverse=True)
+        return ranked
         
     def log_performance(self, function_name: str, execution_time: float,
                        memory_usage: float, success: bool):
@@ -121,7 +283,11 @@ class CodeOptimizer:
             },
             'performance': {
                 'execution_time_threshold': 1.0,
-                'memory_usage_threshold': 100
+                'memory_usage_threshold': 100,
+                # 采样得到的热点函数：自身耗时占比超过 hot_share 才提出建议
+                'hot_share': 0.05,
+                'high_priority_share': 0.25,
+                'max_hot_functions': 5
             },
             'style': {
                 'max_line_length': 80,
@@ -148,6 +314,24 @@ class CodeOptimizer:
                     'priority': 'high'
                 })
                 
+        # 检查运行时采样得到的热点函数
+        rules = self.optimization_rules['performance']
+        hot = [f for f in self.analyzer.hot_functions(module_name) if f['share'] >= rules['hot_share']]
+        for stats in hot[:rules['max_hot_functions']]:
+            memory = f"，新分配内存 {stats['alloc_bytes'] / 1024:.0f}KB" if stats['alloc_bytes'] else ''
+            if stats['self_cpu'] < stats['self_wall'] * 0.5:
+                advice = '大部分时间没有占用 CPU，可能在等待锁或 GIL，建议减少共享状态的争用'
+            else:
+                advice = '建议优化算法或使用缓存'
+            suggestions.append({
+                'type': 'performance',
+                'target': stats['function'],
+                'suggestion': (f"{stats['function']} 占机器人代码耗时的 {stats['share']:.0%}（自身 {stats['self_wall']:.2f}s，"
+                               f"含子调用 {stats['wall']:.2f}s，CPU {stats['cpu']:.2f}s{memory}），{advice}"),
+                'priority': 'high' if stats['share'] >= rules['high_priority_share'] else 'medium',
+                'stats': stats
+            })
+            
         # 检查性能
         for log in self.analyzer.performance_logs:
             if log['execution_time'] > self.optimization_rules['performance']['execution_time_threshold']:
@@ -180,15 +364,11 @@ class CodeOptimizer:
         """
         
         try:
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "你是一个代码重构专家，专注于改进代码质量和可维护性。"},
-                    {"role": "user", "content": prompt}
-                ]
-            )
-            return response.choices[0].message['content']
-        except:
+            return llm_gateway.chat([
+                {"role": "system", "content": "你是一个代码重构专家，专注于改进代码质量和可维护性。"},
+                {"role": "user", "content": prompt}
+            ], caller='optimize')
+        except llm_gateway.LLMError:
             return "无法生成重构代码，请检查API配置。"
             
     def _generate_performance_optimization_code(self, suggestion: Dict[str, Any]) -> str:
@@ -203,15 +383,11 @@ class CodeOptimizer:
         """
         
         try:
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "你是一个性能优化专家，专注于提升代码执行效率。"},
-                    {"role": "user", "content": prompt}
-                ]
-            )
-            return response.choices[0].message['content']
-        except:
+            return llm_gateway.chat([
+                {"role": "system", "content": "你是一个性能优化专家，专注于提升代码执行效率。"},
+                {"role": "user", "content": prompt}
+            ], caller='optimize')
+        except llm_gateway.LLMError:
             return "无法生成优化代码，请检查API配置。"
 
 class SelfImprovement:
@@ -221,9 +397,14 @@ class SelfImprovement:
         self.optimizer = CodeOptimizer(self.analyzer)
         self.improvement_log = []
         self.openai_api_key = openai_api_key
+        # 后台优化线程和请求线程都会调用，分析结果和日志的读写需要加锁
+        self._lock = threading.RLock()
+        # 上次读写状态文件时的函数统计和采样时长，合并保存时只加上之后新增的部分
+        self._persisted_stats = {}
+        self._persisted_time = 0.0
         
         if openai_api_key:
-            openai.api_key = openai_api_key
+            llm_gateway.configure(api_key=openai_api_key)
             
     def analyze_self(self) -> Dict[str, Any]:
         """分析自身代码"""
@@ -234,21 +415,35 @@ class SelfImprovement:
             'self_improvement'
         ]
         
-        analysis = {}
-        for module in modules:
-            analysis[module] = self.analyzer.analyze_code(module)
-            
-        return analysis
+        with self._lock:
+            return self.analyzer.analyze_modules(modules)
+        
+    def profile_window(self, duration: float, memory: bool = False) -> Dict[str, Any]:
+        """对线上流量采样 duration 秒，按函数统计耗时并计入分析结果；已有采样在进行时返回 None"""
+        profile = tracing.profile_functions(duration, memory=memory)
+        if profile is not None:
+            with self._lock:
+                self.analyzer.record_profile(profile)
+        return profile
+        
+    def hotspot_report(self, profile: Dict[str, Any], top: int = 20) -> Dict[str, Any]:
+        """一个采样窗口中最耗时的函数，以及根据累计统计得到的性能建议"""
+        functions = [dict(stats, function=name) for name, stats in list(profile['functions'].items())[:top]]
+        suggestions = [s for s in self.suggest_improvements() if s['type'] == 'performance']
+        return {'duration': profile['duration'], 'samples': profile['samples'],
+                'functions': functions, 'suggestions': suggestions}
         
     def suggest_improvements(self) -> List[Dict[str, Any]]:
-        """提出改进建议"""
+        """提出改进建议，热点函数的性能建议排在最前面（按自身耗时从高到低）"""
         suggestions = []
-        analysis = self.analyze_self()
-        
-        for module, module_analysis in analysis.items():
-            module_suggestions = self.optimizer.suggest_improvements(module)
-            suggestions.extend(module_suggestions)
+        with self._lock:
+            analysis = self.analyze_self()
+            
+            for module, module_analysis in analysis.items():
+                module_suggestions = self.optimizer.suggest_improvements(module)
+                suggestions.extend(module_suggestions)
             
+        suggestions.sort(key=lambda s: -s['stats']['self_wall'] if 'stats' in s else 0)
         return suggestions
         
     def implement_improvement(self, suggestion: Dict[str, Any]) -> bool:
@@ -266,7 +461,8 @@ class SelfImprovement:
                 'suggestion': suggestion,
                 'optimization_code': optimization_code
             }
-            self.improvement_log.append(improvement)
+            with self._lock:
+                self.improvement_log.append(improvement)
             
             # TODO: 实现自动代码更新机制
             # 目前仅生成建议，需要人工审查和应用
@@ -277,11 +473,31 @@ class SelfImprovement:
             print(f"实现改进时出错: {e}")
             return False
             
-    def generate_new_feature(self, feature_description: str) -> str:
+    def generate_new_feature(self, feature_description: str, api_key: str = None) -> str:
         """生成新功能代码"""
+        return ''.join(self.stream_new_feature(feature_description, api_key))
+        
+    def stream_new_feature(self, feature_description: str, api_key: str = None):
+        """生成新功能代码，大模型返回一段就输出一段，失败时不再输出"""
         try:
-            # 使用GPT生成新功能代码
-            prompt = f"""
+            yield from llm_gateway.chat_stream(self._feature_messages(feature_description),
+                                               caller='feature', api_key=api_key)
+        except llm_gateway.LLMError as e:
+            print(f"生成新功能时出错: {e}")
+            
+    async def astream_new_feature(self, feature_description: str, api_key: str = None):
+        """stream_new_feature 的异步版本：在事件循环中等待大模型，不占用线程"""
+        try:
+            async for delta in llm_gateway.achat_stream(self._feature_messages(feature_description),
+                                                        caller='feature', api_key=api_key):
+                yield delta
+        except llm_gateway.LLMError as e:
+            print(f"生成新功能时出错: {e}")
+            
+    def _feature_messages(self, feature_description: str) -> List[Dict[str, str]]:
+        """生成新功能代码的提示"""
+        # 使用GPT生成新功能代码
+        prompt = f"""
             请帮我为机器人开发新功能：
             功能描述：{feature_description}
             
@@ -293,37 +509,72 @@ class SelfImprovement:
             
             请提供完整的实现代码。
             """
+        return [
+            {"role": "system", "content": "你是一个Python专家，专注于开发智能机器人功能。"},
+            {"role": "user", "content": prompt}
+        ]
             
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "你是一个Python专家，专注于开发智能机器人功能。"},
-                    {"role": "user", "content": prompt}
-                ]
-            )
-            
-            return response.choices[0].message['content']
-            
-        except Exception as e:
-            print(f"生成新功能时出错: {e}")
-            return ""
+    def save_state(self, filename: str = 'self_improvement_state.json', merge: bool = False):
+        """保存改进状态
+
+        merge=True 时与文件中已有的状态合并（进程之间的互斥由调用方负责）：函数统计和采样时长
+        加上本进程自上次读写文件以来新增的部分，改进和性能日志去重后合并，代码指标以本进程为准。
+        """
+        with self._lock:
+            state = {
+                'improvement_log': list(self.improvement_log),
+                'code_metrics': dict(self.analyzer.code_metrics),
+                'performance_logs': list(self.analyzer.performance_logs),
+                'function_stats': {name: dict(stats) for name, stats in self.analyzer.function_stats.items()},
+                'profile_time': self.analyzer.profile_time
+            }
+            if merge:
+                try:
+                    with open(filename, 'r', encoding='utf-8') as f:
+                        state = self._merge_saved(json.load(f), state)
+                except (FileNotFoundError, ValueError, TypeError, AttributeError):
+                    pass  # 文件不存在或已损坏时只写入本进程的状态
+                    
+            tmp = f'{filename}.{os.getpid()}.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, filename)
+            # 热点排名使用合并后的累计统计
+            self.analyzer.function_stats = state['function_stats']
+            self.analyzer.profile_time = state['profile_time']
+            self._remember_persisted()
             
-    def save_state(self, filename: str = 'self_improvement_state.json'):
-        """保存改进状态"""
-        state = {
-            'improvement_log': self.improvement_log,
-            'code_metrics': self.analyzer.code_metrics,
-            'performance_logs': self.analyzer.performance_logs
+    def _merge_saved(self, saved: Dict[str, Any], state: Dict[str, Any]) -> Dict[str, Any]:
+        """把本进程的状态合并到文件中已有的状态上"""
+        return {
+            'improvement_log': _merge_logs(saved.get('improvement_log', []), state['improvement_log']),
+            'code_metrics': dict(saved.get('code_metrics', {}), **state['code_metrics']),
+            'performance_logs': _merge_logs(saved.get('performance_logs', []), state['performance_logs']),
+            'function_stats': merge_counts(saved.get('function_stats', {}), state['function_stats'],
+                                           self._persisted_stats),
+            'profile_time': saved.get('profile_time', 0.0) + state['profile_time'] - self._persisted_time
         }
         
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(state, f, ensure_ascii=False, indent=2)
+    def _remember_persisted(self):
+        self._persisted_stats = {name: dict(stats) for name, stats in self.analyzer.function_stats.items()}
+        self._persisted_time = self.analyzer.profile_time
             
     def load_state(self, filename: str = 'self_improvement_state.json'):
         """加载改进状态"""
         try:
             with open(filename, 'r', encoding='utf-8') as f:
                 state = json.load(f)
-                self.improvement_log = state.get('improvement_log', [])
-                self.analyzer.code_metrics = state.get('code_metrics', {})
-                self.analyzer.performance_logs = state.get('performance_logs', []) 
\ No newline at end of file
+        except (FileNotFoundError, ValueError):
+            return  # 如果文件不存在或已损坏，使用空白状态
+        with self._lock:
+            self.improvement_log = state.get('improvement_log', [])
+            self.analyzer.code_metrics = defaultdict(dict, state.get('code_metrics', {}))
+            self.analyzer.performance_logs = state.get('performance_logs', [])
+            self.analyzer.function_stats = state.get('function_stats', {})
+            self.analyzer.profile_time = state.get('profile_time', 0.0)
+            self._remember_persisted()
+
+
+if __name__ == '__main__':
+    # 子进程分析入口：python self_improvement.py 文件... ，结果以 JSON 输出
+    json.dump(analyze_files(sys.argv[1:]), sys.stdout, ensure_ascii=False)
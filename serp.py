@@ -0,0 +1,139 @@
+"""搜索结果页解析：从各搜索引擎的结果页中只提取自然搜索结果，并合并多个引擎的排名
+
+    pages = {'baidu': html, 'bing': html}
+    rankings = [extract(engine, html, base_url) for engine, html in pages.items()]
+    results = rrf_merge(rankings)
+
+每条结果是一个字典：url、title、snippet、engine、rank（从 1 开始）；
+合并后的结果另有 score（RRF 分数）和 engines（出现在哪些引擎中）。
+广告、导航、“相关搜索”和翻页链接都不会出现在结果中。
+"""
+import re
+from typing import Callable, Dict, Iterable, List
+from urllib.parse import parse_qsl, quote, urlencode, urljoin, urlparse, urlunparse
+
+# 引擎名 -> 结果页网址模板（{query} 为编码后的查询词）
+ENGINES = {
+    'baidu': 'https://www.baidu.com/s?wd={query}',
+    'sogou': 'https://www.sogou.com/web?query={query}',
+    'bing': 'https://cn.bing.com/search?q={query}',
+}
+
+# 倒数排名融合的平滑常数（常用取值 60）
+RRF_K = 60
+
+# 去重时忽略的跟踪参数
+TRACKING_PARAMS = re.compile(r'^(?:utm_\w+|spm|from|source|ref)$')
+
+EXTRACTORS = {}
+
+
+def extractor(engine: str):
+    """注册某个引擎的结果提取函数：参数为 BeautifulSoup 和结果页网址，返回 [(网址, 标题, 摘要)]"""
+    def decorator(func: Callable):
+        EXTRACTORS[engine] = func
+        return func
+    return decorator
+
+
+def search_urls(topic: str, engines: Dict[str, str] = None) -> Dict[str, str]:
+    """各引擎的结果页网址"""
+    return {name: template.format(query=quote(topic)) for name, template in (engines or ENGINES).items()}
+
+
+def _text(node) -> str:
+    return node.get_text(' ', strip=True) if node is not None else ''
+
+
+def _is_ad(node) -> bool:
+    classes = ' '.join(node.get('class', []))
+    return node.has_attr('data-tuiguang') or bool(re.search(r'(?:^|[\s_-])(?:ad|ads|ec|biz|promotion)(?:$|[\s_-])', classes))
+
+
+@extractor('baidu')
+def _baidu(soup, base_url):
+    results = []
+    for node in soup.select('div.result, div.c-container'):
+        if _is_ad(node) or node.find_parent(class_='result') is not None:
+            continue
+        link = node.select_one('h3 a[href]')
+        if link is None:
+            continue
+        # 百度的链接是跳转地址，真实网址在 mu 属性中
+        url = node.get('mu') or urljoin(base_url, link['href'])
+        snippet = node.select_one('.c-abstract, [class*="content-right"], .c-span-last, p')
+        results.append((url, _text(link), _text(snippet)))
+    return results
+
+
+@extractor('sogou')
+def _sogou(soup, base_url):
+    results = []
+    for node in soup.select('div.vrwrap, div.rb'):
+        if _is_ad(node):
+            continue
+        link = node.select_one('h3 a[href]')
+        if link is None:
+            continue
+        # 搜狗的链接是跳转地址，部分结果在 data-url 中给出真实网址
+        real = node.select_one('[data-url]')
+        url = real['data-url'] if real is not None else urljoin(base_url, link['href'])
+        snippet = node.select_one('.space-txt, .str-text-info, .str_info, .ft, p')
+        results.append((url, _text(link), _text(snippet)))
+    return results
+
+
+@extractor('bing')
+def _bing(soup, base_url):
+    results = []
+    for node in soup.select('li.b_algo'):
+        link = node.select_one('h2 a[href]')
+        if link is None:
+            continue
+        snippet = node.select_one('.b_caption p, p')
+        results.append((urljoin(base_url, link['href']), _text(link), _text(snippet)))
+    return results
+
+
+def extract(engine: str, html: str, base_url: str) -> List[Dict[str, object]]:
+    """解析某个引擎的结果页，返回按排名排列的自然搜索结果"""
+    from bs4 import BeautifulSoup
+    func = EXTRACTORS.get(engine)
+    if func is None:
+        raise ValueError(f'不支持的搜索引擎: {engine}')
+    results, seen = [], set()
+    for url, title, snippet in func(BeautifulSoup(html, 'html.parser'), base_url):
+        parsed = urlparse(url)
+        key = normalize_url(url)
+        if parsed.scheme not in ('http', 'https') or not parsed.netloc or key in seen:
+            continue
+        seen.add(key)
+        results.append({'url': url, 'title': title, 'snippet': snippet,
+                        'engine': engine, 'rank': len(results) + 1})
+    return results
+
+
+def normalize_url(url: str) -> str:
+    """用于去重的网址：忽略大小写的主机名、片段、末尾斜杠和跟踪参数"""
+    parsed = urlparse(url)
+    query = urlencode(sorted((k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True)
+                             if not TRACKING_PARAMS.match(k)))
+    path = parsed.path.rstrip('/') or '/'
+    return urlunparse((parsed.scheme.lower(), parsed.netloc.lower(), path, '', query, ''))
+
+
+def rrf_merge(rankings: Iterable[List[Dict[str, object]]], k: int = RRF_K) -> List[Dict[str, object]]:
+    """倒数排名融合：每个引擎贡献 1 / (k + 排名)，按总分从高到低返回去重后的结果"""
+    merged = {}
+    for ranking in rankings:
+        for result in ranking:
+            key = normalize_url(result['url'])
+            entry = merged.get(key)
+            if entry is None:
+                entry = merged[key] = dict(result, score=0.0, engines=[])
+            entry['score'] += 1.0 / (k + result['rank'])
+            entry['engines'].append(result['engine'])
+            # 保留最长的摘要，用于相关性过滤
+            if len(result['snippet']) > len(entry['snippet']):
+                entry['snippet'] = result['snippet']
+    return sorted(merged.values(), key=lambda r: (-r['score'], r['rank']))
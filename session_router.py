@@ -0,0 +1,261 @@
+"""多节点部署的会话路由：按会话ID用一致性哈希选择节点，节点增减时迁移会话状态
+
+    python session_router.py --node http://10.0.0.1:5000 --node http://10.0.0.2:5000 --port 8000
+    BOT_ROUTER_NODES=http://10.0.0.1:5000,http://10.0.0.2:5000 gunicorn -w 1 --threads 32 'session_router:create_app()'
+
+- 每个节点在环上放 BOT_ROUTER_VNODES 个虚拟节点（默认 160），会话ID顺时针找到的第一个虚拟节点
+  所属的节点负责该会话；增减一个节点时只有约 1/节点数 的会话换节点
+- 节点变化时先切换到新的环，再把换了节点的会话从原节点交接（导出并删除）到新节点；
+  迁移完成前收到的请求会先迁移该会话再转发，迁移走的会话在原节点上返回 409，路由层按新的环重试
+- 节点之间不直接通信，交接使用节点的 /admin/sessions 接口，需要与节点相同的 BOT_ADMIN_TOKEN
+- 路由表只保存在路由进程中，路由层只能运行一个进程（可以多线程）
+
+管理接口（需要请求头 X-Admin-Token）：
+    GET  /router/nodes                      当前节点和统计
+    POST /router/nodes {"add": 网址} / {"remove": 网址} / {"nodes": [网址]}
+    GET  /router/sessions/<会话ID>          从负责的节点导出会话状态
+"""
+import argparse
+import bisect
+import hashlib
+import os
+import threading
+import time
+from typing import Dict, Iterable
+
+from session_store import SESSION_HEADER, is_valid_session_id, new_session_id, resolve_session_id
+from tracing import ADMIN_TOKEN_HEADER
+
+DEFAULT_VNODES = 160
+
+# 转发给节点的请求头和返回给客户端的响应头
+FORWARD_HEADERS = ('Content-Type', 'Cookie', 'X-OpenAI-Key', 'X-Serper-Key', 'X-Debug-Trace')
+RETURN_HEADERS = ('Content-Type', 'Cache-Control', 'Set-Cookie')
+NODE_HEADER = 'X-Bot-Node'
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """一致性哈希环（创建后不再修改，节点变化时创建新的环）"""
+    def __init__(self, nodes: Iterable[str] = (), vnodes: int = DEFAULT_VNODES):
+        self.vnodes = vnodes
+        self.nodes = sorted(set(nodes))
+        points = sorted((_hash(f'{node}#{i}'), node) for node in self.nodes for i in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def node_for(self, key: str) -> str:
+        """负责该键的节点"""
+        if not self._hashes:
+            raise LookupError('没有可用的节点')
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[index]
+
+
+class SessionRouter:
+    def __init__(self, nodes: Iterable[str], vnodes: int = None, admin_token: str = None, timeout: float = 60):
+        import requests
+        self.vnodes = vnodes or int(os.environ.get('BOT_ROUTER_VNODES', DEFAULT_VNODES))
+        self.ring = HashRing([node.rstrip('/') for node in nodes], self.vnodes)
+        self.previous = None  # 迁移进行中时的旧环
+        self.admin_token = admin_token if admin_token is not None else os.environ.get('BOT_ADMIN_TOKEN', '')
+        self.timeout = timeout
+        self.http = requests.Session()
+        self._locks = [threading.Lock() for _ in range(64)]  # 同一会话的迁移串行进行
+        self._rebalance_lock = threading.Lock()
+        self.stats = {'requests': 0, 'retries': 0, 'errors': 0, 'migrated': 0, 'migrated_on_request': 0,
+                      'rebalances': 0}
+
+    @property
+    def _admin_headers(self) -> Dict[str, str]:
+        return {ADMIN_TOKEN_HEADER: self.admin_token}
+
+    # ------------------------------------------------------------ 选择节点和迁移
+
+    def node_for(self, session_id: str) -> str:
+        """负责该会话的节点；迁移进行中且会话换了节点时，先把会话迁移过去"""
+        ring, previous = self.ring, self.previous
+        node = ring.node_for(session_id)
+        if previous is not None and len(previous):
+            old = previous.node_for(session_id)
+            try:
+                if old != node and self.migrate(session_id, old, node):
+                    self.stats['migrated_on_request'] += 1
+            except Exception as e:
+                # 原节点不可用时会话无法迁移，请求照常发给新节点
+                print(f"迁移会话失败: {session_id} {old} -> {node}, 错误: {e}")
+        return node
+
+    def migrate(self, session_id: str, source: str, target: str) -> bool:
+        """把会话从 source 交接到 target，source 上没有该会话时返回 False"""
+        with self._locks[_hash(session_id) % len(self._locks)]:
+            response = self.http.post(f'{source}/admin/sessions/{session_id}/handoff',
+                                      headers=self._admin_headers, timeout=self.timeout)
+            if response.status_code == 404:
+                return False
+            response.raise_for_status()
+            state = response.json()['state']
+            try:
+                self.http.put(f'{target}/admin/sessions/{session_id}', json={'state': state},
+                              headers=self._admin_headers, timeout=self.timeout).raise_for_status()
+            except Exception:
+                # 新节点没有收下，放回原节点，不丢失会话
+                self.http.put(f'{source}/admin/sessions/{session_id}', json={'state': state},
+                              headers=self._admin_headers, timeout=self.timeout)
+                raise
+        self.stats['migrated'] += 1
+        return True
+
+    def set_nodes(self, nodes: Iterable[str]) -> Dict[str, object]:
+        """切换节点列表，把换了节点的会话迁移到新节点，返回迁移统计
+
+        要移除的节点在迁移完成之前需要保持运行。
+        """
+        with self._rebalance_lock:
+            started = time.perf_counter()
+            ring = HashRing([node.rstrip('/') for node in nodes], self.vnodes)
+            previous, self.previous, self.ring = self.ring, self.ring, ring
+            moved = checked = failed = 0
+            try:
+                for node in previous.nodes:
+                    try:
+                        response = self.http.get(f'{node}/admin/sessions', headers=self._admin_headers,
+                                                 timeout=self.timeout)
+                        response.raise_for_status()
+                        session_ids = response.json()['sessions']
+                    except Exception as e:
+                        print(f"获取节点的会话列表失败: {node}, 错误: {e}")
+                        continue
+                    for session_id in session_ids:
+                        checked += 1
+                        target = ring.node_for(session_id)
+                        if target == node:
+                            continue
+                        try:
+                            moved += self.migrate(session_id, node, target)
+                        except Exception as e:
+                            failed += 1
+                            print(f"迁移会话失败: {session_id} {node} -> {target}, 错误: {e}")
+            finally:
+                self.previous = None
+            self.stats['rebalances'] += 1
+            return {'nodes': ring.nodes, 'checked': checked, 'moved': moved, 'failed': failed,
+                    'seconds': time.perf_counter() - started}
+
+    def add_node(self, node: str) -> Dict[str, object]:
+        return self.set_nodes(self.ring.nodes + [node.rstrip('/')])
+
+    def remove_node(self, node: str) -> Dict[str, object]:
+        return self.set_nodes([n for n in self.ring.nodes if n != node.rstrip('/')])
+
+    # ------------------------------------------------------------ 转发
+
+    def forward(self, path: str, session_id: str, data: bytes, headers: Dict[str, str], stream: bool = False):
+        """把请求转发给负责该会话的节点，返回 (节点, requests.Response)"""
+        self.stats['requests'] += 1
+        headers = dict(headers, **{SESSION_HEADER: session_id})
+        for attempt in range(3):
+            node = self.node_for(session_id)
+            response = self.http.post(node + path, data=data, headers=headers, timeout=self.timeout, stream=stream)
+            if response.status_code != 409:
+                return node, response
+            # 会话刚刚从该节点迁移走，按最新的环重新选择节点
+            response.close()
+            self.stats['retries'] += 1
+        return node, response
+
+
+def create_app(router: SessionRouter = None):
+    """路由层的 Flask 应用；不传 router 时按环境变量 BOT_ROUTER_NODES（逗号分隔）创建"""
+    from flask import Flask, Response, jsonify, request
+    import tracing
+
+    if router is None:
+        nodes = [node for node in os.environ.get('BOT_ROUTER_NODES', '').split(',') if node.strip()]
+        router = SessionRouter(nodes)
+    app = Flask(__name__)
+    app.config['router'] = router
+
+    def proxy(path: str, stream: bool = False):
+        session_id = resolve_session_id(request.headers, request.cookies) or new_session_id()
+        headers = {name: request.headers[name] for name in FORWARD_HEADERS if name in request.headers}
+        try:
+            node, upstream = router.forward(path, session_id, request.get_data(), headers, stream=stream)
+        except Exception as e:
+            router.stats['errors'] += 1
+            return jsonify({'status': 'error', 'message': f'节点不可用: {e}'}), 502
+        result_headers = {name: upstream.headers[name] for name in RETURN_HEADERS if name in upstream.headers}
+        result_headers[NODE_HEADER] = node
+        if stream:
+            return Response(upstream.iter_content(chunk_size=None), status=upstream.status_code,
+                            headers=result_headers)
+        return Response(upstream.content, status=upstream.status_code, headers=result_headers)
+
+    @app.route('/api/bot', methods=['POST'])
+    def chat():
+        return proxy('/api/bot')
+
+    @app.route('/api/bot/stream', methods=['POST'])
+    def chat_stream():
+        return proxy('/api/bot/stream', stream=True)
+
+    def admin_error():
+        if not tracing.admin_authorized(request.headers):
+            return jsonify({'status': 'error', 'message': '无权访问'}), 403
+        return None
+
+    @app.route('/router/nodes', methods=['GET', 'POST'])
+    def nodes():
+        error = admin_error()
+        if error:
+            return error
+        if request.method == 'GET':
+            return jsonify({'status': 'success', 'nodes': router.ring.nodes, 'vnodes': router.vnodes,
+                            'stats': router.stats})
+        data = request.get_json(silent=True) or {}
+        if isinstance(data.get('nodes'), list):
+            report = router.set_nodes(data['nodes'])
+        elif isinstance(data.get('add'), str):
+            report = router.add_node(data['add'])
+        elif isinstance(data.get('remove'), str):
+            report = router.remove_node(data['remove'])
+        else:
+            return jsonify({'status': 'error', 'message': '需要 nodes、add 或 remove 字段'}), 400
+        return jsonify(dict(report, status='success'))
+
+    @app.route('/router/sessions/<session_id>')
+    def session_state(session_id):
+        error = admin_error()
+        if error:
+            return error
+        if not is_valid_session_id(session_id):
+            return jsonify({'status': 'error', 'message': '会话ID不合法'}), 400
+        node = router.node_for(session_id)
+        upstream = router.http.get(f'{node}/admin/sessions/{session_id}', headers=router._admin_headers,
+                                   timeout=router.timeout)
+        return Response(upstream.content, status=upstream.status_code,
+                        headers={'Content-Type': 'application/json', NODE_HEADER: node})
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='多节点会话路由（一致性哈希）')
+    parser.add_argument('--node', action='append', default=[], help='节点网址，可重复')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 8000)))
+    args = parser.parse_args()
+    nodes = args.node or [node for node in os.environ.get('BOT_ROUTER_NODES', '').split(',') if node.strip()]
+    if not nodes:
+        parser.error('需要 --node 或环境变量 BOT_ROUTER_NODES')
+    create_app(SessionRouter(nodes)).run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
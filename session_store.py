@@ -0,0 +1,274 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+SESSION_HEADER = 'X-Session-ID'
+SESSION_COOKIE = 'session_id'
+_SESSION_ID_RE = re.compile(r'^[A-Za-z0-9_\-]{8,128}$')
+
+
+def is_valid_session_id(session_id) -> bool:
+    """检查会话ID格式是否合法"""
+    return isinstance(session_id, str) and bool(_SESSION_ID_RE.match(session_id))
+
+
+def resolve_session_id(headers, cookies) -> Optional[str]:
+    """从请求头或 Cookie 中取出会话ID，格式不合法时返回 None"""
+    session_id = headers.get(SESSION_HEADER) or cookies.get(SESSION_COOKIE)
+    if is_valid_session_id(session_id):
+        return session_id
+    return None
+
+
+def new_session_id() -> str:
+    """生成新的会话ID"""
+    return uuid.uuid4().hex
+
+
+class SessionStore:
+    """会话存储：按会话ID保存每个用户的对话状态，LRU 限制数量并淘汰空闲会话
+
+    factory 用于创建新的会话对象，会话对象需要提供 export_session()/import_session()
+    以便淘汰时写入磁盘、再次访问时恢复。
+
+    state 为 state_service.StateClient 时，会话状态保存在状态服务中（代替 spill_dir）：
+    每次请求后调用 save() 写回，其他进程写入同一会话时丢弃本地的副本，下次访问时重新读取。
+    """
+    def __init__(self, factory: Callable[[], Any], max_sessions: int = 1000,
+                 idle_timeout: float = 1800, spill_dir: str = None,
+                 sweep_interval: float = 60, state=None):
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.spill_dir = spill_dir
+        self.sweep_interval = sweep_interval
+        self.state = state
+        self._sessions = OrderedDict()  # 会话ID -> [会话对象, 最近访问时间]
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+        self._moved = OrderedDict()  # 已经交给其他节点的会话ID（最多 max_sessions 个）
+        self.stats = {'created': 0, 'restored': 0, 'evicted': 0, 'expired': 0, 'spilled': 0,
+                      'saved': 0, 'invalidated': 0, 'handed_off': 0, 'imported': 0}
+
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+        if state is not None:
+            from state_service import SESSION
+            state.on_change(SESSION, lambda session_id, _: self.discard(session_id))
+
+    @classmethod
+    def from_env(cls, factory: Callable[[], Any], max_sessions: int = 1000,
+                 idle_timeout: float = 1800, state=None) -> 'SessionStore':
+        """按环境变量创建会话存储，参数为未设置环境变量时的默认值"""
+        return cls(
+            factory,
+            max_sessions=int(os.environ.get('BOT_MAX_SESSIONS', max_sessions)),
+            idle_timeout=float(os.environ.get('BOT_SESSION_IDLE_TIMEOUT', idle_timeout)),
+            spill_dir=os.environ.get('BOT_SESSION_DIR'),
+            state=state
+        )
+
+    def get(self, session_id: str) -> Any:
+        """获取会话对象，不存在时从磁盘恢复或新建"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                entry[1] = now
+                self._sessions.move_to_end(session_id)
+                return entry[0]
+
+        # 在锁外创建和恢复，避免阻塞其它会话
+        session = self.factory()
+        state = self._load_spilled(session_id)
+        if state is not None:
+            session.import_session(state)
+
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                # 并发请求已经创建了同一个会话
+                entry[1] = now
+                self._sessions.move_to_end(session_id)
+                return entry[0]
+            if session_id in self._moved:
+                # 恢复期间会话刚刚交给其他节点，不再登记到本节点
+                return session
+            self._sessions[session_id] = [session, now]
+            self.stats['restored' if state is not None else 'created'] += 1
+            evicted = self._evict_locked(now)
+
+        self._spill(evicted)
+        return session
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def ids(self) -> List[str]:
+        """内存中的会话ID"""
+        with self._lock:
+            return list(self._sessions)
+
+    def export(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """导出会话状态（不删除），会话不存在时返回 None"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+        if entry is not None:
+            return entry[0].export_session()
+        return self._load_spilled(session_id)
+
+    def handoff(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """把会话交给其他节点：导出状态并从本节点删除，会话不存在时返回 None
+
+        导出时等待该会话正在处理的请求结束；之后本节点对该会话的请求应当返回“已迁移”（见 is_moved）。
+        """
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            self._moved[session_id] = True
+            self._moved.move_to_end(session_id)
+            while len(self._moved) > self.max_sessions:
+                self._moved.popitem(last=False)
+        state = entry[0].export_session() if entry is not None else self._load_spilled(session_id)
+        self._delete_persisted(session_id)
+        if state is not None:
+            self.stats['handed_off'] += 1
+        return state
+
+    def put(self, session_id: str, state: Dict[str, Any]) -> None:
+        """导入其他节点交来的会话，替换本节点已有的同名会话"""
+        session = self.factory()
+        session.import_session(state)
+        now = time.monotonic()
+        with self._lock:
+            self._moved.pop(session_id, None)
+            self._sessions[session_id] = [session, now]
+            self._sessions.move_to_end(session_id)
+            self.stats['imported'] += 1
+            evicted = self._evict_locked(now)
+        self._spill(evicted)
+        self.save(session_id)
+
+    def is_moved(self, session_id: str) -> bool:
+        """会话是否已经交给其他节点"""
+        return session_id in self._moved
+
+    def drop(self, session_id: str) -> None:
+        """删除会话（包括磁盘上或状态服务中的副本）"""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+        self._delete_persisted(session_id)
+
+    def _delete_persisted(self, session_id: str) -> None:
+        if self.state is not None:
+            try:
+                self.state.delete_session(session_id)
+            except Exception as e:
+                print(f"删除会话时出错: {session_id}, 错误: {e}")
+        path = self._spill_path(session_id)
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    def discard(self, session_id: str) -> None:
+        """丢弃内存中的会话，不写回（其他进程已经写入了更新的状态）"""
+        with self._lock:
+            if self._sessions.pop(session_id, None) is not None:
+                self.stats['invalidated'] += 1
+
+    def save(self, session_id: str) -> None:
+        """请求处理完后把会话写回状态服务；没有使用状态服务时什么也不做"""
+        if self.state is None:
+            return
+        with self._lock:
+            entry = self._sessions.get(session_id)
+        if entry is None:
+            return
+        try:
+            self.state.put_session(session_id, entry[0].export_session())
+            self.stats['saved'] += 1
+        except Exception as e:
+            print(f"保存会话时出错: {session_id}, 错误: {e}")
+
+    def evict_idle(self) -> int:
+        """淘汰空闲超时的会话，返回淘汰数量"""
+        with self._lock:
+            evicted = self._evict_locked(time.monotonic(), force_sweep=True)
+        self._spill(evicted)
+        return len(evicted)
+
+    def flush(self) -> None:
+        """把内存中的所有会话写入磁盘（用于进程退出前）"""
+        with self._lock:
+            sessions = [(sid, entry[0]) for sid, entry in self._sessions.items()]
+        self._spill(sessions)
+
+    def _evict_locked(self, now: float, force_sweep: bool = False):
+        """按容量和空闲时间淘汰会话，返回被淘汰的 (会话ID, 会话对象) 列表"""
+        evicted = []
+        while len(self._sessions) > self.max_sessions:
+            session_id, (session, _) = self._sessions.popitem(last=False)
+            evicted.append((session_id, session))
+            self.stats['evicted'] += 1
+
+        # 空闲检查按间隔进行，OrderedDict 头部就是最久未访问的会话
+        if force_sweep or now - self._last_sweep >= self.sweep_interval:
+            self._last_sweep = now
+            while self._sessions:
+                session_id, (session, last_access) = next(iter(self._sessions.items()))
+                if now - last_access < self.idle_timeout:
+                    break
+                self._sessions.popitem(last=False)
+                evicted.append((session_id, session))
+                self.stats['expired'] += 1
+        return evicted
+
+    def _spill_path(self, session_id: str) -> Optional[str]:
+        if not self.spill_dir:
+            return None
+        digest = hashlib.sha1(session_id.encode('utf-8')).hexdigest()
+        return os.path.join(self.spill_dir, f'{digest}.json')
+
+    def _spill(self, sessions) -> None:
+        """把会话状态写入磁盘"""
+        # 使用状态服务时每次请求后已经写回，淘汰时不再写入（本地副本可能已经比服务端旧）
+        if self.state is not None or not self.spill_dir:
+            return
+        for session_id, session in sessions:
+            path = self._spill_path(session_id)
+            tmp_path = f'{path}.tmp'
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(session.export_session(), f, ensure_ascii=False, separators=(',', ':'))
+                os.replace(tmp_path, path)
+                self.stats['spilled'] += 1
+            except (OSError, TypeError, ValueError) as e:
+                print(f"保存会话时出错: {session_id}, 错误: {e}")
+
+    def _load_spilled(self, session_id: str) -> Optional[Dict[str, Any]]:
+        if self.state is not None:
+            try:
+                return self.state.get_session(session_id)
+            except Exception as e:
+                print(f"读取会话时出错: {session_id}, 错误: {e}")
+                return None
+        path = self._spill_path(session_id)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取会话存储统计信息"""
+        with self._lock:
+            return dict(self.stats, active=len(self._sessions), max_sessions=self.max_sessions)
@@ -3,20 +3,33 @@ import random
 import re
 import json
 import os
-import requests
-from urllib.parse import quote, urljoin
-from bs4 import BeautifulSoup
-import openai
-import jieba
-import numpy as np
+import pickle
+from urllib.parse import urljoin
 from collections import Counter
 from urllib.parse import urlparse
 import threading
 import queue
 import time
+import contextlib
+try:
+    import fcntl
+except ImportError:  # Windows 上没有 fcntl：单进程运行，不需要进程间的文件锁
+    fcntl = None
 from cognitive_system import CognitiveSystem
 from emotional_system import EmotionalState, SelfReflection
 from self_improvement import SelfImprovement
+from intent_router import IntentRouter
+import tokenizer
+import serp
+import fetcher
+import llm_gateway
+import state_service
+from learning_trigger import LearningTrigger
+from scheduler import SCHEDULER, LEARNING, ANALYSIS, checkpoint
+from qa_index import QAIndex
+from retention import RingLog
+from metrics import REGISTRY, timed, track
+from typing import Tuple, Dict, Any
 import logging
 
 logging.basicConfig(
@@ -25,6 +38,76 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+HELP_TEXT = '''我可以:
+1. 打招呼和聊天
+2. 记住你的名字（试试说"我叫小明"）
+3. 做简单计算（如"计算 1+1"）
+4. 显示时间
+5. 理解和表达情感：
+   - 问我"你的心情"
+   - 和我分享你的感受
+   - 我会理解你的情绪并共情
+6. 自主学习：
+   - 输入"自主学习xxx"开始学习某个主题
+   - 输入"学习xxx的进度"查看学习状态
+   - 说"学习xxx"或"告诉我关于xxx"来主动学习
+   - 查看"学习历史"了解我学到了什么
+7. 独立思考：
+   - 进行逻辑分析和推理
+   - 帮助做出决策（试试问我"应该xxx还是xxx？"）
+   - 分享相关的记忆和经验
+8. 教我新知识：
+   - 说"问题是:xxx,答案是:xxx"
+   - 更正答案：说"记住xxx的正确答案是xxx"
+9. 自我优化：
+   - 说"自我优化"让我分析和改进自己
+   - 说"添加新功能:xxx"让我设计新功能
+   - 我会定期自动检查和优化自己的代码'''
+
+FALLBACK_RESPONSES = [
+    '抱歉，我还不太明白你的意思',
+    '能换个方式说吗？',
+    '这个问题有点难，让我思考一下...',
+    '让我好好想想这个问题！'
+]
+
+def split_reply(reply: str, max_chunk: int = 64):
+    """把回复按行切分为适合流式发送的片段，过长的行再按长度切分"""
+    for line in reply.splitlines(keepends=True):
+        for start in range(0, len(line), max_chunk):
+            yield line[start:start + max_chunk]
+
+@contextlib.contextmanager
+def state_file_lock(path: str):
+    """多个进程读写同一组状态文件时互斥（没有 fcntl 的平台上不加锁）"""
+    if fcntl is None:
+        yield
+        return
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+class StreamedReply:
+    """由大模型逐段生成的回复：同步代码用 for 读取（在当前线程等待），
+    异步代码用 async for 读取（在事件循环中 await，等待期间不占用线程）"""
+    def __init__(self, chunks, achunks):
+        self._chunks = chunks    # 返回同步生成器的函数
+        self._achunks = achunks  # 返回异步生成器的函数
+        
+    def __iter__(self):
+        return iter(self._chunks())
+        
+    def __aiter__(self):
+        return self._achunks().__aiter__()
+
+# 预热快照格式版本，快照内容的结构变化时递增
+SNAPSHOT_VERSION = 1
+
+CRAWL_PAGES = REGISTRY.counter('bot_crawl_pages_total', '自主学习访问的网页数', ['outcome'])
+
 class WebLearner:
     def __init__(self):
         self.visited_urls = set()
@@ -32,69 +115,179 @@ class WebLearner:
         self.knowledge_base = {}
         self.learning = False
         self.max_pages = 50  # 每次学习最多访问的页面数
+        self.search_engines = dict(serp.ENGINES)  # 引擎名 -> 结果页网址模板
+        # 每个网页最多下载的字节数，超出部分不下载
+        self.max_page_bytes = int(os.environ.get('BOT_CRAWL_MAX_BYTES', fetcher.DEFAULT_MAX_BYTES))
+        self.offline = os.environ.get('BOT_OFFLINE') == '1'  # 离线模式下不联网学习
+        self.stats = {}  # 最近一次学习的统计
+        self.api_key = None  # 本次学习生成摘要使用的用户密钥（为空时使用网关配置的密钥）
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._done.set()
         
-    def start_learning(self, topic):
-        """开始自主学习某个主题"""
-        if self.learning:
+    def start_learning(self, topic, seed_urls=None, api_key: str = None):
+        """开始自主学习某个主题，seed_urls 为起始网址（默认从各搜索引擎的结果开始）"""
+        if self.offline:
+            return f"我现在处于离线模式，暂时无法学习关于{topic}的知识。"
+        if not self.try_start_learning(topic, seed_urls, api_key=api_key):
             return "我正在学习中，请稍后再试..."
+        return "我开始学习了！我会自动浏览网页并学习相关知识..."
         
-        self.learning = True
-        self.visited_urls.clear()
+    def try_start_learning(self, topic, seed_urls=None, background: bool = True, api_key: str = None) -> bool:
+        """在后台开始学习，已经有学习在进行时返回 False
+
+        background=False 时在当前线程中学习（调用方已经是调度器中的学习任务），学完才返回。
+        api_key 为发起学习的用户在请求中携带的 OpenAI 密钥，用于生成摘要。
+        """
+        # 检查并设置学习标志需要是原子操作，避免多个请求同时启动学习
+        with self._lock:
+            if self.learning:
+                return False
+            self.learning = True
+            
+        self.visited_urls = set()
         self.url_queue = queue.Queue()
+        self.api_key = api_key
+        self._done.clear()
+        self.stats = {
+            'topic': topic,
+            'pages': 0,            # 成功处理的网页数
+            'errors': 0,           # 出错的网页数
+            'bytes': 0,            # 下载的字节数
+            'bytes_avoided': 0,    # 因跳过非网页内容或超出大小上限而没有下载的字节数（已知长度时）
+            'skipped': 0,          # 跳过的非网页内容数
+            'truncated': 0,        # 超出大小上限被截断的网页数
+            'charset_detected': 0, # 需要运行字符集检测的网页数
+            'duplicate_urls': 0,   # 出队时发现已经访问过的网址数
+            'relevant': 0,         # 与主题相关、被采用的网页数
+            'serp_results': 0,     # 各搜索引擎合并去重后的结果数
+            'serp_filtered': 0,    # 因摘要与主题无关而没有抓取的结果数
+            'serp_errors': 0,      # 获取或解析失败的结果页数
+            'started': time.time(),
+            'finished': None,
+            'summarized': None     # 生成摘要（写入知识库）的时间
+        }
         
-        # 初始搜索引擎
-        search_engines = [
-            f"https://www.baidu.com/s?wd={quote(topic)}",
-            f"https://www.sogou.com/web?query={quote(topic)}",
-            f"https://cn.bing.com/search?q={quote(topic)}"
-        ]
-        
-        for url in search_engines:
+        for url in seed_urls or []:
             self.url_queue.put(url)
             
-        # 启动学习线程
-        thread = threading.Thread(target=self._learn_process, args=(topic,))
-        thread.daemon = True
-        thread.start()
+        if background:
+            # 由调度器在学习类任务中执行（CPU 份额和运行时限见 scheduler.py）
+            SCHEDULER.submit(self._learn_process, (topic, not seed_urls), name=f'learn:{topic}', cls=LEARNING)
+        else:
+            self._learn_process(topic, not seed_urls)
+        return True
         
-        return "我开始学习了！我会自动浏览网页并学习相关知识..."
+    def wait(self, timeout: float = None) -> bool:
+        """等待当前的学习结束，超时返回 False"""
+        return self._done.wait(timeout)
+        
+    def _fetch(self, url):
+        """流式下载网页，返回 fetcher.Page；非网页内容抛出 fetcher.SkippedPage"""
+        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+        try:
+            page = fetcher.fetch(url, max_bytes=self.max_page_bytes, timeout=10, headers=headers)
+        except fetcher.SkippedPage as e:
+            self.stats['skipped'] += 1
+            self.stats['bytes_avoided'] += e.bytes_avoided
+            raise
+        self.stats['bytes'] += page.bytes
+        self.stats['bytes_avoided'] += page.bytes_avoided
+        self.stats['truncated'] += page.truncated
+        self.stats['charset_detected'] += page.charset_source == 'detect'
+        return page
+        
+    @timed('crawl_search')
+    def _search(self, topic):
+        """同时获取各搜索引擎的结果页，只取自然搜索结果，按倒数排名融合合并去重
+
+        摘要与主题无关的结果不抓取，网页预算只花在真正的搜索结果上。
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        
+        def search(item):
+            engine, url = item
+            try:
+                with track('crawl_fetch'):
+                    response = self._fetch(url)
+                with track('crawl_parse'):
+                    return serp.extract(engine, response.text, response.url)
+            except Exception as e:
+                self.stats['serp_errors'] += 1
+                print(f"获取搜索结果时出错: {url}, 错误: {e}")
+                return []
+                
+        urls = serp.search_urls(topic, self.search_engines)
+        with ThreadPoolExecutor(max_workers=len(urls) or 1) as pool:
+            rankings = list(pool.map(search, urls.items()))
+        results = serp.rrf_merge(rankings)
+        self.stats['serp_results'] = len(results)
+        for result in results:
+            if self._is_relevant(f"{result['title']} {result['snippet']}", topic):
+                self.url_queue.put(result['url'])
+            else:
+                self.stats['serp_filtered'] += 1
+        return results
         
-    def _learn_process(self, topic):
-        """学习处理过程"""
+    def _learn_process(self, topic, search=False):
+        """学习处理过程，search 为 True 时先从搜索引擎获取起始网址"""
         try:
             pages_visited = 0
             knowledge_pieces = []
+            if search:
+                self._search(topic)
             
             while not self.url_queue.empty() and pages_visited < self.max_pages:
+                # 每个网页之间为请求让出，调度器关闭或超出时限时在这里退出
+                checkpoint()
                 url = self.url_queue.get()
                 if url in self.visited_urls:
+                    self.stats['duplicate_urls'] += 1
                     continue
                     
                 try:
                     # 获取网页内容
-                    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
-                    response = requests.get(url, headers=headers, timeout=10)
-                    response.encoding = response.apparent_encoding
-                    soup = BeautifulSoup(response.text, 'html.parser')
-                    
-                    # 提取正文内容
-                    text = self._extract_main_content(soup)
-                    if text:
-                        # 分析文本相关性
-                        if self._is_relevant(text, topic):
-                            knowledge_pieces.append(text)
+                    with track('crawl_fetch'):
+                        response = self._fetch(url)
+                        
+                    with track('crawl_parse'):
+                        if response.is_html:
+                            from bs4 import BeautifulSoup
+                            soup = BeautifulSoup(response.text, 'html.parser')
                             
-                    # 提取更多链接
-                    links = soup.find_all('a', href=True)
-                    for link in links:
-                        new_url = urljoin(url, link['href'])
-                        if self._is_valid_url(new_url) and new_url not in self.visited_urls:
-                            self.url_queue.put(new_url)
+                            # 提取正文内容
+                            text = self._extract_main_content(soup)
+                        else:
+                            # 纯文本没有标签和链接，直接按行提取
+                            soup = None
+                            text = self._extract_plain_text(response.text)
+                        if text:
+                            # 分析文本相关性
+                            if self._is_relevant(text, topic):
+                                knowledge_pieces.append(text)
+                                self.stats['relevant'] += 1
+                                
+                        # 提取更多链接
+                        links = soup.find_all('a', href=True) if soup is not None else []
+                        for link in links:
+                            new_url = urljoin(url, link['href'])
+                            if self._is_valid_url(new_url) and new_url not in self.visited_urls:
+                                self.url_queue.put(new_url)
                             
                     self.visited_urls.add(url)
                     pages_visited += 1
+                    self.stats['pages'] += 1
+                    CRAWL_PAGES.labels('ok').inc()
+                    
+                except fetcher.SkippedPage:
+                    # 非网页内容：不计入页面预算，也不再访问
+                    self.visited_urls.add(url)
+                    CRAWL_PAGES.labels('skipped').inc()
+                    continue
                     
                 except Exception as e:
+                    self.stats['errors'] += 1
+                    CRAWL_PAGES.labels('error').inc()
                     print(f"处理URL时出错: {url}, 错误: {e}")
                     continue
                     
@@ -102,9 +295,12 @@ class WebLearner:
             if knowledge_pieces:
                 combined_knowledge = "\n".join(knowledge_pieces)
                 self.knowledge_base[topic] = self._summarize_knowledge(combined_knowledge)
+                self.stats['summarized'] = time.time()
                 
         finally:
+            self.stats['finished'] = time.time()
             self.learning = False
+            self._done.set()
             
     def _extract_main_content(self, soup):
         """提取网页主要内容"""
@@ -123,11 +319,17 @@ class WebLearner:
                 
         return "\n".join(text_pieces)
         
+    def _extract_plain_text(self, text):
+        """提取纯文本内容，与网页一样只保留较长的段落"""
+        lines = (line.strip() for line in text.splitlines())
+        return "\n".join(line for line in lines if len(line) > 50)
+        
+    @timed('relevance')
     def _is_relevant(self, text, topic):
         """判断文本是否��主题相关"""
         # 使用jieba分词
-        topic_words = set(jieba.cut(topic))
-        text_words = set(jieba.cut(text))
+        topic_words = set(tokenizer.cut(topic))
+        text_words = set(tokenizer.cut(text))
         
         # 计算相关性
         common_words = topic_words & text_words
@@ -141,6 +343,7 @@ class WebLearner:
         except:
             return False
             
+    @timed('crawl_summarize')
     def _summarize_knowledge(self, text):
         """总结学到的知识"""
         # 分段处理长文本
@@ -165,15 +368,11 @@ class WebLearner:
     def _get_summary(self, text):
         """使用GPT生成摘要"""
         try:
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "你是一个帮助总结文章的助手。请简明扼要地总结以下内容的要点："},
-                    {"role": "user", "content": text}
-                ]
-            )
-            return response.choices[0].message['content']
-        except:
+            return llm_gateway.chat([
+                {"role": "system", "content": "你是一个帮助总结文章的助手。请简明扼要地总结以下内容的要点："},
+                {"role": "user", "content": text}
+            ], caller='summary', api_key=self.api_key)
+        except llm_gateway.LLMError:
             # 如果API调用失败，使用简单的提取式摘要
             sentences = text.split('。')
             return "。".join(sentences[:3]) + "。"  # 返回前三句话
@@ -188,14 +387,26 @@ class WebLearner:
             return f"我还没有学习过关于{topic}的知识。"
 
 class SimpleBot:
-    def __init__(self, name):
+    # 会话之间共享的组件（知识库、学习模块、路由表等以读为主的数据）
+    SHARED_ATTRS = (
+        'name', 'max_chat_history', 'log_dir', 'knowledge_file', 'learning_history_file',
+        'cognitive_state_file', 'emotional_state_file', 'self_improvement_state_file', 'state_lock_file',
+        'web_learner', 'learning_trigger', 'self_improvement', 'greetings', 'emotions',
+        'learned_responses', 'qa_index', '_knowledge_lock', 'learning_history', 'router', 'state'
+    )
+    
+    def __init__(self, name, background: bool = True):
+        """background=False 时不启动后台线程，之后调用 start_background（用于 gunicorn 预加载后 fork）"""
         self.name = name
-        self.user_name = None
-        self.chat_history = []
+        self.max_chat_history = 200  # 内存中保留的对话条数
+        self.log_dir = os.environ.get('BOT_LOG_DIR')  # 设置后淘汰的日志写入该目录
         self.knowledge_file = 'bot_knowledge.json'
         self.learning_history_file = 'learning_history.json'
         self.cognitive_state_file = 'cognitive_state.json'
         self.emotional_state_file = 'emotional_state.json'
+        self.self_improvement_state_file = 'self_improvement_state.json'
+        self.state_lock_file = 'bot_state.lock'  # 多个 worker 写状态文件时的进程间锁
+        self._owns_state = True  # 只有主实例负责保存状态文件
         
         # API密钥（需要替换为实际的API密钥）
         self.openai_api_key = ''  # OpenAI API密钥
@@ -203,22 +414,25 @@ class SimpleBot:
         
         # 初始化OpenAI客户端
         if self.openai_api_key:
-            openai.api_key = self.openai_api_key
+            llm_gateway.configure(api_key=self.openai_api_key)
         
         # 初始化自主学习模块
         self.web_learner = WebLearner()
+        self.learning_trigger = LearningTrigger(self.web_learner)
         
         # 初始化认知系统
         self.cognitive = CognitiveSystem()
-        self.load_cognitive_state()
         
-        # 初始化情感系统
-        self.emotional = EmotionalState()
-        self.self_reflection = SelfReflection(self.emotional)
-        self.load_emotional_state()
+        # 设置 BOT_STATE_SOCKET 时，长期记忆、学到的知识、教学问答和会话由本地状态服务保存，
+        # 多个 worker 进程共用（见 state_service.py）
+        self.state = state_service.from_env()
+        
+        # 初始化对话状态和情感系统
+        self._init_conversation_state(self.log_dir)
         
-        # 初始化自我优化系统
+        # 初始化自我优化系统，继续累计上次运行的函数统计（热点排名不因重启而清空）
         self.self_improvement = SelfImprovement(self.openai_api_key)
+        self.self_improvement.load_state(self.self_improvement_state_file)
         
         # 基础回复模板
         self.greetings = [
@@ -233,59 +447,322 @@ class SimpleBot:
             '生气': ['深呼吸，冷静一下', '让我们换个话题吧', '我理解你的感受']
         }
 
-        # 加载知识库
-        self.learned_responses = self.load_knowledge()
-        self.learning_history = self.load_learning_history()
+        # 加载状态：使用状态服务时长期记忆和知识直接使用服务的本地副本；
+        # 否则优先从预热快照恢复，快照不可用时读取各状态文件
+        if self.state is not None:
+            self.cognitive.memory.store = self.state.memory
+            self.web_learner.knowledge_base = self.state.knowledge
+            self.learned_responses = self.state.qa
+            self.load_emotional_state()
+            self.learning_history = self.load_learning_history()
+        elif not self.restore_snapshot(os.environ.get('BOT_SNAPSHOT')):
+            self.load_cognitive_state()
+            self.load_emotional_state()
+            self.learned_responses = self.load_knowledge()
+            self.learning_history = self.load_learning_history()
+        # 教学问答的模糊匹配索引
+        self.qa_index = QAIndex(self.learned_responses, threshold=float(os.environ.get('BOT_QA_THRESHOLD', 0.75)))
+        if self.state is not None:
+            # 其他进程教的问答也加入索引
+            self.state.on_change(state_service.QA, lambda question, answer: answer is not None
+                                 and self.qa_index.add(question, answer))
+        self._knowledge_lock = threading.Lock()
         
-        # 启动自我优化线程
-        self._start_self_improvement_thread()
+        # 构建意图路由表（只在启动时构建一次，所有会话共用）
+        self.router = self._build_router()
         
-    def _start_self_improvement_thread(self):
-        """启动自我优化线程"""
-        def improvement_loop():
-            while True:
-                try:
-                    # 分析自身代码
-                    analysis = self.self_improvement.analyze_self()
-                    
-                    # 获取改进建议
-                    suggestions = self.self_improvement.suggest_improvements()
-                    
-                    if suggestions:
-                        print("\n[自我优化] 发现可能的改进点：")
-                        for suggestion in suggestions:
-                            print(f"- {suggestion['type']}: {suggestion['suggestion']}")
-                            
-                            # 尝试实现改进
-                            if suggestion['priority'] == 'high':
-                                success = self.self_improvement.implement_improvement(suggestion)
-                                if success:
-                                    print(f"[自我优化] 已生成改进建议，等待审查")
-                                    
-                    # 保存优化状态
-                    self.self_improvement.save_state()
-                    
-                    # 每隔一段时间进行一次自我优化检查
-                    time.sleep(3600)  # 每小时检查一次
-                    
-                except Exception as e:
-                    print(f"[自我优化] 出错: {e}")
-                    time.sleep(300)  # 出错后等待5分钟再试
-                    
-        # 启动优化线程
-        thread = threading.Thread(target=improvement_loop)
-        thread.daemon = True
-        thread.start()
+        # 启动自我优化等后台任务
+        self._background_started = False
+        if background:
+            self.start_background()
+        
+    def start_background(self):
+        """启动后台任务（每个进程只启动一次），进程退出时由调度器保存状态"""
+        if self._background_started:
+            return
+        self._background_started = True
+        if self.state is not None:
+            self.state.start()
+        if self._owns_state:
+            SCHEDULER.on_shutdown(self.flush_state)
+        self._schedule_self_improvement()
+        
+    def _init_conversation_state(self, spill_dir: str = None):
+        """初始化每个会话独立的对话状态"""
+        # 同一会话的消息串行处理，会话内的状态只有一个写入者
+        self._respond_lock = threading.RLock()
+        self.user_name = None
+        self.chat_history = RingLog(
+            self.max_chat_history,
+            spill_path=os.path.join(spill_dir, 'chat_history.jsonl') if spill_dir else None
+        )
+        self.emotional = EmotionalState()
+        self.self_reflection = SelfReflection(self.emotional, spill_dir=spill_dir)
+        
+    def new_session(self) -> 'SimpleBot':
+        """创建一个会话实例：共享知识库等组件，独立保存对话历史、情感状态和短期记忆"""
+        session = object.__new__(SimpleBot)
+        for attr in self.SHARED_ATTRS:
+            setattr(session, attr, getattr(self, attr))
+        session._owns_state = False
+        # 请求中携带的 OpenAI 密钥只用于该会话发起的大模型调用
+        session.openai_api_key = ''
+        session.cognitive = self.cognitive.fork()
+        session._init_conversation_state()
+        return session
+        
+    def export_session(self) -> Dict[str, Any]:
+        """导出会话状态（可序列化为JSON）"""
+        with self._respond_lock:
+            return self._export_session()
+            
+    def _export_session(self) -> Dict[str, Any]:
+        return {
+            'user_name': self.user_name,
+            'chat_history': self.chat_history.snapshot(),
+            'emotional_state': self.emotional.export_state(),
+            'short_term_memory': list(self.cognitive.memory.short_term)
+        }
+        
+    def import_session(self, state: Dict[str, Any]):
+        """恢复导出的会话状态"""
+        with self._respond_lock:
+            self._import_session(state)
+            
+    def _import_session(self, state: Dict[str, Any]):
+        self.user_name = state.get('user_name')
+        self.chat_history = RingLog(self.max_chat_history)
+        self.chat_history.extend(state.get('chat_history', []))
+        self.emotional.import_state(state.get('emotional_state', {}))
+        self.cognitive.memory.short_term = list(state.get('short_term_memory', []))
+        
+    def _build_router(self) -> IntentRouter:
+        """构建意图路由表，处理函数的第一个参数是当前会话的机器人实例
+
+        处理函数返回回复字符串，或逐段生成回复的 StreamedReply（respond 会把它拼接成字符串）。
+        """
+        router = IntentRouter()
+        
+        # 指令类意图（按注册顺序决定同一位置匹配时的优先级）
+        router.register_pattern('self_improve', r'自我优化|改进自己', lambda bot: bot.improve_self())
+        # 生成新功能的回复由大模型逐段生成，respond_stream 收到一段就发送一段
+        router.register_pattern('add_feature', r'添加新功能[：:](.*)', lambda bot, desc: bot.feature_reply(desc))
+        router.register_pattern(
+            'start_learning', r'自主学习(.+)',
+            lambda bot, topic: (bot.learning_trigger.request(topic, force=True, api_key=bot.openai_api_key)
+                                or bot.web_learner.start_learning(topic, api_key=bot.openai_api_key))
+        )
+        router.register_pattern(
+            'learning_status', r'学习(.+)的进度',
+            lambda bot, topic: bot.learning_trigger.status(topic)
+        )
+        router.register_pattern(
+            'teach', r'问题是[：:]\s*(.+?)\s*[,，;；]\s*答案是[：:]\s*(.+)',
+            lambda bot, question, answer: bot.teach(question, answer)
+        )
+        router.register_pattern(
+            'correct', r'记住(.+?)的正确答案是[：:]?\s*(.+)',
+            lambda bot, question, answer: bot.teach(question, answer, correction=True)
+        )
+        
+        # 基础问答
+        router.register_exact('greeting', '你好', lambda bot: random.choice(bot.greetings))
+        router.register_exact(
+            'identity', '你是谁',
+            f'我是{self.name}，一个能够自主学习、思考和感知的智能机器人。我可以通过互联网学习新知识，具有独立的思维能力，还能理解和表达情感！我还能分析和优化自己的代码！'
+        )
+        router.register_exact('goodbye', '再见', '再见！希望很快能再次和你聊天！')
+        router.register_exact('mood', '你的心情', lambda bot: f"让我感受一下...{bot.emotional.get_response()}")
+        router.register_exact('help', '帮助', HELP_TEXT)
+        
+        return router
+        
+    def load_knowledge(self) -> Dict[str, str]:
+        """加载知识库"""
+        try:
+            with open(self.knowledge_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+            
+    def save_knowledge(self):
+        """保存知识库（使用状态服务时由服务写入文件）
+
+        与文件中已有的问答合并：多个 worker 各自保存时，不会丢失只在其他 worker 中教过的问答，
+        同一问题以本进程的答案为准。
+        """
+        if self.state is not None:
+            return
+        with self._knowledge_lock:
+            responses = dict(self.learned_responses)
+        with state_file_lock(self.state_lock_file):
+            saved = self.load_knowledge()
+            if isinstance(saved, dict):
+                responses = dict(saved, **responses)
+            tmp = f'{self.knowledge_file}.{os.getpid()}.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(responses, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.knowledge_file)
+            
+    def teach(self, question: str, answer: str, correction: bool = False) -> str:
+        """记住用户教的问答，换个说法提问也能回答"""
+        question, answer = question.strip(), answer.strip()
+        if not question or not answer:
+            return '请告诉我完整的问题和答案，比如“问题是:天空是什么颜色,答案是:蓝色”'
+        if self.state is not None:
+            # 写入状态服务（一次往返并同步），不持有锁；索引由 on_change 回调更新，与其他进程教的问答相同
+            self.learned_responses[question] = answer
+        else:
+            with self._knowledge_lock:
+                self.learned_responses[question] = answer
+                self.qa_index.add(question, answer)
+            # 写文件不占用请求：交给调度器，连续教的多条问答合并为一次写入
+            SCHEDULER.submit(self.save_knowledge, name='save-knowledge', key=f'save-knowledge:{self.knowledge_file}')
+        if correction:
+            return f'好的，已经更正：“{question}”的答案是“{answer}”。'
+        return f'好的，我记住了！以后问我“{question}”，我会回答“{answer}”。'
+            
+    def load_learning_history(self) -> list:
+        """加载学习历史"""
+        try:
+            with open(self.learning_history_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return []
+            
+    def load_cognitive_state(self):
+        """加载认知状态"""
+        self.cognitive.load_state(self.cognitive_state_file)
+        
+    def save_cognitive_state(self):
+        """保存认知状态（使用状态服务时由服务写入文件），与其他 worker 已经保存的长期记忆合并"""
+        if self.state is not None:
+            return
+        with state_file_lock(self.state_lock_file):
+            self.cognitive.save_state(self.cognitive_state_file, merge=True)
+        
+    def load_emotional_state(self):
+        """加载情感状态"""
+        self.emotional.load_state(self.emotional_state_file)
+        
+    def save_emotional_state(self):
+        """保存情感状态"""
+        self.emotional.save_state(self.emotional_state_file)
+        
+    def save_self_improvement_state(self):
+        """保存自我优化记录，与其他 worker 已经保存的函数统计和日志合并"""
+        with state_file_lock(self.state_lock_file):
+            self.self_improvement.save_state(self.self_improvement_state_file, merge=True)
+        
+    def _snapshot_sources(self) -> Dict[str, Any]:
+        """快照依赖的状态文件及其修改时间和大小（文件不存在时为 None）"""
+        sources = {}
+        for filename in (self.cognitive_state_file, self.emotional_state_file,
+                         self.knowledge_file, self.learning_history_file):
+            try:
+                st = os.stat(filename)
+                sources[filename] = (st.st_mtime_ns, st.st_size)
+            except FileNotFoundError:
+                sources[filename] = None
+        return sources
+        
+    def save_snapshot(self, filename: str):
+        """保存预热快照：把已加载的状态整体序列化，启动时一次读入，省去逐个解析 JSON"""
+        snapshot = {
+            'version': SNAPSHOT_VERSION,
+            'sources': self._snapshot_sources(),
+            'cognitive': self.cognitive.memory.store.export(),
+            'emotional': self.emotional.export_state(),
+            'learned_responses': self.learned_responses,
+            'learning_history': self.learning_history
+        }
+        tmp = f'{filename}.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, filename)
+        
+    def restore_snapshot(self, filename: str) -> bool:
+        """从预热快照恢复状态；快照不存在或状态文件在快照之后被修改过时返回 False
+        
+        快照使用 pickle，只能加载自己生成的文件（tools/prebuild.py）。
+        """
+        if not filename:
+            return False
+        try:
+            with open(filename, 'rb') as f:
+                snapshot = pickle.load(f)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            print(f"加载预热快照失败: {str(e)}")
+            return False
+        if snapshot.get('version') != SNAPSHOT_VERSION or snapshot.get('sources') != self._snapshot_sources():
+            print("预热快照已过期，从状态文件加载")
+            return False
+        cognitive = snapshot['cognitive']
+        self.cognitive.memory.store.replace(
+            memories=cognitive['long_term_memory'],
+            associations={k: set(v) for k, v in cognitive['associations'].items()}
+        )
+        self.emotional.import_state(snapshot['emotional'])
+        self.learned_responses = snapshot['learned_responses']
+        self.learning_history = snapshot['learning_history']
+        return True
+        
+    def autonomous_learning(self, message: str) -> str:
+        """遇到不会的问题时自主学习
+
+        由 learning_trigger 归一化主题：学过的主题直接回答，同一主题只学习一次，
+        最近没学到内容的主题暂时不再学习。
+        """
+        reply = self.learning_trigger.request(message, api_key=self.openai_api_key)
+        if reply is None:
+            return random.choice(FALLBACK_RESPONSES)
+        return reply
+        
+    def _schedule_self_improvement(self):
+        """把自我优化安排为周期任务（分析类，优先级最低）"""
+        if os.environ.get('BOT_SELF_IMPROVE', '1') == '0':
+            return
+        # 启动后先等待一段时间再开始分析，不和冷启动及第一批请求争抢 CPU
+        delay = float(os.environ.get('BOT_SELF_IMPROVE_DELAY', 600))
+        interval = float(os.environ.get('BOT_SELF_IMPROVE_INTERVAL', 3600))
+        # 每轮先对线上流量采样，找出实际耗时的函数
+        window = float(os.environ.get('BOT_PROFILE_WINDOW', 30))
+        # 出错后 5 分钟再试
+        SCHEDULER.every('self-improvement', interval, self._improve_once, (window,), cls=ANALYSIS,
+                        delay=delay, retry=300)
+        
+    def _improve_once(self, window: float):
+        """一轮自我优化：采样、分析自身代码、为高优先级的建议生成改进"""
+        if window > 0:
+            self.self_improvement.profile_window(window)
+            checkpoint()
+            
+        # 分析自身代码并获取改进建议（未修改的模块直接使用缓存的分析结果）
+        suggestions = self.self_improvement.suggest_improvements()
+        
+        if suggestions:
+            print("\n[自我优化] 发现可能的改进点：")
+            for suggestion in suggestions:
+                print(f"- {suggestion['type']}: {suggestion['suggestion']}")
+                
+                # 尝试实现改进
+                if suggestion['priority'] == 'high':
+                    checkpoint()
+                    success = self.self_improvement.implement_improvement(suggestion)
+                    if success:
+                        print(f"[自我优化] 已生成改进建议，等待审查")
+                        
+        # 保存优化状态
+        self.save_self_improvement_state()
         
     def improve_self(self, feature_description: str = None) -> str:
         """手动触发自我改进"""
         try:
             if feature_description:
                 # 生成新功能
-                new_feature_code = self.self_improvement.generate_new_feature(feature_description)
-                if new_feature_code:
-                    return f"我已经生成了新功能的代码建议，请审查后实施：\n{new_feature_code}"
-                return "抱歉，生成新功能时出现问题。"
+                return ''.join(self.feature_reply(feature_description))
                 
             # 分析并提出改进建议
             suggestions = self.self_improvement.suggest_improvements()
@@ -301,6 +778,35 @@ class SimpleBot:
         except Exception as e:
             return f"���我改进过程中出错: {e}"
 
+    def feature_reply(self, feature_description: str) -> StreamedReply:
+        """逐段生成新功能的回复：大模型返回的代码收到一段就输出一段"""
+        header = "我已经生成了新功能的代码建议，请审查后实施：\n"
+        failed = "抱歉，生成新功能时出现问题。"
+        api_key = self.openai_api_key
+        
+        def chunks():
+            started = False
+            for delta in self.self_improvement.stream_new_feature(feature_description, api_key=api_key):
+                if not started:
+                    started = True
+                    yield header
+                yield delta
+            if not started:
+                yield failed
+                
+        async def achunks():
+            started = False
+            async for delta in self.self_improvement.astream_new_feature(feature_description, api_key=api_key):
+                if not started:
+                    started = True
+                    yield header
+                yield delta
+            if not started:
+                yield failed
+                
+        return StreamedReply(chunks, achunks)
+            
+    @timed('think')
     def think(self, message: str) -> str:
         """使用认知系统进行思考"""
         # 处理输入
@@ -397,33 +903,64 @@ class SimpleBot:
             
         return combined_response, reflection
 
+    @timed('respond')
     def respond(self, message):
+        # 处理请求期间，学习和自我分析任务在检查点让出
+        with SCHEDULER.serving(), self._respond_lock:
+            reply = self._respond(message)
+            # 逐段生成的回复（如生成新功能）在这里取完
+            return reply if isinstance(reply, str) else ''.join(reply)
+            
+    async def respond_async(self, message: str) -> str:
+        """异步版本的 respond：大模型调用在事件循环中 await（见 respond_stream_async）"""
+        return ''.join([chunk async for chunk in self.respond_stream_async(message)])
+        
+    def respond_stream(self, message: str):
+        """分段生成回复：大模型生成的内容收到一段就返回一段，其余回复生成后按行切分"""
+        with track('respond'), SCHEDULER.serving(), self._respond_lock:
+            reply = self._respond(message)
+            if isinstance(reply, str):
+                yield from split_reply(reply)
+            else:
+                yield from reply
+                
+    async def respond_stream_async(self, message: str):
+        """异步分段生成回复
+
+        意图路由、思考和情感等本地处理只需要几毫秒，在工作线程中完成（可能读写状态服务，不阻塞事件循环）；
+        大模型生成的回复在事件循环中 await 流式响应，等待期间不占用线程，一个 worker 可以同时等待很多请求。
+        """
+        import asyncio
+        with track('respond'), SCHEDULER.serving():
+            # to_thread 会复制当前上下文，请求追踪可以跟随到工作线程
+            reply = await asyncio.to_thread(self._respond_locked, message)
+            # 大模型生成的回复不再修改会话状态，等待它时不持有会话锁
+            if isinstance(reply, str):
+                for chunk in split_reply(reply):
+                    yield chunk
+            else:
+                async for chunk in reply:
+                    yield chunk
+                    
+    def _respond_locked(self, message):
+        with self._respond_lock:
+            return self._respond(message)
+            
+    def _respond(self, message):
         try:
             logger.debug(f"收到消息: {message}")
             message = message.strip()
             self.chat_history.append(message)
             
-            # 检查是否是自我改进请求
-            if '自我优化' in message or '改进自己' in message:
-                return self.improve_self()
-            
-            # 检查是否是添加新功能请求
-            feature_match = re.search(r'添加新功能[：:](.*)', message)
-            if feature_match:
-                feature_description = feature_match.group(1).strip()
-                return self.improve_self(feature_description)
-            
-            # 检查是否是自主学习请求
-            learn_match = re.search(r'自主学习(.+)', message)
-            if learn_match:
-                topic = learn_match.group(1).strip()
-                return self.web_learner.start_learning(topic)
+            # 意图路由：精确匹配和指令类意图
+            routed = self.router.route(message, self)
+            if routed is not None:
+                return routed
             
-            # 检查学习状态
-            status_match = re.search(r'学习(.+)的进度', message)
-            if status_match:
-                topic = status_match.group(1).strip()
-                return self.web_learner.get_learning_status(topic)
+            # 用户教过的问答（允许换个说法）
+            taught = self.qa_index.lookup(message)
+            if taught is not None:
+                return taught
             
             # 使用认知和情感系统思考
             response, reflection = self.think_and_feel(message)
@@ -435,63 +972,27 @@ class SimpleBot:
                         print(f"- {suggestion}")
                 return response
             
-            # 基础问答
-            responses = {
-                '你好': lambda: random.choice(self.greetings),
-                '你是谁': f'我是{self.name}，一个能够自主学习、思考和感知的智能机器人。我可以通过互联网学习新知识，具有独立的思维能力，还能理解和表达情感！我还能分析和优化自己的代码！',
-                '再见': '再见！希望很快能再次和你聊天！',
-                '你的心情': lambda: f"让我感受一下...{self.emotional.get_response()}",
-                '帮助': '''我可以:
-1. 打招呼和聊天
-2. 记住你的名字（试试说"我叫小明"）
-3. 做简单计算（如"计算 1+1"）
-4. 显示时间
-5. 理解和表达情感：
-   - 问我"你的心情"
-   - 和我分享你的感受
-   - 我会理解你的情绪并共情
-6. 自主学习：
-   - 输入"自主学习xxx"开始学习某个主题
-   - 输入"学习xxx的进度"查看学习状态
-   - 说"学习xxx"或"告诉我关于xxx"来主动学习
-   - 查看"学习历史"了解我学到了什么
-7. 独立思考：
-   - 进行逻辑分析和推理
-   - 帮助做出决策（试试问我"应该xxx还是xxx？"）
-   - 分享相关的记忆和经验
-8. 教我新知识：
-   - 说"问题是:xxx,答案是:xxx"
-   - 更正答案：说"记住xxx的正确答案是xxx"
-9. 自我优化：
-   - 说"自我优化"让我分析和改进自己
-   - 说"添加新功能:xxx"让我设计新功能
-   - 我会定期自动检查和优化自己的代码''',
-            }
-            
-            # 检查完整匹配
-            if message.lower() in responses:
-                response = responses[message.lower()]
-                return response() if callable(response) else response
-            
             # 如果没有找到答案，尝试自主学习
             if not any(keyword in message for keyword in ['计算', '时间', '你好', '再见']):
                 return self.autonomous_learning(message)
             
-            return random.choice([
-                '抱歉，我还不太明白你的意思',
-                '能换个方式说吗？',
-                '这个问题有点难，让我思考一下...',
-                '让我好好想想这个问题！'
-            ])
+            return random.choice(FALLBACK_RESPONSES)
         except Exception as e:
             logger.error(f"处理消息时出错: {str(e)}", exc_info=True)
             return "抱歉，出现了一点问题。请稍后再试。"
 
-    def __del__(self):
-        """保存状态"""
+    def flush_state(self):
+        """保存状态（进程退出时由调度器在后台任务结束后调用）
+
+        没有状态服务时每个 worker 退出时都会保存：教学问答、长期记忆和自我优化记录与文件中已有的内容合并，
+        情感状态以最后退出的 worker 为准。
+        """
+        self.save_knowledge()
         self.save_cognitive_state()
         self.save_emotional_state()
-        self.self_improvement.save_state()
+        self.save_self_improvement_state()
+        self.chat_history.flush()
+        self.self_reflection.flush_logs()
 
 def main():
     print("正在初始化具有自主学习、思维、情感和自我优化能力的机器人...")
@@ -504,7 +1005,7 @@ def main():
 =======================
 ''')
     
-    if not bot.openai_api_key:
+    if not (bot.openai_api_key or llm_gateway.GATEWAY.api_key):
         print("提示：配置OpenAI API密钥可以提升学习和优化效果")
     
     while True:
@@ -523,10 +1024,8 @@ def main():
         except Exception as e:
             print(f'机器人: 抱歉，出现了一点小问题，让我们重新开始吧！')
     
-    # 保存状态
-    bot.save_cognitive_state()
-    bot.save_emotional_state()
-    bot.self_improvement.save_state()
+    # 停止后台任务并保存状态
+    SCHEDULER.shutdown()
 
 if __name__ == '__main__':
     main() 
\ No newline at end of file
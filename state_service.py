@@ -0,0 +1,635 @@
+"""本地状态服务：多个 worker 进程共用一份长期记忆、知识库和会话状态
+
+    python state_service.py --socket /tmp/bot-state.sock      # 在状态文件所在目录启动服务
+    BOT_STATE_SOCKET=/tmp/bot-state.sock gunicorn -c gunicorn.conf.py app:app
+
+- 服务进程独占 cognitive_state.json 和 bot_knowledge.json，worker 不再各自覆盖这些文件
+- 通过 Unix 套接字通信，每一帧是 5 字节的头（1 字节操作码或状态 + 4 字节长度）加紧凑 JSON
+- 每次写入分配一个递增的序号。客户端在本地保存长期记忆、学到的知识和教学问答的副本，
+  读取不经过套接字；服务端有写入时向订阅连接推送最新序号，客户端再拉取之后的变更。
+  客户端自己的写入在返回前同步到本地副本（读到自己的写入）
+- 会话状态不在客户端缓存：每次请求后写回服务，其他 worker 收到变更后丢弃本地的旧副本，
+  下次访问时从服务读取
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, List, Optional
+
+from cognitive_system import LongTermStore
+from metrics import REGISTRY
+
+STATE_REQUESTS = REGISTRY.counter('bot_state_requests_total', '状态服务请求数', ['op', 'outcome'])
+
+# 命名空间：长期记忆（只追加）、学到的知识（主题 -> 摘要）、教学问答（问题 -> 答案）、会话状态
+MEMORY = 'memory'
+KNOWLEDGE = 'knowledge'
+QA = 'qa'
+SESSION = 'session'
+MAPS = (KNOWLEDGE, QA, SESSION)
+
+# 操作码
+OP_CHANGES = 1    # {since, epoch} -> {epoch, seq, changes: [[序号, 命名空间, 键, 值, 来源]]} 或 {epoch, seq, reset}
+OP_GET = 2        # {ns, key} -> {value}
+OP_PUT = 3        # {ns, key, value, origin} -> {seq}
+OP_APPEND = 4     # {values, origin} -> {seq}（长期记忆）
+OP_DELETE = 5     # {ns, key, origin} -> {seq}
+OP_SUBSCRIBE = 6  # 之后服务端在这个连接上推送 OP_NOTIFY {seq}
+OP_NOTIFY = 7
+OP_SAVE = 8       # 立即写入状态文件
+OP_STATS = 9
+OP_NAMES = {OP_CHANGES: 'changes', OP_GET: 'get', OP_PUT: 'put', OP_APPEND: 'append', OP_DELETE: 'delete',
+            OP_SUBSCRIBE: 'subscribe', OP_SAVE: 'save', OP_STATS: 'stats'}
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+HEADER = struct.Struct('!BI')
+MAX_FRAME = 64 << 20
+
+
+class StateError(Exception):
+    """状态服务不可用或请求失败"""
+
+
+def send_frame(sock: socket.socket, code: int, payload: Any) -> None:
+    body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    sock.sendall(HEADER.pack(code, len(body)) + body)
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError('连接已关闭')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_frame(sock: socket.socket):
+    """读取一帧，返回 (操作码或状态, 数据)"""
+    code, size = HEADER.unpack(_recv_exact(sock, HEADER.size))
+    if size > MAX_FRAME:
+        raise ConnectionError(f'帧太大: {size}')
+    return code, json.loads(_recv_exact(sock, size).decode('utf-8'))
+
+
+# ---------------------------------------------------------------- 服务端
+
+class StateService:
+    """状态服务的数据部分：按命名空间保存状态，记录最近的变更，定期写入状态文件"""
+    def __init__(self, state_dir: str = '.', flush_interval: float = 5.0, max_sessions: int = 10000,
+                 max_log: int = 10000):
+        self.state_dir = state_dir
+        self.flush_interval = flush_interval
+        self.max_sessions = max_sessions
+        self.epoch = uuid.uuid4().hex  # 服务重启后客户端据此重新加载全部状态
+        self.seq = 0
+        self._lock = threading.Lock()
+        self._log = deque(maxlen=max_log)  # (序号, 命名空间, 键, 值, 来源)
+        self.memories = []                 # 长期记忆，按写入顺序
+        self.store = LongTermStore()       # 同一份长期记忆按类别整理，用于写入 cognitive_state.json
+        self.maps = {KNOWLEDGE: {}, QA: {}, SESSION: OrderedDict()}
+        self._dirty = set()
+        self._subscribers = set()
+        self._notify = threading.Condition()
+        self._notified = 0
+        self._stopped = threading.Event()
+        self.stats = {'requests': 0, 'writes': 0, 'resets': 0, 'flushes': 0}
+        self._load()
+
+    # ------------------------------------------------------------ 状态文件
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.state_dir, name)
+
+    def _load(self):
+        try:
+            with open(self._path('cognitive_state.json'), 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            # 旧版本或手工编辑的文件可能缺少其中一项，缺少的按空白处理
+            long_term_memory = state.get('long_term_memory', {})
+            associations = state.get('associations', {})
+            for memories in long_term_memory.values():
+                self.memories.extend(memories)
+            self.store.replace(memories=long_term_memory,
+                               associations={k: set(v) for k, v in associations.items()})
+        except FileNotFoundError:
+            pass
+        try:
+            with open(self._path('bot_knowledge.json'), 'r', encoding='utf-8') as f:
+                self.maps[QA].update(json.load(f))
+        except FileNotFoundError:
+            pass
+
+    def flush(self) -> None:
+        """把有变化的状态写入文件"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            qa = dict(self.maps[QA]) if QA in dirty else None
+        if MEMORY in dirty:
+            self._write('cognitive_state.json', self.store.export())
+        if qa is not None:
+            self._write('bot_knowledge.json', qa)
+        if dirty:
+            self.stats['flushes'] += 1
+
+    def _write(self, name: str, data):
+        path = self._path(name)
+        tmp = f'{path}.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"写入状态文件时出错: {name}, 错误: {e}")
+
+    # ------------------------------------------------------------ 请求处理
+
+    def handle(self, op: int, request: Dict[str, Any]) -> Dict[str, Any]:
+        self.stats['requests'] += 1
+        if op == OP_CHANGES:
+            return self.changes(request.get('since', 0), request.get('epoch'))
+        if op == OP_GET:
+            with self._lock:
+                return {'value': self.maps[request['ns']].get(request['key'])}
+        if op == OP_PUT:
+            return {'seq': self.put(request['ns'], request['key'], request['value'], request.get('origin'))}
+        if op == OP_DELETE:
+            return {'seq': self.put(request['ns'], request['key'], None, request.get('origin'))}
+        if op == OP_APPEND:
+            return {'seq': self.append(request['values'], request.get('origin'))}
+        if op == OP_SAVE:
+            self.flush()
+            return {'seq': self.seq}
+        if op == OP_STATS:
+            with self._lock:
+                sizes = {ns: len(values) for ns, values in self.maps.items()}
+            return dict(self.stats, seq=self.seq, epoch=self.epoch, memories=len(self.memories),
+                        subscribers=len(self._subscribers), **sizes)
+        raise ValueError(f'未知的操作: {op}')
+
+    def put(self, ns: str, key: str, value, origin: str = None) -> int:
+        """写入或删除（value 为 None）一个键"""
+        if ns not in MAPS:
+            raise ValueError(f'未知的命名空间: {ns}')
+        with self._lock:
+            values = self.maps[ns]
+            if value is None:
+                values.pop(key, None)
+            else:
+                values[key] = value
+                if ns == SESSION:
+                    values.move_to_end(key)
+                    while len(values) > self.max_sessions:
+                        values.popitem(last=False)
+            # 会话状态可能很大，变更记录中只保留键
+            seq = self._record(ns, key, None if ns == SESSION else value, origin)
+            if ns == QA:
+                self._dirty.add(QA)
+        self._wake(seq)
+        return seq
+
+    def append(self, memories: List[Dict[str, Any]], origin: str = None) -> int:
+        """追加一批长期记忆"""
+        with self._lock:
+            start = len(self.memories)
+            self.memories.extend(memories)
+            self.store.add(memories)
+            seq = self._record(MEMORY, start, memories, origin)
+            self._dirty.add(MEMORY)
+        self._wake(seq)
+        return seq
+
+    def _record(self, ns, key, value, origin) -> int:
+        """记录一条变更（调用方持有锁）"""
+        self.seq += 1
+        self.stats['writes'] += 1
+        self._log.append((self.seq, ns, key, value, origin))
+        return self.seq
+
+    def changes(self, since: int, epoch: str = None) -> Dict[str, Any]:
+        """返回序号 since 之后的变更；客户端落后太多或服务重启过时返回全部状态"""
+        with self._lock:
+            first = self._log[0][0] if self._log else self.seq + 1
+            if epoch != self.epoch or since > self.seq or since + 1 < first:
+                self.stats['resets'] += 1
+                return {'epoch': self.epoch, 'seq': self.seq, 'reset': {
+                    MEMORY: list(self.memories),
+                    KNOWLEDGE: dict(self.maps[KNOWLEDGE]),
+                    QA: dict(self.maps[QA]),
+                    SESSION: list(self.maps[SESSION]),
+                }}
+            changes = []
+            for entry in reversed(self._log):
+                if entry[0] <= since:
+                    break
+                changes.append(entry)
+            changes.reverse()
+            return {'epoch': self.epoch, 'seq': self.seq, 'changes': changes}
+
+    # ------------------------------------------------------------ 推送和定期保存
+
+    def subscribe(self, sock: socket.socket) -> None:
+        with self._notify:
+            self._subscribers.add(sock)
+
+    def unsubscribe(self, sock: socket.socket) -> None:
+        with self._notify:
+            self._subscribers.discard(sock)
+
+    def _wake(self, seq: int) -> None:
+        with self._notify:
+            self._notified = max(self._notified, seq)
+            self._notify.notify()
+
+    def run_notifier(self) -> None:
+        """推送线程：只推送最新的序号，连续的写入合并为一次推送"""
+        sent = 0
+        while not self._stopped.is_set():
+            with self._notify:
+                self._notify.wait_for(lambda: self._notified > sent or self._stopped.is_set())
+                seq, subscribers = self._notified, list(self._subscribers)
+            sent = seq
+            for sock in subscribers:
+                try:
+                    send_frame(sock, OP_NOTIFY, {'seq': seq})
+                except OSError:
+                    # 客户端重新连接后会拉取错过的变更
+                    self.unsubscribe(sock)
+
+    def run_flusher(self) -> None:
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        with self._notify:
+            self._notify.notify_all()
+        self.flush()
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        service = self.server.service
+        sock = self.request
+        while True:
+            try:
+                op, request = recv_frame(sock)
+            except (ConnectionError, OSError, ValueError):
+                break
+            if op == OP_SUBSCRIBE:
+                service.subscribe(sock)
+                try:
+                    # 订阅连接上只有推送，等待客户端断开
+                    while sock.recv(4096):
+                        pass
+                except OSError:
+                    pass
+                service.unsubscribe(sock)
+                break
+            try:
+                response, status = service.handle(op, request), STATUS_OK
+            except Exception as e:
+                response, status = {'error': f'{type(e).__name__}: {e}'}, STATUS_ERROR
+            try:
+                send_frame(sock, status, response)
+            except OSError:
+                break
+
+
+class StateServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, service: StateService):
+        self.service = service
+        if os.path.exists(path):
+            if _reachable(path):
+                raise StateError(f'状态服务已经在运行: {path}')
+            os.unlink(path)  # 上次异常退出留下的套接字文件
+        super().__init__(path, _Handler)
+        os.chmod(path, 0o600)
+
+    def serve(self) -> None:
+        threading.Thread(target=self.service.run_notifier, name='state-notifier', daemon=True).start()
+        threading.Thread(target=self.service.run_flusher, name='state-flusher', daemon=True).start()
+        try:
+            self.serve_forever()
+        finally:
+            self.service.stop()
+            self.server_close()
+            try:
+                os.unlink(self.server_address)
+            except FileNotFoundError:
+                pass
+
+
+def _reachable(path: str) -> bool:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+def spawn(path: str, state_dir: str = '.', timeout: float = 10.0) -> Optional[subprocess.Popen]:
+    """在子进程中启动状态服务并等待它就绪；已经在运行时返回 None"""
+    if _reachable(path):
+        return None
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--socket', path, '--dir', state_dir])
+    deadline = time.monotonic() + timeout
+    while not _reachable(path):
+        if process.poll() is not None or time.monotonic() > deadline:
+            process.kill()
+            raise StateError(f'状态服务没有启动: {path}')
+        time.sleep(0.05)
+    return process
+
+
+# ---------------------------------------------------------------- 客户端
+
+class SharedDict(dict):
+    """以状态服务为准的字典：写入发送给服务，读取直接使用本地副本
+
+    只有 d[key] = value 和 del d[key] 会发送给服务，不要使用 update()、setdefault() 等方法写入。
+    """
+    def __init__(self, client: 'StateClient', namespace: str):
+        super().__init__()
+        self._client = client
+        self.namespace = namespace
+
+    def __setitem__(self, key, value):
+        self._client.put(self.namespace, key, value)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._client.put(self.namespace, key, None)
+
+
+class SharedMemoryStore(LongTermStore):
+    """以状态服务为准的长期记忆：add() 发送给服务，召回使用本地副本"""
+    def __init__(self, client: 'StateClient'):
+        super().__init__()
+        self._client = client
+
+    def add(self, memories: List[Dict[str, Any]]) -> None:
+        if memories:
+            self._client.append(memories)
+
+    def _apply(self, memories: List[Dict[str, Any]]) -> None:
+        LongTermStore.add(self, memories)
+
+    def _reset(self, memories: List[Dict[str, Any]]) -> None:
+        self.replace(memories={}, associations={})
+        LongTermStore.add(self, memories)
+
+
+class StateClient:
+    """状态服务客户端：连接池、本地副本和变更订阅
+
+    创建后先调用 load() 读入全部状态；start() 启动订阅线程（fork 之后在子进程中调用）。
+    """
+    def __init__(self, path: str, timeout: float = 5.0):
+        self.path = path
+        self.timeout = timeout
+        self.epoch = None
+        self.seq = 0
+        self.memory = SharedMemoryStore(self)
+        self.knowledge = SharedDict(self, KNOWLEDGE)
+        self.qa = SharedDict(self, QA)
+        self._listeners = {}  # 命名空间 -> [callback(键, 值)]
+        self._pool = []
+        self._pool_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._subscriber = None
+        self._init_process()
+        self.stats = {'requests': 0, 'errors': 0, 'syncs': 0, 'changes': 0, 'resets': 0, 'notifications': 0}
+
+    def _init_process(self):
+        # 来源标识每个进程不同：会话变更只通知其他进程
+        self._pid = os.getpid()
+        self.origin = f'{self._pid}-{uuid.uuid4().hex[:8]}'
+        self._pool = []
+        self._subscriber = None
+
+    def on_change(self, namespace: str, callback: Callable[[Any, Any], None]) -> None:
+        """注册变更回调：知识和问答的每次变更（包括自己的写入），以及其他进程对会话的写入"""
+        self._listeners.setdefault(namespace, []).append(callback)
+
+    # ------------------------------------------------------------ 请求
+
+    def _connect(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def call(self, op: int, request: Dict[str, Any] = None) -> Dict[str, Any]:
+        """发送一个请求并等待结果，失败时抛出 StateError"""
+        if os.getpid() != self._pid:
+            # fork 之后不能使用父进程的连接
+            self._init_process()
+        name = OP_NAMES.get(op, str(op))
+        with self._pool_lock:
+            sock = self._pool.pop() if self._pool else None
+        try:
+            if sock is None:
+                sock = self._connect()
+            send_frame(sock, op, request or {})
+            status, response = recv_frame(sock)
+        except (OSError, ValueError) as e:
+            if sock is not None:
+                sock.close()
+            self.stats['errors'] += 1
+            STATE_REQUESTS.labels(name, 'error').inc()
+            raise StateError(f'状态服务请求失败: {e}') from e
+        with self._pool_lock:
+            self._pool.append(sock)
+        self.stats['requests'] += 1
+        if status != STATUS_OK:
+            STATE_REQUESTS.labels(name, 'error').inc()
+            raise StateError(response.get('error', '未知错误'))
+        STATE_REQUESTS.labels(name, 'ok').inc()
+        return response
+
+    def load(self) -> None:
+        """读入服务端的全部状态"""
+        self.sync()
+
+    def put(self, namespace: str, key: str, value) -> None:
+        """写入一个键（value 为 None 时删除）并同步到本地副本；服务不可用时只写入本地"""
+        try:
+            response = self.call(OP_PUT, {'ns': namespace, 'key': key, 'value': value, 'origin': self.origin})
+            self.sync(response['seq'])
+        except StateError as e:
+            print(f"写入状态服务失败，只保存在本进程: {e}")
+            self._apply(namespace, key, value, self.origin)
+
+    def append(self, memories: List[Dict[str, Any]]) -> None:
+        """追加长期记忆并同步到本地副本；服务不可用时只写入本地"""
+        try:
+            response = self.call(OP_APPEND, {'values': memories, 'origin': self.origin})
+            self.sync(response['seq'])
+        except StateError as e:
+            print(f"写入状态服务失败，只保存在本进程: {e}")
+            self.memory._apply(memories)
+
+    def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return self.call(OP_GET, {'ns': SESSION, 'key': session_id})['value']
+
+    def put_session(self, session_id: str, state: Dict[str, Any]) -> None:
+        self.call(OP_PUT, {'ns': SESSION, 'key': session_id, 'value': state, 'origin': self.origin})
+
+    def delete_session(self, session_id: str) -> None:
+        self.call(OP_DELETE, {'ns': SESSION, 'key': session_id, 'origin': self.origin})
+
+    def save(self) -> None:
+        """让服务立即写入状态文件"""
+        self.call(OP_SAVE)
+
+    def server_stats(self) -> Dict[str, Any]:
+        return self.call(OP_STATS)
+
+    # ------------------------------------------------------------ 同步
+
+    def sync(self, seq: int = None) -> None:
+        """拉取并应用服务端的变更；指定 seq 时本地已经同步到该序号则直接返回"""
+        with self._sync_lock:
+            if seq is not None and self.seq >= seq and self.epoch is not None:
+                return
+            response = self.call(OP_CHANGES, {'since': self.seq, 'epoch': self.epoch})
+            self.stats['syncs'] += 1
+            if 'reset' in response:
+                self._reset(response['reset'], same_epoch=response['epoch'] == self.epoch)
+            else:
+                memories = []
+                for _, namespace, key, value, origin in response['changes']:
+                    if namespace == MEMORY:
+                        memories.extend(value)
+                    else:
+                        self._apply(namespace, key, value, origin)
+                self.memory._apply(memories)
+                self.stats['changes'] += len(response['changes'])
+            self.epoch, self.seq = response['epoch'], response['seq']
+
+    def _apply(self, namespace: str, key, value, origin: str) -> None:
+        if namespace == SESSION:
+            if origin == self.origin:
+                return
+        else:
+            mirror = self.knowledge if namespace == KNOWLEDGE else self.qa
+            if value is None:
+                dict.pop(mirror, key, None)
+            else:
+                dict.__setitem__(mirror, key, value)
+        for callback in self._listeners.get(namespace, ()):
+            try:
+                callback(key, value)
+            except Exception as e:
+                print(f"处理状态变更时出错: {namespace} {key}, 错误: {e}")
+
+    def _reset(self, state: Dict[str, Any], same_epoch: bool) -> None:
+        """用服务端的全部状态替换本地副本"""
+        self.stats['resets'] += 1
+        self.memory._reset(state[MEMORY])
+        for namespace, mirror in ((KNOWLEDGE, self.knowledge), (QA, self.qa)):
+            dict.clear(mirror)
+            for key, value in state[namespace].items():
+                self._apply(namespace, key, value, None)
+        # 服务重启后没有会话状态，本地的会话是唯一的副本，保留；
+        # 只是落后太多时，服务端的会话可能比本地新，丢弃本地副本
+        if same_epoch:
+            for session_id in state[SESSION]:
+                self._apply(SESSION, session_id, None, None)
+
+    def start(self) -> None:
+        """启动订阅线程（每个进程一次）"""
+        if os.getpid() != self._pid:
+            self._init_process()
+        if self._subscriber is not None:
+            return
+        self._subscriber = threading.Thread(target=self._subscribe_loop, name='state-subscriber', daemon=True)
+        self._subscriber.start()
+
+    def _subscribe_loop(self) -> None:
+        delay = 0.5
+        while True:
+            try:
+                sock = self._connect()
+                sock.settimeout(None)
+                send_frame(sock, OP_SUBSCRIBE, {})
+                # 订阅之后先补上错过的变更
+                self.sync()
+                delay = 0.5
+                while True:
+                    _, notice = recv_frame(sock)
+                    self.stats['notifications'] += 1
+                    if notice['seq'] > self.seq:
+                        self.sync(notice['seq'])
+            except (OSError, ValueError, StateError) as e:
+                print(f"状态服务订阅断开，{delay:g} 秒后重试: {e}")
+            time.sleep(delay)
+            delay = min(delay * 2, 5.0)
+
+
+def from_env() -> Optional[StateClient]:
+    """设置了 BOT_STATE_SOCKET 时连接状态服务并读入全部状态；服务不可用时返回 None（使用进程内状态）"""
+    path = os.environ.get('BOT_STATE_SOCKET')
+    if not path:
+        return None
+    client = StateClient(path)
+    try:
+        client.load()
+    except StateError as e:
+        print(f"连接状态服务失败，使用进程内状态: {e}")
+        return None
+    return client
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地状态服务（多个 worker 共用长期记忆、知识库和会话）')
+    parser.add_argument('--socket', default=os.environ.get('BOT_STATE_SOCKET'), help='Unix 套接字路径')
+    parser.add_argument('--dir', default='.', help='状态文件所在目录')
+    parser.add_argument('--flush-interval', type=float, default=float(os.environ.get('BOT_STATE_FLUSH', 5)),
+                        help='每隔多少秒把变化写入状态文件')
+    parser.add_argument('--max-sessions', type=int, default=10000, help='保存的会话数上限')
+    args = parser.parse_args()
+    if not args.socket:
+        parser.error('需要 --socket 或环境变量 BOT_STATE_SOCKET')
+
+    service = StateService(args.dir, flush_interval=args.flush_interval, max_sessions=args.max_sessions)
+    try:
+        server = StateServer(args.socket, service)
+    except StateError as e:
+        sys.exit(str(e))
+    # 收到 SIGTERM 时停止服务并写入状态文件
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+    print(f"状态服务已启动: {args.socket}，长期记忆 {len(service.memories)} 条，教学问答 {len(service.maps[QA])} 条")
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
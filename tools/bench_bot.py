@@ -0,0 +1,298 @@
+"""对话热路径基准测试
+
+用法：
+    python tools/bench_bot.py                       # 运行全部基准
+    python tools/bench_bot.py --quick -k recall     # 只运行名称包含 recall 的基准，减少数据量
+    python tools/bench_bot.py -o after.json --compare before.json
+
+运行时不联网（BOT_OFFLINE=1），状态文件写入临时目录。每个操作单独计时，
+输出平均值、中位数、p95 和吞吐量；-o 保存为 JSON，--compare 与之前保存的结果对比。
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('BOT_OFFLINE', '1')
+
+import corpus  # noqa: E402
+
+BENCHMARKS = []  # (名称, 参数列表, 快速模式参数列表, 准备函数)
+
+
+def benchmark(name: str, params=(None,), quick_params=None):
+    """注册基准：准备函数接收参数和操作次数，返回每次调用执行一个操作的函数"""
+    def decorator(setup: Callable[[Any, int], Callable[[int], Any]]):
+        BENCHMARKS.append((name, tuple(params), tuple(quick_params or params), setup))
+        return setup
+    return decorator
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """把每次操作的耗时（秒）汇总为统计值（微秒）"""
+    ordered = sorted(samples)
+    total = sum(ordered)
+    return {
+        'ops': len(ordered),
+        'mean_us': total / len(ordered) * 1e6,
+        'median_us': statistics.median(ordered) * 1e6,
+        'p95_us': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1e6,
+        'min_us': ordered[0] * 1e6,
+        'max_us': ordered[-1] * 1e6,
+        'ops_per_sec': len(ordered) / total if total else 0.0,
+    }
+
+
+def measure(op: Callable[[int], Any], ops: int, warmup: int) -> Dict[str, float]:
+    for i in range(warmup):
+        op(i)
+    samples = []
+    clock = time.perf_counter
+    for i in range(warmup, warmup + ops):
+        start = clock()
+        op(i)
+        samples.append(clock() - start)
+    return summarize(samples)
+
+
+# ---------------------------------------------------------------- 基准定义
+
+@benchmark('respond')
+def bench_respond(_, ops):
+    """SimpleBot.respond 端到端（路由、认知、情感、反思）"""
+    from simple_bot import SimpleBot
+    bot = SimpleBot('基准测试')
+    messages = corpus.messages(ops + 100, seed=1)
+    return lambda i: bot.respond(messages[i])
+
+
+def _memory_with(size: int):
+    from cognitive_system import Memory
+    memory = Memory()
+    memory.store.add(corpus.memories(size, seed=2))
+    return memory
+
+
+@benchmark('recall', params=(100, 1000, 10000), quick_params=(100, 1000))
+def bench_recall(size, ops):
+    """Memory.recall：每次使用不同的查询（不命中召回缓存）"""
+    memory = _memory_with(size)
+    queries = [f'{message} q{i}' for i, message in enumerate(corpus.messages(ops + 100, seed=3))]
+    return lambda i: memory.recall(queries[i])
+
+
+@benchmark('make_decision', params=(2, 8, 32, 128), quick_params=(2, 32))
+def bench_make_decision(count, ops):
+    """DecisionMaking.make_decision：长期记忆 1000 条，选项数递增"""
+    from cognitive_system import CognitiveSystem
+    cognitive = CognitiveSystem(_memory_with(1000))
+    options = corpus.options(count, seed=4)
+    situations = [f'应该 {message} s{i}' for i, message in enumerate(corpus.messages(ops + 100, seed=5))]
+    return lambda i: cognitive.decision_making.make_decision(situations[i], options)
+
+
+@benchmark('update_state')
+def bench_update_state(_, ops):
+    """EmotionalState.update_state"""
+    from emotional_system import EmotionalState
+    from retention import RingLog
+    state = EmotionalState()
+    history = RingLog(200)
+    history.extend(corpus.messages(200, seed=6))
+    messages = corpus.messages(ops + 100, seed=7)
+    context = {'chat_history': history, 'task_success': False, 'task_failure': False,
+               'response_time': 0.01, 'emotional_alignment': 0.0}
+    return lambda i: state.update_state(messages[i], context)
+
+
+@benchmark('reflect', params=(10, 200, 2000), quick_params=(10, 200))
+def bench_reflect(history_size, ops):
+    """SelfReflection.reflect：对话历史长度递增，每次反思前追加一条消息"""
+    from emotional_system import EmotionalState, SelfReflection
+    from retention import RingLog
+    reflection = SelfReflection(EmotionalState())
+    history = RingLog(history_size)
+    history.extend(corpus.messages(history_size, seed=8))
+    messages = corpus.messages(ops + 100, seed=9)
+    context = {'chat_history': history, 'response_time': 0.01, 'emotional_alignment': 0.0}
+
+    def op(i):
+        history.append(messages[i])
+        reflection.reflect(context)
+    return op
+
+
+@benchmark('cognitive_save', params=(1000, 10000), quick_params=(1000,))
+def bench_cognitive_save(size, ops):
+    """CognitiveSystem.save_state"""
+    from cognitive_system import CognitiveSystem
+    cognitive = CognitiveSystem(_memory_with(size))
+    return lambda i: cognitive.save_state('cognitive_state.json')
+
+
+@benchmark('cognitive_load', params=(1000, 10000), quick_params=(1000,))
+def bench_cognitive_load(size, ops):
+    """CognitiveSystem.load_state"""
+    from cognitive_system import CognitiveSystem
+    CognitiveSystem(_memory_with(size)).save_state('cognitive_state.json')
+    cognitive = CognitiveSystem()
+    return lambda i: cognitive.load_state('cognitive_state.json')
+
+
+@benchmark('emotional_save_load')
+def bench_emotional_save_load(_, ops):
+    """EmotionalState.save_state + load_state（情感记忆已满）"""
+    from emotional_system import EmotionalState
+    state = EmotionalState()
+    for message in corpus.messages(state.max_memory, seed=10):
+        state.update_state(message, {})
+
+    def op(i):
+        state.save_state('emotional_state.json')
+        state.load_state('emotional_state.json')
+    return op
+
+
+@benchmark('analyze_self', params=('cold', 'cached'))
+def bench_analyze_self(mode, ops):
+    """SelfImprovement.analyze_self：cold 每次新建分析器（全部重新解析），cached 文件未修改"""
+    from self_improvement import SelfImprovement
+    improvement = SelfImprovement()
+
+    def op(i):
+        if mode == 'cold':
+            improvement.analyzer._cache.clear()
+        improvement.analyze_self()
+    return op
+
+
+@benchmark('decode', params=('apparent_encoding', 'bounded'))
+def bench_decode(mode, ops):
+    """解码没有声明字符集的 512KB GB18030 网页：apparent_encoding 检测整个正文，bounded 为 fetcher.decode"""
+    import random
+    from requests.compat import chardet
+    import fetcher
+    rng = random.Random(0)
+    paragraphs = []
+    while sum(len(p) for p in paragraphs) < 200 * 1024:
+        paragraphs.append(f'<p>{corpus.paragraph(rng, sentences=5)}</p>')
+    body = f'<html><head><title>网页</title></head><body>{"".join(paragraphs)}</body></html>'.encode('gb18030')
+    body = body[:512 * 1024]
+
+    if mode == 'apparent_encoding':
+        return lambda i: body.decode(chardet.detect(body)['encoding'] or 'utf-8', errors='replace')
+    return lambda i: fetcher.decode(body, 'text/html')
+
+
+@benchmark('qa_lookup', params=(1000, 100000), quick_params=(1000, 10000))
+def bench_qa_lookup(size, ops):
+    """QAIndex.lookup：在 size 个教学问答中查找换了说法的问题"""
+    from qa_index import QAIndex
+    pairs = corpus.qa_pairs(size, seed=5)
+    index = QAIndex(pairs)
+    questions = list(pairs)
+    rng = corpus.random.Random(6)
+    queries = [corpus.paraphrase(rng, rng.choice(questions)) for _ in range(ops + 100)]
+    return lambda i: index.lookup(queries[i])
+
+
+# ---------------------------------------------------------------- 运行和输出
+
+OPS = {'respond': 2000, 'save': 20, 'load': 20, 'decode': 50}
+
+
+def _ops_for(name: str, quick: bool) -> int:
+    for key, ops in OPS.items():
+        if key in name:
+            break
+    else:
+        ops = 1000
+    return max(5, ops // 5) if quick else ops
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ''
+
+
+def run(selected: str = None, quick: bool = False) -> Dict[str, Any]:
+    logging.disable(logging.WARNING)
+    results = []
+    for name, params, quick_params, setup in BENCHMARKS:
+        if selected and selected not in name:
+            continue
+        for param in (quick_params if quick else params):
+            ops = _ops_for(name, quick)
+            label = name if param is None else f'{name}[{param}]'
+            with contextlib.redirect_stdout(io.StringIO()):
+                op = setup(param, ops)
+                stats = measure(op, ops, warmup=min(100, ops // 10))
+            results.append({'name': label, 'param': param, **stats})
+            print(f'{label:<28} {stats["mean_us"]:>12.1f} us  median {stats["median_us"]:>10.1f}  '
+                  f'p95 {stats["p95_us"]:>10.1f}  {stats["ops_per_sec"]:>10.0f} ops/s', flush=True)
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'quick': quick,
+        },
+        'results': results,
+    }
+
+
+def compare(report: Dict[str, Any], baseline_path: str) -> None:
+    """与之前保存的结果对比平均耗时"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {r['name']: r for r in json.load(f)['results']}
+    print(f'\n与 {baseline_path} 对比（平均耗时，负数表示更快）：')
+    for result in report['results']:
+        before = baseline.get(result['name'])
+        if not before:
+            continue
+        change = (result['mean_us'] - before['mean_us']) / before['mean_us'] * 100
+        print(f'{result["name"]:<28} {before["mean_us"]:>12.1f} -> {result["mean_us"]:>12.1f} us  {change:+7.1f}%')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SimpleBot 热路径基准测试')
+    parser.add_argument('-k', dest='selected', help='只运行名称包含该字符串的基准')
+    parser.add_argument('--quick', action='store_true', help='减少数据量和操作次数')
+    parser.add_argument('-o', '--output', help='把结果保存为 JSON')
+    parser.add_argument('--compare', help='与之前保存的 JSON 结果对比')
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.compare) if args.compare else None
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)  # 状态文件写入临时目录
+        report = run(args.selected, args.quick)
+        # 在临时目录删除之前停止后台任务并保存状态
+        from scheduler import SCHEDULER
+        SCHEDULER.shutdown()
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if baseline:
+        compare(report, baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""爬虫基准测试：用本地测试站点评测 WebLearner 的抓取吞吐量
+
+用法：
+    python tools/bench_crawler.py --max-pages 200
+    python tools/bench_crawler.py --latency 0.05 --jitter 0.05 --error-rate 0.05 --mirror-rate 0.3 -o crawl.json
+
+输出网页/秒、字节/秒、主题网页比例（抓取中真正与主题相关的正文页所占比例）、重复抓取比例（同一内容经镜像或参数变体被重复下载）、
+网址去重次数、错误数和从开始学习到生成摘要的时间。
+
+--start 选择起始方式：
+    search   从测试站点的简单搜索页开始（默认）
+    engines  把三个仿搜索引擎的结果页当作普通网页抓取（不解析结果页时的做法）
+    serp     WebLearner 的搜索阶段：解析结果页、合并排名并按摘要过滤
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fixture_site import FixtureSite  # noqa: E402
+
+
+def run(args) -> dict:
+    from simple_bot import WebLearner
+    logging.disable(logging.WARNING)
+
+    site = FixtureSite(pages=args.pages, fanout=args.fanout, page_size=args.page_size, topic=args.topic,
+                       latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                       mirror_rate=args.mirror_rate, binary_rate=args.binary_rate, seed=args.seed)
+    with site:
+        learner = WebLearner()
+        learner.offline = False
+        learner.max_pages = args.max_pages
+        learner.max_page_bytes = args.max_page_bytes
+        seed_urls = [site.search_url(args.topic)]
+        if args.seed_mode == 'engines':
+            seed_urls = [template.format(query=args.topic) for template in site.search_engines().values()]
+        elif args.seed_mode == 'serp':
+            learner.search_engines = site.search_engines()
+            seed_urls = None
+
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            learner.start_learning(args.topic, seed_urls=seed_urls)
+            finished = learner.wait(args.timeout)
+        elapsed = time.perf_counter() - started
+        server = site.get_stats()
+
+    stats = learner.stats
+    summary_time = stats['summarized'] - stats['started'] if stats.get('summarized') else None
+    fetched = stats['pages'] + stats['errors']
+    return {
+        'config': vars(args),
+        'finished': finished,
+        'elapsed_s': elapsed,
+        'pages': stats['pages'],
+        'errors': stats['errors'],
+        'bytes': stats['bytes'],
+        'relevant_pages': stats['relevant'],
+        'bytes_avoided': stats['bytes_avoided'],
+        'skipped': stats['skipped'],
+        'truncated': stats['truncated'],
+        'charset_detected': stats['charset_detected'],
+        'topic_fetches': server['topic_fetches'],
+        'topic_rate': server['topic_fetches'] / server['requests'] if server['requests'] else 0.0,
+        'serp_fetches': server['serp_fetches'],
+        'serp_results': stats['serp_results'],
+        'serp_filtered': stats['serp_filtered'],
+        'pages_per_sec': stats['pages'] / elapsed if elapsed else 0.0,
+        'bytes_per_sec': stats['bytes'] / elapsed if elapsed else 0.0,
+        'duplicate_urls': stats['duplicate_urls'],
+        'duplicate_content_fetches': server['duplicate_fetches'],
+        'duplicate_content_rate': server['duplicate_fetches'] / server['page_fetches'] if server['page_fetches'] else 0.0,
+        'fetch_attempts': fetched,
+        'time_to_summary_s': summary_time,
+        'knowledge_chars': len(learner.knowledge_base.get(args.topic, '')),
+        'server': server,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='WebLearner 爬虫基准测试（本地测试站点）')
+    parser.add_argument('--pages', type=int, default=1000, help='测试站点的页面数')
+    parser.add_argument('--fanout', type=int, default=8)
+    parser.add_argument('--page-size', type=int, default=4096)
+    parser.add_argument('--topic', default='机器学习')
+    parser.add_argument('--latency', type=float, default=0.0, help='每个请求的固定延迟（秒）')
+    parser.add_argument('--jitter', type=float, default=0.0, help='每个请求额外的随机延迟上限（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--mirror-rate', type=float, default=0.2, help='指向镜像页或参数变体的链接比例')
+    parser.add_argument('--binary-rate', type=float, default=0.0, help='指向二进制文件的链接比例')
+    parser.add_argument('--max-pages', type=int, default=200, help='WebLearner 每次学习最多访问的页面数')
+    parser.add_argument('--max-page-bytes', type=int, default=1 << 20, help='每个网页最多下载的字节数')
+    parser.add_argument('--start', dest='seed_mode', choices=['search', 'engines', 'serp'], default='search',
+                        help='起始方式（见文件说明）')
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='把结果保存为 JSON')
+    args = parser.parse_args()
+
+    result = run(args)
+    print(f'抓取 {result["pages"]} 页（错误 {result["errors"]}，服务端注入错误 {result["server"]["errors_injected"]}），'
+          f'用时 {result["elapsed_s"]:.2f}s')
+    print(f'吞吐量：{result["pages_per_sec"]:.1f} 页/秒，{result["bytes_per_sec"] / 1024:.1f} KB/秒')
+    print(f'跳过非网页内容 {result["skipped"]} 个，截断 {result["truncated"]} 页，'
+          f'少下载 {result["bytes_avoided"] / 1024:.1f} KB，字符集检测 {result["charset_detected"]} 次')
+    print(f'主题网页：{result["topic_fetches"]}/{result["server"]["requests"]} 次请求（{result["topic_rate"]:.1%}），'
+          f'结果页请求 {result["serp_fetches"]} 次' +
+          (f'，搜索结果 {result["serp_results"]} 条，按摘要过滤 {result["serp_filtered"]} 条'
+           if args.seed_mode == 'serp' else ''))
+    print(f'重复内容抓取：{result["duplicate_content_fetches"]} 次（{result["duplicate_content_rate"]:.1%}），'
+          f'网址去重 {result["duplicate_urls"]} 次')
+    if result['time_to_summary_s'] is not None:
+        print(f'生成摘要用时：{result["time_to_summary_s"]:.2f}s，知识 {result["knowledge_chars"]} 字')
+    else:
+        print('没有生成摘要')
+    if not result['finished']:
+        print('学习在超时前没有结束')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    sys.exit(0 if result['finished'] else 1)
+
+
+if __name__ == '__main__':
+    main()
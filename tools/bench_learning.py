@@ -0,0 +1,128 @@
+"""自主学习触发测试：大量用户同时问相似的不会的问题时，学习任务数只与不同主题数有关
+
+用法：
+    python tools/bench_learning.py
+    python tools/bench_learning.py --messages 2000 --threads 32 --latency 0.01 -o triggers.json
+
+消息由若干个主题的不同问法组成（“什么是X？”“X是什么”“告诉我关于X”……），
+其中一个主题是测试站点的主题（能学到内容），其余主题学不到内容（进入负缓存）。
+分两轮发送：第一轮在学习进行中，第二轮在学习结束后，检查：
+    - 学习任务数等于不同主题数
+    - 第二轮中能学到的主题直接用知识库回答，学不到的主题命中负缓存，不再抓取网页
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.pop('BOT_OFFLINE', None)
+
+from fixture_site import FixtureSite  # noqa: E402
+
+QUESTION_FORMS = ['什么是{}？', '{}是什么', '告诉我关于{}', '学习{}', '{}是什么意思呢', '请问什么是{}?', ' {} ']
+UNKNOWN_TOPICS = ['量子纠缠', '区块链', '光合作用', '黑洞']
+
+
+def _messages(topics, count, seed):
+    rng = random.Random(seed)
+    return [rng.choice(QUESTION_FORMS).format(rng.choice(topics)) for _ in range(count)]
+
+
+def _send(trigger, messages, threads):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        replies = list(pool.map(trigger.request, messages))
+    return replies, time.perf_counter() - started
+
+
+def _outcomes(counter):
+    return {labels[0]: child.get() for labels, child in counter._children_items()}
+
+
+def run(args) -> dict:
+    from learning_trigger import LEARN_TRIGGERS, LearningTrigger
+    from simple_bot import WebLearner
+    logging.disable(logging.WARNING)
+
+    site = FixtureSite(pages=args.pages, topic=args.topic, latency=args.latency, seed=args.seed)
+    topics = [args.topic] + UNKNOWN_TOPICS[:args.unknown_topics]
+    with site:
+        learner = WebLearner()
+        learner.offline = False
+        learner.max_pages = args.max_pages
+        trigger = LearningTrigger(learner, seed_urls=lambda topic: [site.search_url(topic)])
+        before = _outcomes(LEARN_TRIGGERS)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, first_elapsed = _send(trigger, _messages(topics, args.messages, args.seed), args.threads)
+            finished = trigger.wait(args.timeout)
+            fetches_after_learning = site.get_stats()['requests']
+            second, second_elapsed = _send(trigger, _messages(topics, args.messages, args.seed + 1), args.threads)
+            trigger.wait(args.timeout)
+        server = site.get_stats()
+
+    after = _outcomes(LEARN_TRIGGERS)
+    counts = {name: after.get(name, 0) - before.get(name, 0) for name in after}
+    answered = sum(1 for reply in second if reply in learner.knowledge_base.values())
+    return {
+        'config': vars(args),
+        'finished': finished,
+        'messages': args.messages * 2,
+        'distinct_topics': len(topics),
+        'jobs': trigger.jobs,
+        'outcomes': counts,
+        'first_round_s': first_elapsed,
+        'second_round_s': second_elapsed,
+        'second_round_answered_from_knowledge': answered,
+        'server_requests': server['requests'],
+        'server_requests_in_second_round': server['requests'] - fetches_after_learning,
+        'trigger': trigger.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='自主学习触发层测试（本地测试站点）')
+    parser.add_argument('--messages', type=int, default=1000, help='每轮发送的消息数')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--unknown-topics', type=int, default=3, help='学不到内容的主题数')
+    parser.add_argument('--pages', type=int, default=200, help='测试站点的页面数')
+    parser.add_argument('--max-pages', type=int, default=30, help='每次学习最多访问的页面数')
+    parser.add_argument('--topic', default='机器学习')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='把结果保存为 JSON')
+    args = parser.parse_args()
+
+    result = run(args)
+    print(f'{result["messages"]} 条消息，{result["distinct_topics"]} 个不同主题，启动学习任务 {result["jobs"]} 次')
+    print('触发结果：' + '，'.join(f'{name} {count:g}' for name, count in sorted(result['outcomes'].items())))
+    print(f'第二轮：{result["second_round_answered_from_knowledge"]} 条直接用知识库回答，'
+          f'服务端请求 {result["server_requests_in_second_round"]} 次')
+
+    checks = [
+        ('学习在超时前结束', result['finished']),
+        ('学习任务数等于不同主题数', result['jobs'] == result['distinct_topics']),
+        ('第二轮没有抓取网页', result['server_requests_in_second_round'] == 0),
+        ('学不到内容的主题进入负缓存', result['trigger']['negative'] == args.unknown_topics),
+    ]
+    failures = [label for label, ok in checks if not ok]
+    for label in failures:
+        print(f'    检查失败：{label}')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(dict(result, failures=failures), f, ensure_ascii=False, indent=2)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
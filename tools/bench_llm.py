@@ -0,0 +1,295 @@
+"""大模型网关测试：用本地模拟服务检查 llm_gateway 的并发上限、合并、重试和超时
+
+用法：
+    python tools/bench_llm.py
+    python tools/bench_llm.py -k retry -o llm.json
+
+每个场景使用独立的网关和模拟服务，检查不满足时以非零状态退出。
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.pop('BOT_OFFLINE', None)
+
+from llm_stub import LLMStub  # noqa: E402
+
+SCENARIOS = []
+
+
+def scenario(name: str, **stub_options):
+    """注册场景：函数接收模拟服务，返回 (结果, 检查列表)"""
+    def decorator(func: Callable[[LLMStub], Any]):
+        SCENARIOS.append((name, stub_options, func))
+        return func
+    return decorator
+
+
+def _gateway(stub: LLMStub, **options):
+    from llm_gateway import LLMGateway
+    options.setdefault('backoff', 0.05)
+    return LLMGateway(api_key='test', base_url=stub.base_url, **options)
+
+
+def _fire(gateway, prompts: List[str], threads: int, caller: str = 'bench') -> Dict[str, Any]:
+    """多线程发送请求，返回耗时分布和各类错误的次数"""
+    from llm_gateway import LLMError
+    latencies, errors, results = [], {}, []
+    lock = threading.Lock()
+
+    def one(prompt):
+        started = time.perf_counter()
+        try:
+            text = gateway.chat([{'role': 'user', 'content': prompt}], caller=caller)
+            with lock:
+                results.append(text)
+        except LLMError as e:
+            with lock:
+                errors[e.kind] = errors.get(e.kind, 0) + 1
+        with lock:
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(one, prompts))
+    elapsed = time.perf_counter() - started
+    ordered = sorted(latencies)
+    return {
+        'calls': len(prompts),
+        'ok': len(results),
+        'errors': errors,
+        'elapsed_s': elapsed,
+        'calls_per_sec': len(prompts) / elapsed if elapsed else 0.0,
+        'p50_ms': statistics.median(ordered) * 1000,
+        'max_ms': ordered[-1] * 1000,
+        'distinct_results': len(set(results)),
+    }
+
+
+@scenario('concurrency', latency=0.05)
+def check_concurrency(stub):
+    """64 个不同请求、32 个线程，全局并发上限 4"""
+    result = _fire(_gateway(stub, max_concurrency=4), [f'问题 {i}' for i in range(64)], threads=32)
+    server = stub.get_stats()
+    return result, [
+        ('全部成功', result['ok'] == 64),
+        ('服务端最大并发不超过 4', server['max_concurrency'] <= 4),
+    ]
+
+
+@scenario('caller_limit', latency=0.05)
+def check_caller_limit(stub):
+    """optimize 调用方的并发上限为 1"""
+    result = _fire(_gateway(stub), [f'优化 {i}' for i in range(8)], threads=8, caller='optimize')
+    server = stub.get_stats()
+    return result, [
+        ('全部成功', result['ok'] == 8),
+        ('服务端最大并发为 1', server['max_concurrency'] == 1),
+    ]
+
+
+@scenario('coalesce', latency=0.2)
+def check_coalesce(stub):
+    """32 个线程同时发送相同的请求，只应到达服务端一次"""
+    result = _fire(_gateway(stub), ['同一个问题'] * 32, threads=32)
+    server = stub.get_stats()
+    return result, [
+        ('全部成功', result['ok'] == 32),
+        ('服务端只收到 1 个请求', server['requests'] == 1),
+        ('结果相同', result['distinct_results'] == 1),
+    ]
+
+
+@scenario('retry', error_rate=0.2, rate_limit_rate=0.1, seed=1)
+def check_retry(stub):
+    """30% 的请求返回 500 或 429，最多重试 4 次"""
+    result = _fire(_gateway(stub, max_retries=4), [f'重试 {i}' for i in range(100)], threads=8)
+    server = stub.get_stats()
+    result['server_requests'] = server['requests']
+    return result, [
+        ('成功率不低于 98%', result['ok'] >= 98),
+        ('发生了重试', server['requests'] > 100),
+    ]
+
+
+@scenario('retry_after', rate_limit_first=1, retry_after=0.3)
+def check_retry_after(stub):
+    """第一次请求返回 429 和 Retry-After: 0.3，退避上限只有 0.05 秒时也要等够 0.3 秒再重试"""
+    result = _fire(_gateway(stub, max_backoff=0.05), ['限流'], threads=1)
+    server = stub.get_stats()
+    return result, [
+        ('重试后成功', result['ok'] == 1 and server['requests'] == 2),
+        ('至少等待 Retry-After', result['max_ms'] >= 300),
+    ]
+
+
+@scenario('reconfigure', latency=0.5)
+def check_reconfigure(stub):
+    """请求进行中更换密钥：进行中的请求用旧客户端正常完成（不重试），之后的请求使用新客户端"""
+    gateway = _gateway(stub, max_retries=0)
+    gateway._get_client()  # 先创建客户端，确保更换密钥时请求已经在进行
+    outcome = {}
+    worker = threading.Thread(target=lambda: outcome.update(_fire(gateway, ['更换前'], threads=1)))
+    worker.start()
+    time.sleep(0.2)
+    gateway.configure(api_key='rotated')
+    worker.join()
+    after = _fire(gateway, ['更换后'], threads=1)
+    gateway.close()
+    result = dict(outcome, calls=2, ok=outcome['ok'] + after['ok'])
+    return result, [
+        ('进行中的请求成功', outcome['ok'] == 1),
+        ('更换后的请求成功', after['ok'] == 1),
+    ]
+
+
+@scenario('timeout', latency=2.0)
+def check_timeout(stub):
+    """服务端很慢：单次超时 0.3 秒、总时限 1 秒，调用方不会被卡住"""
+    result = _fire(_gateway(stub, timeout=0.3, deadline=1.0), [f'超时 {i}' for i in range(4)], threads=4)
+    return result, [
+        ('全部超时失败', result['errors'].get('timeout') == 4),
+        ('每次调用不超过 1.5 秒', result['max_ms'] <= 1500),
+    ]
+
+
+@scenario('busy', latency=1.0)
+def check_busy(stub):
+    """并发上限 1、总时限 0.3 秒：排队的请求很快失败而不是无限等待"""
+    result = _fire(_gateway(stub, max_concurrency=1, timeout=2.0, deadline=0.3),
+                   [f'排队 {i}' for i in range(4)], threads=4)
+    return result, [
+        ('排队的请求返回 busy', result['errors'].get('busy', 0) >= 3),
+        ('排队的请求不超过 0.6 秒就失败', result['p50_ms'] <= 600),
+    ]
+
+
+@scenario('stream', latency=0.05, reply_chars=80, stream_chars=8, stream_delay=0.05)
+def check_stream(stub):
+    """流式请求：第一段在服务端生成完整回复之前到达；提前关闭时释放并发名额"""
+    gateway = _gateway(stub, max_concurrency=1)
+    messages = [{'role': 'user', 'content': '流式' * 40}]
+    started = time.perf_counter()
+    first_ms, chunks = None, []
+    for delta in gateway.chat_stream(messages, caller='bench'):
+        if first_ms is None:
+            first_ms = (time.perf_counter() - started) * 1000
+        chunks.append(delta)
+    total_ms = (time.perf_counter() - started) * 1000
+    full = gateway.chat(messages, caller='bench')
+
+    # 读到第一段就关闭，连接断开、名额归还，下一个请求不需要排队
+    stream = gateway.chat_stream(messages, caller='bench')
+    next(stream)
+    stream.close()
+    reused = _fire(_gateway(stub, max_concurrency=1, deadline=1.0), ['关闭后'], threads=1)
+    result = {'calls': 1, 'ok': int(''.join(chunks) == full), 'errors': {},
+              'calls_per_sec': 1000 / total_ms, 'p50_ms': total_ms, 'max_ms': total_ms,
+              'chunks': len(chunks), 'first_ms': first_ms, 'total_ms': total_ms}
+    return result, [
+        ('内容与非流式请求相同', ''.join(chunks) == full),
+        ('分多段返回', len(chunks) > 5),
+        ('第一段在全部生成之前到达', first_ms is not None and first_ms < total_ms / 3),
+        ('关闭后可以继续请求', reused['ok'] == 1),
+    ]
+
+
+@scenario('async_stream', latency=0.2, reply_chars=40, stream_chars=8, stream_delay=0.05)
+def check_async_stream(stub):
+    """32 个异步流式请求在同一个事件循环中等待服务端，不为每个请求占用线程"""
+    import asyncio
+    gateway = _gateway(stub, max_concurrency=32, caller_limits={'bench': 32})
+    messages = [[{'role': 'user', 'content': f'异步 {i} ' * 10}] for i in range(32)]
+
+    def waiting_threads():
+        """除主线程外，调用栈中有网关或 openai 代码的线程数（模拟服务的线程不计入）"""
+        count = 0
+        for ident, frame in sys._current_frames().items():
+            if ident == threading.main_thread().ident:
+                continue
+            files = []
+            while frame is not None:
+                files.append(frame.f_code.co_filename)
+                frame = frame.f_back
+            count += any('llm_gateway' in f or os.sep + 'openai' + os.sep in f for f in files)
+        return count
+
+    peak_threads = 0
+
+    async def one(message):
+        return ''.join([delta async for delta in gateway.achat_stream(message, caller='bench')])
+
+    async def watch(done):
+        nonlocal peak_threads
+        while not done.is_set():
+            peak_threads = max(peak_threads, waiting_threads())
+            await asyncio.sleep(0.02)
+
+    async def main():
+        done = asyncio.Event()
+        watcher = asyncio.ensure_future(watch(done))
+        started = time.perf_counter()
+        texts = await asyncio.gather(*(one(m) for m in messages))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await watcher
+        return texts, elapsed
+
+    texts, elapsed = asyncio.run(main())
+    expected = [stub.completion({'messages': m})['choices'][0]['message']['content'] for m in messages]
+    ok = sum(text == want for text, want in zip(texts, expected))
+    one_ms = (0.2 + 0.05 * 5) * 1000
+    result = {'calls': 32, 'ok': ok, 'errors': {}, 'calls_per_sec': 32 / elapsed,
+              'p50_ms': elapsed * 1000, 'max_ms': elapsed * 1000, 'waiting_threads': peak_threads}
+    return result, [
+        ('全部成功且内容完整', ok == 32),
+        ('并发等待：总耗时不超过单个请求的 3 倍', elapsed * 1000 <= one_ms * 3),
+        ('等待期间没有线程在执行网关代码', peak_threads == 0),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='llm_gateway 测试（本地模拟服务）')
+    parser.add_argument('-k', dest='selected', help='只运行名称包含该字符串的场景')
+    parser.add_argument('-o', '--output', help='把结果保存为 JSON')
+    args = parser.parse_args()
+
+    report, failures = {}, 0
+    for name, stub_options, func in SCENARIOS:
+        if args.selected and args.selected not in name:
+            continue
+        with LLMStub(**stub_options) as stub:
+            result, checks = func(stub)
+            result['server'] = stub.get_stats()
+        report[name] = dict(result, checks={label: ok for label, ok in checks})
+        print(f'{name:<14}{result["ok"]:>4}/{result["calls"]:<4} 成功  {result["calls_per_sec"]:8.1f} 次/秒  '
+              f'p50 {result["p50_ms"]:7.1f}ms  max {result["max_ms"]:7.1f}ms  '
+              f'服务端请求 {result["server"]["requests"]:>4}  最大并发 {result["server"]["max_concurrency"]:>3}  '
+              f'错误 {result["errors"] or "-"}')
+        if 'first_ms' in result:
+            print(f'    流式：第一段 {result["first_ms"]:.1f}ms，全部 {result["total_ms"]:.1f}ms，共 {result["chunks"]} 段')
+        for label, ok in checks:
+            if not ok:
+                failures += 1
+                print(f'    检查失败：{label}')
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if failures:
+        print(f'\n{failures} 项检查失败')
+        sys.exit(1)
+    print('\n所有检查通过')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,301 @@
+"""多节点会话路由测试：一致性哈希分配会话，在有流量的情况下增加和移除节点，检查会话没有丢失
+
+用法：
+    python tools/bench_routing.py
+    python tools/bench_routing.py --nodes 3 --sessions 300 --messages 3 --clients 16 -o routing.json
+
+在各自的临时目录中启动 nodes + 1 个节点（gunicorn -w 1，BOT_ADMIN_TOKEN 相同），
+路由层（session_router.py）在本进程中运行，依次：
+    1. 通过路由层给每个会话发送若干条消息，统计各节点的会话数
+    2. 客户端持续发送消息的同时增加一个节点，统计迁移的会话比例和耗时
+    3. 客户端持续发送消息的同时移除一个节点（节点在迁移完成前保持运行）
+每个阶段结束后检查：每个会话只在一个节点上、就是路由层选择的节点，
+对话历史的条数等于发送的消息数（没有请求落到空会话上）。
+另外计算同样的会话用取模分配（hash % 节点数）时需要换节点的比例，以及经过路由层的额外耗时。
+检查不通过时以非零状态退出。
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import corpus  # noqa: E402
+
+TOKEN = 'bench-routing-token'
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_ready(url: str, process: subprocess.Popen, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'节点已退出（状态 {process.returncode}）')
+        try:
+            with urllib.request.urlopen(url, timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('等待节点启动超时')
+
+
+def _start_node(directory: str, args):
+    port = _free_port()
+    env = dict(os.environ, BOT_ADMIN_TOKEN=TOKEN, BOT_OFFLINE='1', BOT_SELF_IMPROVE='0', PYTHONUNBUFFERED='1')
+    env.pop('BOT_STATE_SOCKET', None)
+    env.pop('BOT_SESSION_DIR', None)
+    command = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+               '--pythonpath', ROOT, '-w', '1', '--threads', str(args.threads),
+               '-b', f'127.0.0.1:{port}', 'app:app']
+    os.makedirs(directory)
+    process = subprocess.Popen(command, cwd=directory, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return f'http://127.0.0.1:{port}', process
+
+
+def _node_sessions(router, node: str) -> List[str]:
+    response = router.http.get(f'{node}/admin/sessions', headers=router._admin_headers, timeout=30)
+    response.raise_for_status()
+    return response.json()['sessions']
+
+
+class Traffic:
+    """通过路由层给会话发送消息，记录每个会话发送成功的消息数"""
+    def __init__(self, client, session_ids: List[str], seed: int):
+        self.client = client
+        self.session_ids = session_ids
+        self.sent = {session_id: 0 for session_id in session_ids}
+        self.latencies = []
+        self.errors = []
+        self._messages = corpus.messages(500, seed)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def send(self, session_id: str, index: int = 0):
+        message = self._messages[index % len(self._messages)]
+        started = time.perf_counter()
+        response = self.client.post('/api/bot', json={'message': message}, headers={'X-Session-ID': session_id})
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            if response.status_code == 200 and response.get_json().get('status') == 'success':
+                self.sent[session_id] += 1
+                self.latencies.append(elapsed)
+            else:
+                self.errors.append((session_id, response.status_code))
+
+    def _loop(self, seed: int):
+        rng = random.Random(seed)
+        while not self._stop.is_set():
+            # 每个会话的消息数不超过对话历史的上限
+            session_id = rng.choice(self.session_ids)
+            if self.sent[session_id] < 150:
+                self.send(session_id, rng.randrange(1 << 20))
+
+    def run_during(self, clients: int, action):
+        """clients 个线程持续发送消息的同时执行 action，返回 action 的结果和期间发送的消息数"""
+        self._stop.clear()
+        before = sum(self.sent.values())
+        threads = [threading.Thread(target=self._loop, args=(i,), daemon=True) for i in range(clients)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.3)
+        try:
+            result = action()
+        finally:
+            time.sleep(0.3)
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+        return result, sum(self.sent.values()) - before
+
+
+def _check(router, client, traffic: Traffic, retired: List[str] = ()) -> Dict[str, object]:
+    """检查每个会话只在路由层选择的节点上，且对话历史完整"""
+    located = {}
+    duplicated = 0
+    counts = {}
+    for node in router.ring.nodes + list(retired):
+        ids = [s for s in _node_sessions(router, node) if s in traffic.sent]
+        counts[node] = len(ids)
+        for session_id in ids:
+            duplicated += session_id in located
+            located[session_id] = node
+    misplaced = sum(1 for s in traffic.session_ids if located.get(s) != router.ring.node_for(s))
+    incomplete = 0
+    for session_id in traffic.session_ids:
+        response = client.get(f'/router/sessions/{session_id}', headers={'X-Admin-Token': TOKEN})
+        history = response.get_json().get('state', {}).get('chat_history', []) if response.status_code == 200 else []
+        # 每条消息在对话历史中记录一条（用户消息和回复在同一条中）
+        incomplete += len(history) != traffic.sent[session_id]
+    return {'counts': counts, 'duplicated': duplicated, 'misplaced': misplaced, 'incomplete': incomplete}
+
+
+def _modulo_moved(session_ids: List[str], before: int, after: int) -> float:
+    from session_router import _hash
+    return sum(_hash(s) % before != _hash(s) % after for s in session_ids) / len(session_ids)
+
+
+def run(args) -> dict:
+    os.environ['BOT_ADMIN_TOKEN'] = TOKEN
+    from session_router import SessionRouter, create_app
+
+    base = tempfile.mkdtemp(prefix='bot-routing-')
+    nodes = []
+    try:
+        for i in range(args.nodes + 1):
+            nodes.append(_start_node(os.path.join(base, f'node{i}'), args))
+        for url, process in nodes:
+            _wait_ready(url + '/metrics', process, args.timeout)
+        urls = [url for url, _ in nodes]
+
+        router = SessionRouter(urls[:args.nodes], admin_token=TOKEN)
+        client = create_app(router).test_client()
+        session_ids = [f'bench-routing-{i:05d}' for i in range(args.sessions)]
+        traffic = Traffic(client, session_ids, args.seed)
+
+        # 路由层的额外耗时：同样的请求依次直接发给节点和经过路由层
+        direct, routed = [], []
+        data = json.dumps({'message': '你好'}).encode('utf-8')
+        for i in range(args.overhead_requests):
+            session_id = f'overhead-direct-{i:05d}'
+            request = urllib.request.Request(router.ring.node_for(session_id) + '/api/bot', data=data, headers={
+                'Content-Type': 'application/json', 'X-Session-ID': session_id})
+            started = time.perf_counter()
+            with urllib.request.urlopen(request, timeout=30):
+                pass
+            direct.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            client.post('/api/bot', data=data, headers={'Content-Type': 'application/json',
+                                                        'X-Session-ID': f'overhead-routed-{i:05d}'})
+            routed.append(time.perf_counter() - started)
+
+        # 1. 初始分配
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.clients) as pool:
+            list(pool.map(lambda item: traffic.send(item[1], item[0]),
+                          enumerate(s for s in session_ids for _ in range(args.messages))))
+        initial_s = time.perf_counter() - started
+        initial = _check(router, client, traffic)
+
+        # 2. 增加节点
+        added, added_messages = traffic.run_during(args.clients, lambda: router.add_node(urls[-1]))
+        scale_out = _check(router, client, traffic)
+
+        # 3. 移除节点（迁移完成后再停止）
+        removed_node = urls[0]
+        removed, removed_messages = traffic.run_during(args.clients, lambda: router.remove_node(removed_node))
+        scale_in = _check(router, client, traffic, retired=[removed_node])
+        left_on_removed = scale_in['counts'][removed_node]
+    finally:
+        for _, process in nodes:
+            process.send_signal(signal.SIGTERM)
+        for _, process in nodes:
+            try:
+                process.wait(30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        shutil.rmtree(base, ignore_errors=True)
+
+    return {
+        'config': vars(args),
+        'initial': dict(initial, seconds=initial_s),
+        'scale_out': dict(scale_out, report=added, messages_during=added_messages,
+                          modulo_moved_fraction=_modulo_moved(session_ids, args.nodes, args.nodes + 1)),
+        'scale_in': dict(scale_in, report=removed, messages_during=removed_messages, left_on_removed=left_on_removed,
+                         modulo_moved_fraction=_modulo_moved(session_ids, args.nodes + 1, args.nodes)),
+        'latency': {
+            'direct_median_ms': statistics.median(direct) * 1000 if direct else None,
+            'routed_median_ms': statistics.median(routed) * 1000 if routed else None,
+            'concurrent_median_ms': statistics.median(traffic.latencies) * 1000 if traffic.latencies else None,
+        },
+        'router_stats': dict(router.stats),
+        'errors': traffic.errors[:20],
+        'error_count': len(traffic.errors),
+        'total_messages': sum(traffic.sent.values()),
+    }
+
+
+def _balance(counts: Dict[str, int]) -> str:
+    values = [v for v in counts.values() if v]
+    mean = sum(values) / len(values)
+    return f'{len(values)} 个节点 {sorted(values)}，最多的是平均的 {max(values) / mean:.2f} 倍'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='多节点会话路由测试')
+    parser.add_argument('--nodes', type=int, default=3, help='初始节点数（另外启动一个用于扩容）')
+    parser.add_argument('--sessions', type=int, default=300)
+    parser.add_argument('--messages', type=int, default=3, help='初始阶段每个会话的消息数')
+    parser.add_argument('--clients', type=int, default=16, help='并发客户端数')
+    parser.add_argument('--threads', type=int, default=8, help='每个节点的线程数')
+    parser.add_argument('--overhead-requests', type=int, default=100, help='测量直连耗时的请求数')
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='把结果保存为 JSON')
+    args = parser.parse_args()
+
+    result = run(args)
+    n, sessions = args.nodes, args.sessions
+    print(f'{n} 个节点，{sessions} 个会话，每个会话 {args.messages} 条消息，{args.clients} 个并发客户端')
+    print(f'初始分配：{_balance(result["initial"]["counts"])}')
+    for key, label, before, after in (('scale_out', '增加节点', n, n + 1), ('scale_in', '移除节点', n + 1, n)):
+        stage = result[key]
+        report = stage['report']
+        print(f'{label}（{before} -> {after}）：迁移 {report["moved"]}/{sessions} 个会话'
+              f'（{report["moved"] / sessions:.0%}，取模分配需要 {stage["modulo_moved_fraction"]:.0%}），'
+              f'耗时 {report["seconds"]:.2f}s，期间处理 {stage["messages_during"]} 条消息')
+        print(f'    {_balance(stage["counts"])}')
+    latency = result['latency']
+    print(f'单条消息耗时（中位数）：直连 {latency["direct_median_ms"]:.2f}ms，'
+          f'经过路由层 {latency["routed_median_ms"]:.2f}ms；'
+          f'{args.clients} 个并发客户端时经过路由层 {latency["concurrent_median_ms"]:.2f}ms')
+    stats = result['router_stats']
+    print(f'请求时迁移 {stats["migrated_on_request"]} 次，因 409 重试 {stats["retries"]} 次，'
+          f'共发送 {result["total_messages"]} 条消息，失败 {result["error_count"]} 条')
+
+    checks = [('所有消息都处理成功', result['error_count'] == 0)]
+    for key, label in (('initial', '初始分配'), ('scale_out', '增加节点后'), ('scale_in', '移除节点后')):
+        stage = result[key]
+        checks += [
+            (f'{label}每个会话只在一个节点上', stage['duplicated'] == 0 and sum(stage['counts'].values()) == sessions),
+            (f'{label}每个会话都在路由层选择的节点上', stage['misplaced'] == 0),
+            (f'{label}对话历史完整', stage['incomplete'] == 0),
+        ]
+    checks += [
+        ('增加节点时迁移的会话不超过一半', result['scale_out']['report']['moved'] < sessions / 2),
+        ('迁移没有失败', result['scale_out']['report']['failed'] == result['scale_in']['report']['failed'] == 0),
+        ('移除的节点上没有剩余会话', result['scale_in']['left_on_removed'] == 0),
+    ]
+    failures = [label for label, ok in checks if not ok]
+    for label in failures:
+        print(f'    检查失败：{label}')
+    if not failures:
+        print('检查全部通过')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(dict(result, failures=failures), f, ensure_ascii=False, indent=2)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,389 @@
+"""后台任务调度测试：检查优先级、并发上限、CPU 份额、运行时限、抖动和关闭，
+并测量后台学习对请求延迟的影响
+
+用法：
+    python tools/bench_scheduler.py
+    python tools/bench_scheduler.py --duration 5 --clients 4 --qa-pairs 20000 -o scheduler.json
+
+依次：
+    1. 在独立的 Scheduler 上检查：一个工作线程时按 request > learning > analysis 的顺序执行；
+       learning 同时只运行一个，期间 request 任务不用排队；CPU 份额限制了任务实际使用的 CPU；
+       超出运行时限的任务在检查点被取消；周期任务的间隔有抖动；shutdown 取消排队的任务、
+       等运行中的任务在检查点退出后调用保存函数；snapshot 列出排队和运行中的任务
+    2. 若干客户端线程持续调用 respond，同时在后台解析网页（与自主学习的解析步骤相同），比较
+       没有后台任务、后台任务使用普通线程（原来的做法）和使用调度器时的请求延迟与后台吞吐量
+    3. 已有大量教学问答时教新问答的耗时：原来在请求中同步写文件，现在交给调度器合并写入
+检查不通过时以非零状态退出。
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import corpus  # noqa: E402
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {'count': 0}
+    return {
+        'count': len(samples),
+        'median_ms': statistics.median(samples) * 1000,
+        'p99_ms': samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000,
+        'max_ms': samples[-1] * 1000,
+    }
+
+
+def _spin(seconds: float):
+    """占用 CPU 一段时间"""
+    end = time.thread_time() + seconds
+    while time.thread_time() < end:
+        pass
+
+
+# ------------------------------------------------------------ 1. 调度器本身
+
+def check_scheduler() -> dict:
+    from scheduler import ANALYSIS, LEARNING, REQUEST, Scheduler, TaskClass, checkpoint
+
+    def classes(**overrides):
+        result = {
+            REQUEST: TaskClass(REQUEST, 0),
+            LEARNING: TaskClass(LEARNING, 1, concurrency=1, yields=True),
+            ANALYSIS: TaskClass(ANALYSIS, 2, concurrency=1, yields=True),
+        }
+        result.update(overrides)
+        return result
+
+    results = {}
+
+    # 优先级：一个工作线程被占用时提交三类任务，空出来后按优先级执行
+    scheduler = Scheduler(workers=1, classes=classes())
+    order = []
+    gate = threading.Event()
+    scheduler.submit(gate.wait, (5,), name='blocker')
+    time.sleep(0.05)
+    for cls in (ANALYSIS, LEARNING, REQUEST, ANALYSIS, REQUEST):
+        scheduler.submit(order.append, (cls,), name=cls, cls=cls)
+    gate.set()
+    scheduler.submit(lambda: None, cls=ANALYSIS).wait(5)
+    results['priority_order'] = order
+    scheduler.shutdown()
+
+    # 并发上限：learning 同时只运行一个，request 任务不受影响
+    scheduler = Scheduler(workers=3, classes=classes())
+    active, peak, lock = [0], [0], threading.Lock()
+
+    def learn():
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.1)
+        with lock:
+            active[0] -= 1
+
+    learning = [scheduler.submit(learn, cls=LEARNING) for _ in range(4)]
+    time.sleep(0.02)
+    started = time.perf_counter()
+    scheduler.submit(lambda: None, cls=REQUEST).wait(5)
+    results['request_wait_ms'] = (time.perf_counter() - started) * 1000
+    for task in learning:
+        task.wait(5)
+    results['learning_peak'] = peak[0]
+    scheduler.shutdown()
+
+    # CPU 份额：持续占用 CPU 的任务（每 5ms 一个检查点）实际使用的 CPU
+    share, window, duration = 0.25, 1.0, 3.0
+    scheduler = Scheduler(workers=1, classes=classes(
+        **{ANALYSIS: TaskClass(ANALYSIS, 2, concurrency=1, cpu_share=share, window=window)}))
+
+    def burn():
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            _spin(0.005)
+            checkpoint()
+
+    task = scheduler.submit(burn, cls=ANALYSIS)
+    task.wait(duration + 5)
+    results['budget'] = {'share': share, 'window': window, 'wall_s': duration, 'cpu_s': task.cpu,
+                         'allowed_cpu_s': share * (duration + window)}
+    scheduler.shutdown()
+
+    # 运行时限：超出时限的任务在下一个检查点被取消
+    scheduler = Scheduler(workers=1, classes=classes(
+        **{LEARNING: TaskClass(LEARNING, 1, concurrency=1, time_limit=0.3)}))
+
+    def forever():
+        while True:
+            time.sleep(0.01)
+            checkpoint()
+
+    started = time.perf_counter()
+    task = scheduler.submit(forever, cls=LEARNING)
+    task.wait(5)
+    results['time_limit'] = {'limit_s': 0.3, 'ran_s': time.perf_counter() - started,
+                             'cancelled': scheduler.classes[LEARNING].stats['cancelled']}
+    scheduler.shutdown()
+
+    # 抖动：周期任务的实际间隔
+    scheduler = Scheduler(workers=1, classes=classes())
+    runs = []
+    interval, jitter = 0.05, 0.5
+    scheduler.every('tick', interval, lambda: runs.append(time.monotonic()), cls=REQUEST, delay=0, jitter=jitter)
+    time.sleep(interval * 30)
+    scheduler.shutdown()
+    gaps = [b - a for a, b in zip(runs, runs[1:])]
+    results['jitter'] = {'interval': interval, 'jitter': jitter, 'runs': len(runs),
+                         'min_gap': min(gaps), 'max_gap': max(gaps)}
+
+    # 关闭：排队的任务被取消，运行中的任务在检查点退出，之后调用保存函数；查看排队和运行中的任务
+    scheduler = Scheduler(workers=2, classes=classes())
+    flushed = []
+    scheduler.on_shutdown(lambda: flushed.append(scheduler.snapshot()['running']))
+    running = scheduler.submit(forever, name='crawl', cls=LEARNING)
+    queued = scheduler.submit(lambda: None, name='later', cls=ANALYSIS, delay=60)
+    periodic = scheduler.every('periodic', 60, lambda: None)
+    time.sleep(0.1)
+    snapshot = scheduler.snapshot()
+    started = time.perf_counter()
+    finished = scheduler.shutdown(timeout=5)
+    results['shutdown'] = {
+        'seconds': time.perf_counter() - started,
+        'finished': finished,
+        'hook_calls': len(flushed),
+        'running_at_hook': flushed[0] if flushed else None,
+        'tasks_done': running.done and queued.done and periodic.done,
+        'queued_cancelled': queued.cancelled and periodic.cancelled,
+        'submit_after': scheduler.submit(lambda: None).cancelled,
+        'second_call': scheduler.shutdown(),
+        'hook_calls_after_second': len(flushed),
+    }
+    results['snapshot'] = {
+        'running': [t['name'] for t in snapshot['running']],
+        'queued': [t['name'] for t in snapshot['queued']],
+    }
+    return results
+
+
+# ------------------------------------------------------------ 2. 请求延迟
+
+def _page(rng_seed: int) -> str:
+    paragraphs = ''.join(f'<p>{corpus.paragraph(rng_seed * 100 + i, 6)}</p>' for i in range(40))
+    links = ''.join(f'<a href="/page/{rng_seed}-{i}">链接{i}</a>' for i in range(30))
+    return f'<html><head><title>页面</title><script>var x = 1;</script></head><body>' \
+           f'<nav>导航</nav><article>{paragraphs}</article>{links}<footer>页脚</footer></body></html>'
+
+
+def _parse_loop(learner, pages, stop: threading.Event, parsed: list):
+    """与自主学习的解析步骤相同：解析网页、提取正文、判断相关性、提取链接"""
+    from bs4 import BeautifulSoup
+    from scheduler import checkpoint
+    i = 0
+    while not stop.is_set():
+        checkpoint()
+        soup = BeautifulSoup(pages[i % len(pages)], 'html.parser')
+        text = learner._extract_main_content(soup)
+        learner._is_relevant(text, '机器学习')
+        soup.find_all('a', href=True)
+        parsed[0] += 1
+        i += 1
+
+
+def measure_latency(bot, mode: str, args) -> dict:
+    from scheduler import LEARNING, SCHEDULER
+
+    messages = corpus.messages(500, args.seed)
+    pages = [_page(i) for i in range(8)]
+    stop = threading.Event()
+    parsed = [0]
+    background = None
+    if mode == 'thread':
+        background = threading.Thread(target=_parse_loop, args=(bot.web_learner, pages, stop, parsed), daemon=True)
+        background.start()
+    elif mode == 'scheduler':
+        background = SCHEDULER.submit(_parse_loop, (bot.web_learner, pages, stop, parsed),
+                                      name='bench-parse', cls=LEARNING)
+    time.sleep(0.2)
+
+    latencies = [[] for _ in range(args.clients)]
+    deadline = time.monotonic() + args.duration
+
+    def client(index: int):
+        session = bot.new_session()
+        i = index
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            session.respond(messages[i % len(messages)])
+            latencies[index].append(time.perf_counter() - started)
+            i += args.clients
+            time.sleep(args.think)
+
+    parsed_before = parsed[0]
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    pages_during = parsed[0] - parsed_before
+    stop.set()
+    if mode == 'thread':
+        background.join()
+    elif mode == 'scheduler':
+        background.wait(10)
+    samples = [s for client_samples in latencies for s in client_samples]
+    return dict(_percentiles(samples), mode=mode, background_pages_per_s=pages_during / args.duration,
+                requests_per_s=len(samples) / args.duration)
+
+
+# ------------------------------------------------------------ 3. 教学问答
+
+def measure_teach(bot, args) -> dict:
+    from scheduler import REQUEST, SCHEDULER
+
+    pairs = list(corpus.qa_pairs(args.teach * 2, args.seed + 7).items())
+    sync_pairs, async_pairs = pairs[:args.teach], pairs[args.teach:]
+
+    # 原来的做法：写文件在请求中完成
+    sync = []
+    for question, answer in sync_pairs:
+        started = time.perf_counter()
+        bot.teach(question, answer)
+        bot.save_knowledge()
+        sync.append(time.perf_counter() - started)
+
+    saves_before = SCHEDULER.classes[REQUEST].stats['completed']
+    background = []
+    for question, answer in async_pairs:
+        started = time.perf_counter()
+        bot.teach(question, answer)
+        background.append(time.perf_counter() - started)
+
+    def saved() -> bool:
+        try:
+            with open(bot.knowledge_file, encoding='utf-8') as f:
+                stored = json.load(f)
+            return all(question in stored for question, _ in async_pairs)
+        except (OSError, ValueError):
+            return False
+
+    deadline = time.monotonic() + 30
+    while not saved() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return {
+        'sync': _percentiles(sync),
+        'scheduled': _percentiles(background),
+        'teaches': len(async_pairs),
+        'file_writes': SCHEDULER.classes[REQUEST].stats['completed'] - saves_before,
+        'saved': saved(),
+    }
+
+
+def run(args) -> dict:
+    os.environ.update(BOT_OFFLINE='1', BOT_SELF_IMPROVE='0')
+    logging.disable(logging.WARNING)
+    result = {'config': vars(args), 'scheduler': check_scheduler()}
+
+    workdir = tempfile.mkdtemp(prefix='bot-scheduler-')
+    os.chdir(workdir)
+    with open('bot_knowledge.json', 'w', encoding='utf-8') as f:
+        json.dump(corpus.qa_pairs(args.qa_pairs, args.seed), f, ensure_ascii=False)
+    from simple_bot import SimpleBot
+    from scheduler import SCHEDULER
+    with contextlib.redirect_stdout(io.StringIO()):
+        bot = SimpleBot('调度测试')
+        import tokenizer
+        tokenizer.cut('预热分词')
+        result['latency'] = [measure_latency(bot, mode, args) for mode in ('none', 'thread', 'scheduler')]
+        result['teach'] = measure_teach(bot, args)
+        result['tasks'] = SCHEDULER.snapshot()['classes']
+        # 在临时目录删除之前停止后台任务并保存状态
+        SCHEDULER.shutdown()
+    os.chdir(ROOT)
+    import shutil
+    shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='后台任务调度测试')
+    parser.add_argument('--duration', type=float, default=4.0, help='每种模式发送请求的秒数')
+    parser.add_argument('--clients', type=int, default=4, help='并发客户端数')
+    parser.add_argument('--think', type=float, default=0.005, help='客户端两次请求之间的间隔（秒）')
+    parser.add_argument('--qa-pairs', type=int, default=20000, help='已有的教学问答条数')
+    parser.add_argument('--teach', type=int, default=50, help='教的问答条数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='把结果保存为 JSON')
+    args = parser.parse_args()
+
+    result = run(args)
+    checks_data = result['scheduler']
+    budget, limit, jitter = checks_data['budget'], checks_data['time_limit'], checks_data['jitter']
+    shutdown = checks_data['shutdown']
+    print(f'一个工作线程时的执行顺序：{" > ".join(checks_data["priority_order"])}')
+    print(f'learning 最多同时运行 {checks_data["learning_peak"]} 个，'
+          f'期间 request 任务等待 {checks_data["request_wait_ms"]:.1f}ms')
+    print(f'CPU 份额 {budget["share"]}：{budget["wall_s"]:.0f}s 内使用 CPU {budget["cpu_s"]:.2f}s'
+          f'（上限 {budget["allowed_cpu_s"]:.2f}s）')
+    print(f'运行时限 {limit["limit_s"]}s：{limit["ran_s"]:.2f}s 后取消')
+    print(f'周期 {jitter["interval"] * 1000:.0f}ms、抖动 ±{jitter["jitter"]:.0%}：'
+          f'实际间隔 {jitter["min_gap"] * 1000:.0f}-{jitter["max_gap"] * 1000:.0f}ms')
+    print(f'关闭：{shutdown["seconds"] * 1000:.0f}ms，运行中的任务已退出：{shutdown["finished"]}')
+
+    print(f'\n{args.clients} 个客户端持续请求 {args.duration:g}s，后台解析网页：')
+    print(f'{"后台任务":<10}{"中位数":>10}{"p99":>10}{"最大":>10}{"请求/秒":>10}{"后台网页/秒":>12}')
+    labels = {'none': '无', 'thread': '普通线程', 'scheduler': '调度器'}
+    for row in result['latency']:
+        print(f'{labels[row["mode"]]:<10}{row["median_ms"]:>8.2f}ms{row["p99_ms"]:>8.2f}ms{row["max_ms"]:>8.2f}ms'
+              f'{row["requests_per_s"]:>10.0f}{row["background_pages_per_s"]:>12.1f}')
+
+    teach = result['teach']
+    print(f'\n已有 {args.qa_pairs} 条教学问答时教新问答：同步写文件 {teach["sync"]["median_ms"]:.2f}ms，'
+          f'交给调度器 {teach["scheduled"]["median_ms"]:.3f}ms（中位数）；'
+          f'{teach["teaches"]} 条问答写文件 {teach["file_writes"]} 次')
+
+    latency = {row['mode']: row for row in result['latency']}
+    checks = [
+        ('按优先级执行', checks_data['priority_order'] == ['request', 'request', 'learning', 'analysis', 'analysis']),
+        ('learning 同时只运行一个', checks_data['learning_peak'] == 1),
+        ('learning 运行时 request 任务不用排队', checks_data['request_wait_ms'] < 50),
+        ('CPU 份额限制了使用的 CPU', budget['cpu_s'] <= budget['allowed_cpu_s'] + 0.1),
+        ('超出运行时限的任务被取消', limit['cancelled'] == 1 and limit['ran_s'] < 1.0),
+        ('周期任务的间隔有抖动', jitter['max_gap'] - jitter['min_gap'] > jitter['interval'] * 0.3),
+        ('关闭时运行中的任务退出、排队的任务取消',
+         shutdown['finished'] and shutdown['tasks_done'] and shutdown['queued_cancelled']),
+        ('任务退出后才保存状态，且只保存一次',
+         shutdown['running_at_hook'] == [] and shutdown['hook_calls_after_second'] == 1),
+        ('关闭后不再接受任务', shutdown['submit_after']),
+        ('可以查看运行和排队的任务',
+         checks_data['snapshot']['running'] == ['crawl']
+         and sorted(checks_data['snapshot']['queued']) == ['later', 'periodic']),
+        ('后台任务使用调度器时请求延迟低于普通线程', latency['scheduler']['p99_ms'] < latency['thread']['p99_ms']),
+        ('后台任务在请求期间仍有进展', latency['scheduler']['background_pages_per_s'] > 0),
+        ('教的问答都写入了文件', teach['saved']),
+        ('连续教的问答合并写入', teach['file_writes'] < teach['teaches']),
+    ]
+    failures = [label for label, ok in checks if not ok]
+    for label in failures:
+        print(f'    检查失败：{label}')
+    if not failures:
+        print('检查全部通过')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(dict(result, failures=failures), f, ensure_ascii=False, indent=2, default=str)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""启动时间基准测试：在全新的子进程中测量冷启动各阶段的耗时
+
+用法：
+    python tools/bench_startup.py
+    python tools/bench_startup.py --repeat 10 --max-import-ms 400 --max-total-ms 1500 -o startup.json
+
+阶段：
+    import          导入 simple_bot
+    init            构造 SimpleBot（加载状态、构建路由表）
+    first_response  第一次 respond
+    first_cut       第一次中文分词（加载 jieba 词典）
+    api             导入 api/index.py 并处理第一个请求（Vercel 冷启动的实际路径）
+
+每个阶段取多次运行的中位数；另外用 python -X importtime 列出导入最慢的模块。
+指定 --max-*-ms 预算时，超出预算以非零状态退出（用于 CI）。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 子进程中运行的测量脚本，结果以 JSON 输出到最后一行
+PROBE = '''
+import contextlib, io, json, sys, time
+sys.path.insert(0, {root!r})
+timings = {{}}
+started = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    import simple_bot
+    timings['import'] = time.perf_counter() - started
+    mark = time.perf_counter()
+    bot = simple_bot.SimpleBot('小助手')
+    timings['init'] = time.perf_counter() - mark
+    mark = time.perf_counter()
+    bot.respond('你好')
+    timings['first_response'] = time.perf_counter() - mark
+    import tokenizer
+    mark = time.perf_counter()
+    tokenizer.cut('机器学习是什么')
+    timings['first_cut'] = time.perf_counter() - mark
+timings['total'] = time.perf_counter() - started
+print(json.dumps(timings))
+'''
+
+API_PROBE = '''
+import contextlib, io, json, sys, time
+sys.path.insert(0, {root!r})
+sys.path.insert(0, {api!r})
+started = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    import index
+    response = index.app.test_client().post('/', json={{'message': '你好'}})
+assert response.status_code == 200, response.status_code
+print(json.dumps({{'api': time.perf_counter() - started}}))
+'''
+
+PHASES = ['import', 'init', 'first_response', 'first_cut', 'total', 'api']
+
+
+def _env() -> Dict[str, str]:
+    env = dict(os.environ, BOT_OFFLINE='1')
+    env.pop('PYTHONSTARTUP', None)
+    return env
+
+
+def run_probe(code: str, workdir: str) -> Dict[str, float]:
+    result = subprocess.run([sys.executable, '-c', code], cwd=workdir, env=_env(),
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure(repeat: int, workdir: str, with_api: bool = True) -> Dict[str, List[float]]:
+    """重复运行测量脚本，返回各阶段的耗时列表（毫秒）"""
+    runs = {phase: [] for phase in PHASES}
+    probe = PROBE.format(root=ROOT)
+    api_probe = API_PROBE.format(root=ROOT, api=os.path.join(ROOT, 'api'))
+    for _ in range(repeat):
+        timings = run_probe(probe, workdir)
+        if with_api:
+            timings.update(run_probe(api_probe, workdir))
+        for phase, seconds in timings.items():
+            runs[phase].append(seconds * 1000)
+    return {phase: values for phase, values in runs.items() if values}
+
+
+def import_profile(workdir: str, top: int, module: str = 'simple_bot') -> List[Dict[str, object]]:
+    """python -X importtime 的结果中，被直接或间接导入的耗时最多的顶层依赖"""
+    code = f'import sys; sys.path.insert(0, {ROOT!r}); import {module}'
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=workdir, env=_env(),
+                            capture_output=True, text=True, check=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth <= 1:
+            modules.append({'module': name.strip(), 'depth': depth,
+                            'self_ms': int(self_us) / 1000, 'cumulative_ms': int(cumulative_us) / 1000})
+    modules.sort(key=lambda m: m['cumulative_ms'], reverse=True)
+    return modules[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SimpleBot 冷启动时间基准测试')
+    parser.add_argument('--repeat', type=int, default=5, help='运行子进程的次数（取中位数）')
+    parser.add_argument('--top', type=int, default=15, help='列出导入最慢的模块数')
+    parser.add_argument('--no-api', action='store_true', help='不测量 api/index.py 的冷启动')
+    for phase in ('import', 'init', 'first-response', 'first-cut', 'total', 'api'):
+        parser.add_argument(f'--max-{phase}-ms', type=float, help=f'{phase} 阶段中位数的预算（毫秒）')
+    parser.add_argument('-o', '--output', help='把结果保存为 JSON')
+    args = parser.parse_args()
+
+    # 在空目录中运行，不读取开发环境中的状态文件
+    with tempfile.TemporaryDirectory() as workdir:
+        runs = measure(args.repeat, workdir, with_api=not args.no_api)
+        modules = import_profile(workdir, args.top)
+
+    medians = {phase: statistics.median(values) for phase, values in runs.items()}
+    print(f'{"阶段":<18}{"中位数":>10}{"最小":>10}{"最大":>10}  (ms, {args.repeat} 次)')
+    for phase, values in runs.items():
+        print(f'{phase:<20}{medians[phase]:>10.1f}{min(values):>10.1f}{max(values):>10.1f}')
+
+    print(f'\n{"导入耗时最多的模块":<30}{"累计":>10}{"自身":>10}  (ms)')
+    for m in modules:
+        print(f'{"  " * m["depth"] + m["module"]:<36}{m["cumulative_ms"]:>10.1f}{m["self_ms"]:>10.1f}')
+
+    failures = []
+    for phase in PHASES:
+        budget = getattr(args, f'max_{phase}_ms')
+        if budget is not None and phase in medians and medians[phase] > budget:
+            failures.append(f'{phase} {medians[phase]:.1f}ms 超出预算 {budget:g}ms')
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'runs': runs, 'medians': medians, 'imports': modules, 'failures': failures},
+                      f, ensure_ascii=False, indent=2)
+    if failures:
+        print('\n' + '\n'.join(failures))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+"""状态服务多进程测试：多个 worker 进程通过本地状态服务共用长期记忆、教学问答、学到的知识和会话
+
+用法：
+    python tools/bench_state.py
+    python tools/bench_state.py --workers 4 --pairs 200 --memories 2000 --initial-memories 20000 -o state.json
+
+在临时目录中启动 state_service.py，再启动若干个子进程，每个子进程构造自己的 SimpleBot
+（BOT_STATE_SOCKET 指向该服务），依次检查：
+    - 每个进程教不同的问答，所有进程都能回答其他进程教的问题
+    - 一个进程写入的知识推送到其他进程的时间（从写入到其他进程的本地副本更新）
+    - 每个进程写入长期记忆，所有进程的本地副本与服务端的条数一致
+    - 会话在一个进程中开始、在另一个进程中继续，再回到原来的进程，对话历史没有丢失
+    - 停止服务后状态文件完整，不使用状态服务的 SimpleBot 能正常加载
+另外测量写入的往返时间和读取本地副本的时间。检查不通过时以非零状态退出。
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import corpus  # noqa: E402
+
+
+def _percentiles(samples):
+    if not samples:
+        return {}
+    samples = sorted(samples)
+    return {
+        'median_ms': statistics.median(samples) * 1000,
+        'p99_ms': samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000,
+        'max_ms': samples[-1] * 1000,
+    }
+
+
+def _wait_until(condition, timeout: float) -> float:
+    """等待条件成立，返回等待的秒数（超时返回 -1）"""
+    started = time.perf_counter()
+    while not condition():
+        if time.perf_counter() - started > timeout:
+            return -1.0
+        time.sleep(0.001)
+    return time.perf_counter() - started
+
+
+def _worker(index: int, args, socket_path: str, barrier, results):
+    os.environ.update(BOT_STATE_SOCKET=socket_path, BOT_OFFLINE='1', BOT_SELF_IMPROVE='0')
+    logging.disable(logging.WARNING)
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = _run_worker(index, args, barrier)
+    results.put(result)
+
+
+def _run_worker(index: int, args, barrier) -> dict:
+    import state_service
+    from session_store import SessionStore
+    from simple_bot import SimpleBot
+
+    started = time.perf_counter()
+    bot = SimpleBot(f'worker{index}')
+    result = {'index': index, 'init_s': time.perf_counter() - started, 'connected': bot.state is not None}
+    if bot.state is None:
+        return result
+    sessions = SessionStore(bot.new_session, state=bot.state)
+    workers = args.workers
+
+    # 知识推送延迟：写入的值是写入时间
+    arrivals = []
+    bot.state.on_change(state_service.KNOWLEDGE, lambda key, value: key.startswith('bench-')
+                        and not key.startswith(f'bench-{index}-') and arrivals.append(time.time() - float(value)))
+
+    # 1. 教学问答：每个进程教不同的问题
+    pairs = list(corpus.qa_pairs(workers * args.pairs, args.seed).items())
+    own = pairs[index::workers]
+    barrier.wait()
+    writes = []
+    for question, answer in own:
+        mark = time.perf_counter()
+        bot.teach(question, answer)
+        writes.append(time.perf_counter() - mark)
+    for i in range(args.pushes):
+        bot.web_learner.knowledge_base[f'bench-{index}-{i}'] = repr(time.time())
+        time.sleep(0.002)
+    barrier.wait()
+    result['qa_visible_wait_s'] = _wait_until(lambda: len(bot.learned_responses) >= len(pairs), args.timeout)
+    _wait_until(lambda: len(arrivals) >= args.pushes * (workers - 1), args.timeout)
+    reads, answered = [], 0
+    for question, answer in pairs:
+        mark = time.perf_counter()
+        found = bot.qa_index.lookup(question)
+        reads.append(time.perf_counter() - mark)
+        answered += found == answer
+    result.update(qa_total=len(pairs), qa_answered=answered, write=_percentiles(writes),
+                  read=_percentiles(reads), push=_percentiles(arrivals), pushes_received=len(arrivals))
+
+    # 2. 长期记忆
+    store = bot.cognitive.memory.store
+    before = sum(len(v) for v in store.snapshot.values())
+    barrier.wait()
+    memories = corpus.memories(args.memories, args.seed + index + 1)
+    for start in range(0, len(memories), 10):
+        # 与短期记忆整合时一样，每批 10 条
+        store.add(memories[start:start + 10])
+    barrier.wait()
+    expected = before + workers * args.memories
+    result['memory_wait_s'] = _wait_until(lambda: sum(len(v) for v in store.snapshot.values()) >= expected,
+                                          args.timeout)
+    result['memories_local'] = sum(len(v) for v in store.snapshot.values())
+    result['memories_server'] = bot.state.server_stats()['memories']
+    result['memories_expected'] = expected
+
+    # 3. 会话：在本进程开始，在下一个进程继续，再回到本进程
+    own_session = f'bench-session-{index}'
+    other_session = f'bench-session-{(index - 1) % workers}'
+    session = sessions.get(own_session)
+    session.respond(f'我叫用户{index}')
+    for message in corpus.messages(3, args.seed + index):
+        session.respond(message)
+    sessions.save(own_session)
+    result['session_started'] = len(session.chat_history)
+    barrier.wait()
+
+    other = sessions.get(other_session)
+    result['session_continued_first'] = other.chat_history.snapshot()[:1]
+    result['session_continued_seen'] = len(other.chat_history)
+    for message in corpus.messages(2, args.seed + 100 + index):
+        other.respond(message)
+    sessions.save(other_session)
+    result['session_continued'] = len(other.chat_history)
+    barrier.wait()
+
+    _wait_until(lambda: own_session not in sessions, args.timeout)
+    session = sessions.get(own_session)
+    result['session_returned_first'] = session.chat_history.snapshot()[:1]
+    result['session_returned'] = len(session.chat_history)
+    result['session_stats'] = sessions.get_stats()
+    result['client'] = dict(bot.state.stats)
+    barrier.wait()
+    return result
+
+
+def run(args) -> dict:
+    import state_service
+
+    state_dir = tempfile.mkdtemp(prefix='bot-state-')
+    os.chdir(state_dir)
+    if args.initial_memories:
+        from cognitive_system import LongTermStore
+        store = LongTermStore()
+        store.add(corpus.memories(args.initial_memories, args.seed))
+        with open('cognitive_state.json', 'w', encoding='utf-8') as f:
+            json.dump(store.export(), f, ensure_ascii=False)
+
+    socket_path = os.path.join(state_dir, 'state.sock')
+    daemon = state_service.spawn(socket_path, state_dir)
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(args.workers)
+    queue = context.Queue()
+    processes = [context.Process(target=_worker, args=(i, args, socket_path, barrier, queue))
+                 for i in range(args.workers)]
+    try:
+        for process in processes:
+            process.start()
+        workers = sorted((queue.get(timeout=args.timeout * 4) for _ in processes), key=lambda r: r['index'])
+        for process in processes:
+            process.join(args.timeout)
+        server = state_service.StateClient(socket_path).server_stats()
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        daemon.send_signal(signal.SIGTERM)
+        daemon.wait(30)
+
+    # 服务退出时写入状态文件，不使用状态服务的 SimpleBot 应该能加载全部内容
+    os.environ.pop('BOT_STATE_SOCKET', None)
+    os.environ.update(BOT_OFFLINE='1', BOT_SELF_IMPROVE='0')
+    from simple_bot import SimpleBot
+    logging.disable(logging.WARNING)
+    with contextlib.redirect_stdout(io.StringIO()):
+        reloaded = SimpleBot('reloaded')
+    result = {
+        'config': vars(args),
+        'workers': workers,
+        'server': server,
+        'reloaded_qa': len(reloaded.learned_responses),
+        'reloaded_memories': sum(len(v) for v in reloaded.cognitive.memory.store.snapshot.values()),
+        'socket_removed': not os.path.exists(socket_path),
+    }
+    # 在临时目录删除之前停止后台任务并保存状态
+    from scheduler import SCHEDULER
+    SCHEDULER.shutdown()
+    os.chdir(ROOT)
+    shutil.rmtree(state_dir, ignore_errors=True)
+    return result
+
+
+def _merge(workers, key):
+    samples = [w[key] for w in workers if w.get(key)]
+    return {name: max(s[name] for s in samples) if name != 'median_ms'
+            else statistics.median(s[name] for s in samples) for name in samples[0]} if samples else {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='状态服务多进程测试')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--pairs', type=int, default=200, help='每个进程教的问答数')
+    parser.add_argument('--pushes', type=int, default=100, help='每个进程写入的知识条数（测量推送延迟）')
+    parser.add_argument('--memories', type=int, default=2000, help='每个进程写入的长期记忆条数')
+    parser.add_argument('--initial-memories', type=int, default=20000, help='服务启动时已有的长期记忆条数')
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='把结果保存为 JSON')
+    args = parser.parse_args()
+
+    result = run(args)
+    workers = result['workers']
+    n = args.workers
+    write, read, push = _merge(workers, 'write'), _merge(workers, 'read'), _merge(workers, 'push')
+    print(f'{n} 个进程，每个教 {args.pairs} 条问答、写入 {args.memories} 条长期记忆，'
+          f'服务启动时已有 {args.initial_memories} 条长期记忆')
+    print(f'连接并加载全部状态：{statistics.median(w["init_s"] for w in workers) * 1000:.0f}ms（中位数）')
+    if write:
+        print(f'写入往返（教学问答）：中位数 {write["median_ms"]:.3f}ms，p99 {write["p99_ms"]:.3f}ms')
+        print(f'读取本地副本（问答查找）：中位数 {read["median_ms"]:.3f}ms，p99 {read["p99_ms"]:.3f}ms')
+    if push:
+        print(f'推送到其他进程：中位数 {push["median_ms"]:.2f}ms，p99 {push["p99_ms"]:.2f}ms，最大 {push["max_ms"]:.2f}ms')
+    print(f'停止服务后重新加载：问答 {result["reloaded_qa"]} 条，长期记忆 {result["reloaded_memories"]} 条')
+
+    total_qa = n * args.pairs
+    total_memories = args.initial_memories + n * args.memories
+    checks = [('所有进程都连接到状态服务', all(w['connected'] for w in workers))]
+    if checks[0][1]:
+        checks += [
+            ('所有进程都能回答其他进程教的问题', all(w['qa_answered'] == total_qa for w in workers)),
+            ('知识推送到了所有其他进程', all(w['pushes_received'] == args.pushes * (n - 1) for w in workers)),
+            ('各进程的长期记忆与服务端一致',
+             all(w['memories_local'] == w['memories_server'] == total_memories for w in workers)),
+            ('会话在其他进程中继续时对话历史完整',
+             all(w['session_continued_first'] == [f'我叫用户{(w["index"] - 1) % n}']
+                 and w['session_continued_seen'] == workers[(w['index'] - 1) % n]['session_started']
+                 for w in workers)),
+            ('会话回到原来的进程时包含其他进程的回复',
+             all(w['session_returned_first'] == [f'我叫用户{w["index"]}']
+                 and w['session_returned'] == workers[(w['index'] + 1) % n]['session_continued']
+                 for w in workers)),
+        ]
+    checks += [
+        ('状态文件包含全部问答', result['reloaded_qa'] == total_qa),
+        # 会话中的对话也会整合出长期记忆，以服务端最终的条数为准
+        ('状态文件包含全部长期记忆', result['reloaded_memories'] == result['server']['memories'] >= total_memories),
+        ('服务退出时删除套接字文件', result['socket_removed']),
+    ]
+    failures = [label for label, ok in checks if not ok]
+    for label in failures:
+        print(f'    检查失败：{label}')
+    if not failures:
+        print('检查全部通过')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(dict(result, failures=failures), f, ensure_ascii=False, indent=2)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+"""gunicorn 多 worker 内存测试：比较预加载（BOT_PRELOAD=1）和各 worker 各自加载时每个 worker 的内存
+
+用法：
+    python tools/bench_workers.py
+    python tools/bench_workers.py --workers 4 --memories 20000 --qa-pairs 20000 --requests 200 -o workers.json
+
+在临时目录中生成较大的状态文件（长期记忆、教学问答），分别以两种模式启动
+gunicorn -c gunicorn.conf.py app:app，发送一批请求后从 /proc/<pid>/smaps_rollup 读取各进程的：
+    RSS  常驻内存（共享页在每个进程中都计入）
+    PSS  按共享进程数分摊后的内存，所有进程相加就是实际占用
+    USS  进程独占的内存（Private_Clean + Private_Dirty），即每多一个 worker 增加的内存
+jieba 词典只在自主学习时才加载；默认在不预加载时让每个 worker 启动后也加载词典，
+模拟运行一段时间、学习过的 worker（--no-jieba 关闭）。
+只能在 Linux 上运行。
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import corpus  # noqa: E402
+
+
+def _write_state(directory: str, memories: int, qa_pairs: int, seed: int):
+    from cognitive_system import LongTermStore
+    store = LongTermStore()
+    store.add(corpus.memories(memories, seed))
+    with open(os.path.join(directory, 'cognitive_state.json'), 'w', encoding='utf-8') as f:
+        json.dump(store.export(), f, ensure_ascii=False)
+    with open(os.path.join(directory, 'bot_knowledge.json'), 'w', encoding='utf-8') as f:
+        json.dump(corpus.qa_pairs(qa_pairs, seed), f, ensure_ascii=False)
+
+
+# 不预加载时使用的配置：在 gunicorn.conf.py 的基础上，worker 加载应用后再加载 jieba 词典
+JIEBA_CONFIG = '''
+exec(open({config!r}, encoding='utf-8').read())
+
+
+def post_worker_init(worker):
+    import tokenizer
+    tokenizer.preload()
+'''
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _children(pid: int) -> List[int]:
+    children = []
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as f:
+                # 进程名可能含空格，从最后一个右括号之后开始解析
+                fields = f.read().rsplit(')', 1)[1].split()
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(name))
+    return sorted(children)
+
+
+def _memory(pid: int) -> Dict[str, float]:
+    """进程的 RSS、PSS、USS（MB）和线程数"""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(':') and parts[1].isdigit():
+                values[parts[0][:-1]] = int(parts[1])
+    with open(f'/proc/{pid}/status') as f:
+        threads = next(int(line.split()[1]) for line in f if line.startswith('Threads:'))
+    return {
+        'rss_mb': values.get('Rss', 0) / 1024,
+        'pss_mb': values.get('Pss', 0) / 1024,
+        'uss_mb': (values.get('Private_Clean', 0) + values.get('Private_Dirty', 0)) / 1024,
+        'threads': threads,
+    }
+
+
+def _post(url: str, message: str, session_id: str):
+    request = urllib.request.Request(url, data=json.dumps({'message': message}).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json', 'X-Session-ID': session_id})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return response.status
+
+
+def _wait_ready(url: str, process: subprocess.Popen, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn 已退出（状态 {process.returncode}）')
+        try:
+            with urllib.request.urlopen(url, timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('等待 gunicorn 启动超时')
+
+
+def _wait_loaded(pid: int, workers: int, timeout: float):
+    """等待所有 worker 加载完成：worker 数量齐全，且各自的 RSS 在一段时间内不再变化"""
+    deadline = time.monotonic() + timeout
+    previous = None
+    while time.monotonic() < deadline:
+        children = _children(pid)
+        current = [_memory(child)['rss_mb'] for child in children] if len(children) >= workers else None
+        if current is not None and current == previous:
+            return
+        previous = current
+        time.sleep(0.5)
+    raise RuntimeError('等待 worker 加载超时')
+
+
+def run_mode(preload: bool, state_dir: str, args) -> dict:
+    port = _free_port()
+    env = dict(os.environ, BOT_PRELOAD='1' if preload else '0', BOT_OFFLINE='1', PYTHONUNBUFFERED='1')
+    config = os.path.join(ROOT, 'gunicorn.conf.py')
+    if args.jieba and not preload:
+        path = os.path.join(state_dir, 'gunicorn_jieba.conf.py')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(JIEBA_CONFIG.format(config=config))
+        config = path
+    command = [sys.executable, '-m', 'gunicorn', '-c', config,
+               '--pythonpath', ROOT, '-w', str(args.workers), '-b', f'127.0.0.1:{port}', 'app:app']
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=state_dir, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        base = f'http://127.0.0.1:{port}'
+        _wait_ready(base + '/metrics', process, args.timeout)
+        _wait_loaded(process.pid, args.workers, args.timeout)
+        ready = time.perf_counter() - started
+
+        messages = corpus.messages(args.requests, args.seed)
+        with ThreadPoolExecutor(args.workers * 2) as pool:
+            list(pool.map(lambda item: _post(base + '/api/bot', item[1], f'bench-{item[0] % 50}'),
+                          enumerate(messages)))
+        time.sleep(args.settle)
+
+        workers = [_memory(pid) for pid in _children(process.pid)]
+        master = _memory(process.pid)
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    def mean(key):
+        return sum(w[key] for w in workers) / len(workers)
+
+    return {
+        'preload': preload,
+        'ready_s': ready,
+        'master': master,
+        'workers': workers,
+        'worker_rss_mb': mean('rss_mb'),
+        'worker_pss_mb': mean('pss_mb'),
+        'worker_uss_mb': mean('uss_mb'),
+        'total_pss_mb': master['pss_mb'] + sum(w['pss_mb'] for w in workers),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='gunicorn 预加载的内存对比')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--memories', type=int, default=20000, help='长期记忆条数')
+    parser.add_argument('--qa-pairs', type=int, default=20000, help='教学问答条数')
+    parser.add_argument('--requests', type=int, default=200, help='测量前发送的请求数')
+    parser.add_argument('--settle', type=float, default=1.0, help='请求结束后等待多少秒再测量')
+    parser.add_argument('--no-jieba', dest='jieba', action='store_false',
+                        help='不预加载时 worker 不加载 jieba 词典')
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='把结果保存为 JSON')
+    args = parser.parse_args()
+
+    if not os.path.exists('/proc/self/smaps_rollup'):
+        sys.exit('需要 Linux 的 /proc/<pid>/smaps_rollup')
+
+    with tempfile.TemporaryDirectory() as state_dir:
+        _write_state(state_dir, args.memories, args.qa_pairs, args.seed)
+        results = [run_mode(preload, state_dir, args) for preload in (False, True)]
+
+    print(f'{args.workers} 个 worker，{args.memories} 条长期记忆，{args.qa_pairs} 条教学问答')
+    print(f'{"模式":<8}{"启动(s)":>9}{"RSS/worker":>12}{"PSS/worker":>12}{"USS/worker":>12}{"总 PSS":>10}')
+    for result in results:
+        print(f'{"预加载" if result["preload"] else "各自加载":<8}{result["ready_s"]:>9.2f}'
+              f'{result["worker_rss_mb"]:>10.1f}MB{result["worker_pss_mb"]:>10.1f}MB'
+              f'{result["worker_uss_mb"]:>10.1f}MB{result["total_pss_mb"]:>8.1f}MB')
+    before, after = results
+    print(f'每个 worker 独占内存减少 {1 - after["worker_uss_mb"] / before["worker_uss_mb"]:.0%}，'
+          f'总 PSS 减少 {1 - after["total_pss_mb"] / before["total_pss_mb"]:.0%}')
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'config': vars(args), 'results': results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""合成中文语料：用于基准测试、长时间运行测试和爬虫测试站点
+
+所有生成函数都接收 random.Random 或种子，同样的种子总是生成同样的语料。
+消息中的词用空格分隔，这样记忆召回、概念关联和连贯性统计都能命中。
+"""
+import datetime
+import random
+from typing import Dict, List, Union
+
+TOPICS = ['机器学习', '深度学习', '自然语言', '计算机', '天气', '旅行', '音乐', '电影', '历史', '数学',
+          '物理', '化学', '生物', '经济', '金融', '健康', '运动', '美食', '编程', '数据库',
+          '网络', '安全', '算法', '设计', '教育', '工作', '家庭', '朋友', '城市', '自然']
+NOUNS = ['问题', '方法', '模型', '数据', '系统', '结构', '过程', '结果', '原因', '计划',
+         '目标', '经验', '知识', '工具', '环境', '时间', '项目', '任务', '能力', '想法']
+VERBS = ['学习', '研究', '分析', '讨论', '理解', '设计', '实现', '改进', '测试', '比较',
+         '总结', '整理', '准备', '尝试', '完成']
+EMOTIONS = ['开心', '难过', '生气', '害怕', '惊讶', '平静']
+IMPORTANT = ['重要', '必须', '记住', '关键', '核心']
+FACTORS = ['安全', '保护', '稳妥', '可靠', '风险', '危险', '诚实', '公平', '合法', '高效', '快速', '创新']
+FILLERS = ['我觉得', '今天', '其实', '最近', '也许', '我们', '这个', '那个', '非常', '一点']
+OPENERS = ['你好', '帮助', '你的心情', '你是谁']
+
+Rng = Union[random.Random, int, None]
+
+
+def _rng(rng: Rng) -> random.Random:
+    return rng if isinstance(rng, random.Random) else random.Random(rng)
+
+
+def words(rng: Rng, count: int) -> List[str]:
+    """随机抽取 count 个词"""
+    rng = _rng(rng)
+    pool = (TOPICS, NOUNS, VERBS, FILLERS)
+    return [rng.choice(rng.choice(pool)) for _ in range(count)]
+
+
+def sentence(rng: Rng, min_words: int = 4, max_words: int = 12) -> str:
+    """一句用空格分隔的陈述"""
+    rng = _rng(rng)
+    return ' '.join(words(rng, rng.randint(min_words, max_words)))
+
+
+def paragraph(rng: Rng, sentences: int = 5, spaced: bool = False) -> str:
+    """一段正文（网页风格，默认不带空格、用句号分隔）"""
+    rng = _rng(rng)
+    sep = ' ' if spaced else ''
+    return '。'.join(sep.join(words(rng, rng.randint(6, 16))) for _ in range(sentences)) + '。'
+
+
+def message(rng: Rng) -> str:
+    """一条用户消息，覆盖问候、情感、重要信息、提问、决策和普通闲聊"""
+    rng = _rng(rng)
+    kind = rng.random()
+    if kind < 0.1:
+        return rng.choice(OPENERS)
+    if kind < 0.3:
+        return f'{rng.choice(FILLERS)} {rng.choice(TOPICS)} 让我 很 {rng.choice(EMOTIONS)}'
+    if kind < 0.45:
+        # 两个关键词使重要性超过长期记忆的阈值（0.6）
+        first, second = rng.sample(IMPORTANT, 2)
+        return f'{first} {sentence(rng, 3, 8)} {second}'
+    if kind < 0.6:
+        return f'{sentence(rng, 3, 8)} 吗?'
+    if kind < 0.7:
+        a, b = rng.sample(VERBS, 2)
+        return f'应该 先{a} {rng.choice(FACTORS)} 还是 先{b} {rng.choice(FACTORS)}?'
+    if kind < 0.75:
+        return f'如果 {sentence(rng, 2, 4)} 那么 {sentence(rng, 2, 4)} 吗?'
+    return sentence(rng)
+
+
+def messages(count: int, seed: Rng = 0) -> List[str]:
+    """生成 count 条消息"""
+    rng = _rng(seed)
+    return [message(rng) for _ in range(count)]
+
+
+def qa_pairs(count: int, seed: Rng = 0) -> Dict[str, str]:
+    """生成 count 个不重复的教学问答（问题 -> 答案）"""
+    rng = _rng(seed)
+    pairs = {}
+    while len(pairs) < count:
+        question = ''.join(words(rng, rng.randint(4, 8))) + rng.choice(['', '吗', '?'])
+        pairs[question] = sentence(rng, 3, 6)
+    return pairs
+
+
+def paraphrase(rng: Rng, question: str) -> str:
+    """对问题做一处小改动（删字、换字、加语气词或标点），模拟换个说法的提问"""
+    rng = _rng(rng)
+    kind = rng.random()
+    i = rng.randrange(len(question))
+    if kind < 0.3:
+        return question[:i] + question[i + 1:]
+    if kind < 0.6:
+        return question[:i] + rng.choice('的了是在有') + question[i + 1:]
+    if kind < 0.8:
+        return question + rng.choice(['呢', '啊？', '吗'])
+    return '请问' + question
+
+
+def memories(count: int, seed: Rng = 0) -> List[Dict[str, object]]:
+    """生成 count 条长期记忆记录（与 Memory.add_memory 的格式一致）"""
+    rng = _rng(seed)
+    start = datetime.datetime(2024, 1, 1)
+    return [
+        {
+            'content': f'{rng.choice(IMPORTANT)} {sentence(rng, 3, 10)}',
+            'timestamp': (start + datetime.timedelta(minutes=i)).isoformat(),
+            'category': None,
+            'importance': round(rng.uniform(0.61, 1.0), 2)
+        }
+        for i in range(count)
+    ]
+
+
+def options(count: int, seed: Rng = 0) -> List[str]:
+    """生成 count 个决策选项"""
+    rng = _rng(seed)
+    return [f'{rng.choice(VERBS)} {rng.choice(TOPICS)} {rng.choice(FACTORS)} 方案{i}' for i in range(count)]
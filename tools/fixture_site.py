@@ -0,0 +1,353 @@
+"""本地测试站点：按种子生成一个中文网页链接图，用于离线测试和评测爬虫
+
+    site = FixtureSite(pages=500, fanout=8, latency=0.02, error_rate=0.05)
+    with site:
+        learner.start_learning('机器学习', seed_urls=[site.search_url('机器学习')])
+
+也可以单独运行：python tools/fixture_site.py --port 8800
+
+页面：
+    /search?q=...   搜索结果页，链接到前 serp_results 个页面
+    /serp/<引擎>?q=  仿百度、搜狗、必应结构的结果页（含广告、导航、相关搜索和翻页链接）
+    /link?url=...   跳转到 url（仿搜索引擎的跳转链接）
+    /page/<i>       正文页，正文大小约为 page_size 字节，包含 fanout 个站内链接
+    /mirror/<i>     与 /page/<i> 内容完全相同的镜像页（用于测试内容去重）
+    /download/<i>   二进制文件（application/octet-stream）
+
+部分链接指向镜像页或带 ?from= 参数的同一页面；可以注入延迟和 500 错误。
+"""
+import argparse
+import hashlib
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qs, quote, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import corpus  # noqa: E402
+
+
+class FixtureSite:
+    """生成的测试站点和它的 HTTP 服务"""
+    def __init__(self, pages: int = 500, fanout: int = 8, page_size: int = 4096, topic: str = '机器学习',
+                 latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 mirror_rate: float = 0.1, irrelevant_rate: float = 0.2, binary_rate: float = 0.0,
+                 binary_size: int = 1 << 20, serp_results: int = 10, seed: int = 0):
+        self.pages = pages
+        self.fanout = fanout
+        self.page_size = page_size
+        self.topic = topic
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.mirror_rate = mirror_rate
+        self.irrelevant_rate = irrelevant_rate
+        self.binary_rate = binary_rate
+        self.binary_size = binary_size
+        self.serp_results = serp_results
+        self.seed = seed
+
+        self._links = self._build_graph()
+        self._cache = {}
+        self._serp_cache = {}
+        self._server = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._error_rng = random.Random(seed + 1)
+        self.reset_stats()
+
+    # ------------------------------------------------------------ 站点内容
+
+    def _build_graph(self):
+        """为每个页面生成出链路径列表"""
+        rng = random.Random(self.seed)
+        links = []
+        for i in range(self.pages):
+            targets = []
+            for _ in range(self.fanout):
+                j = rng.randrange(self.pages)
+                roll = rng.random()
+                if roll < self.binary_rate:
+                    targets.append(f'/download/{j}')
+                elif roll < self.binary_rate + self.mirror_rate / 2:
+                    targets.append(f'/mirror/{j}')
+                elif roll < self.binary_rate + self.mirror_rate:
+                    targets.append(f'/page/{j}?from={i}')
+                else:
+                    targets.append(f'/page/{j}')
+            links.append(targets)
+        return links
+
+    def _page_html(self, i: int) -> bytes:
+        cached = self._cache.get(i)
+        if cached is not None:
+            return cached
+        rng = random.Random(self.seed * 1000003 + i)
+        relevant = rng.random() >= self.irrelevant_rate
+        title = f'{self.topic} 第{i}篇' if relevant else f'随笔 第{i}篇'
+        paragraphs = []
+        size = 0
+        while size < self.page_size:
+            text = corpus.paragraph(rng, sentences=rng.randint(3, 6))
+            if relevant:
+                text = f'{self.topic}{text}'
+            paragraphs.append(f'<p>{escape(text)}</p>')
+            size += len(text.encode('utf-8'))
+        links = ''.join(f'<li><a href="{escape(path)}">相关文章 {n}</a></li>'
+                        for n, path in enumerate(self._links[i]))
+        html = (
+            '<!DOCTYPE html><html><head><meta charset="utf-8">'
+            f'<title>{escape(title)}</title><style>body{{margin:0}}</style></head><body>'
+            '<header><nav><a href="/">首页</a></nav></header>'
+            f'<article><h1>{escape(title)}</h1>{"".join(paragraphs)}</article>'
+            f'<section class="related"><ul>{links}</ul></section>'
+            '<footer>测试站点</footer><script>var x = 1;</script></body></html>'
+        ).encode('utf-8')
+        with self._lock:
+            self._cache[i] = html
+        return html
+
+    def _search_html(self, query: str) -> bytes:
+        results = ''.join(
+            f'<div class="result"><h3><a href="/page/{i}">{escape(query)} 第{i}篇</a></h3>'
+            f'<p>{escape(query)} 的搜索结果摘要</p></div>'
+            for i in range(min(self.serp_results, self.pages))
+        )
+        return (f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{escape(query)} - 搜索</title>'
+                f'</head><body>{results}</body></html>').encode('utf-8')
+
+    def _is_topic_page(self, i: int) -> bool:
+        """与 _page_html 使用相同的随机序列判断页面是否与主题相关"""
+        return random.Random(self.seed * 1000003 + i).random() >= self.irrelevant_rate
+
+    def _snippet(self, i: int) -> str:
+        text = corpus.paragraph(random.Random(i), sentences=2)[:60]
+        return f'{self.topic}{text}' if self._is_topic_page(i) else text
+
+    def _engine_html(self, engine: str, query: str) -> bytes:
+        """仿搜索引擎结构的结果页：自然结果以相关页面为主、混有少量无关页面，
+        另有指向无关页面的广告和导航，以及相关搜索和翻页链接"""
+        cached = self._serp_cache.get((engine, query))
+        if cached is not None:
+            return cached
+        topic_pages = [i for i in range(self.pages) if self._is_topic_page(i)][:self.serp_results * 2]
+        other_pages = [i for i in range(self.pages) if not self._is_topic_page(i)][:self.serp_results]
+        rng = random.Random(f'{self.seed}:{engine}')
+        organic = rng.sample(topic_pages, min(len(topic_pages), self.serp_results * 4 // 5))
+        organic += rng.sample(other_pages, min(len(other_pages), self.serp_results - len(organic)))
+        rng.shuffle(organic)
+        chrome = rng.sample(other_pages, min(len(other_pages), 4))
+        q = escape(query)
+
+        def title(i):
+            return escape(f'{self.topic} 第{i}篇' if self._is_topic_page(i) else f'随笔 第{i}篇')
+
+        def link(i):
+            return escape(f'/link?url={quote(f"/page/{i}")}')
+
+        if engine == 'baidu':
+            ads = ''.join(f'<div class="result c-container" data-tuiguang="1"><h3 class="t"><a href="/page/{i}">'
+                          f'{q} 推广</a></h3><div class="c-abstract">广告</div></div>' for i in chrome[:2])
+            items = ''.join(f'<div class="result c-container" mu="{escape(self.url(f"/page/{i}"))}">'
+                            f'<h3 class="t"><a href="{link(i)}">{title(i)}</a></h3>'
+                            f'<div class="c-abstract">{escape(self._snippet(i))}</div></div>' for i in organic)
+            body = f'<div id="content_left">{ads}{items}</div>'
+        elif engine == 'sogou':
+            ads = ''.join(f'<div class="vrwrap biz_sponsor"><h3><a href="/page/{i}">{q} 推广</a></h3></div>'
+                          for i in chrome[:2])
+            items = ''.join(f'<div class="vrwrap"><h3 class="vr-title"><a href="{link(i)}">{title(i)}</a></h3>'
+                            f'<div class="space-txt">{escape(self._snippet(i))}</div>'
+                            f'<div class="r-sech" data-url="{escape(self.url(f"/page/{i}"))}"></div></div>'
+                            for i in organic)
+            body = f'<div class="results">{ads}{items}</div>'
+        else:
+            ads = ''.join(f'<li class="b_ad"><h2><a href="/page/{i}">{q} 广告</a></h2></li>' for i in chrome[:2])
+            items = ''.join(f'<li class="b_algo"><h2><a href="{escape(self.url(f"/page/{i}"))}">{title(i)}</a></h2>'
+                            f'<div class="b_caption"><p>{escape(self._snippet(i))}</p></div></li>'
+                            for i in organic)
+            body = f'<ol id="b_results">{ads}{items}</ol>'
+        nav = ''.join(f'<a href="/page/{i}">频道 {n}</a>' for n, i in enumerate(chrome[2:]))
+        related = ''.join(f'<a href="/serp/{engine}?q={quote(query + word)}">{q}{word}</a>'
+                          for word in ('教程', '入门', '是什么', '应用'))
+        pager = ''.join(f'<a href="/serp/{engine}?q={quote(query)}&amp;pn={n}">{n}</a>' for n in range(2, 6))
+        html = (f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{q} - {engine}</title></head><body>'
+                f'<div id="head"><nav>{nav}</nav></div>{body}'
+                f'<div id="rs">相关搜索 {related}</div><div id="page">{pager}</div></body></html>').encode('utf-8')
+        with self._lock:
+            self._serp_cache[(engine, query)] = html
+        return html
+
+    def _binary(self, i: int) -> bytes:
+        block = hashlib.sha256(str(i).encode()).digest()
+        return block * (self.binary_size // len(block))
+
+    def resolve(self, path: str, query: Dict[str, list]):
+        """返回 (状态码, Content-Type, 内容, 规范页面编号)"""
+        parts = path.strip('/').split('/')
+        if parts == ['search'] or parts == ['']:
+            q = query.get('q', [self.topic])[0]
+            return 200, 'text/html; charset=utf-8', self._search_html(q), None
+        if len(parts) == 2 and parts[0] == 'serp' and parts[1] in ('baidu', 'sogou', 'bing'):
+            q = query.get('q', [self.topic])[0]
+            return 200, 'text/html; charset=utf-8', self._engine_html(parts[1], q), None
+        if parts == ['link'] and query.get('url'):
+            return 302, 'text/plain; charset=utf-8', query['url'][0].encode('utf-8'), None
+        if len(parts) == 2 and parts[1].isdigit() and int(parts[1]) < self.pages:
+            i = int(parts[1])
+            if parts[0] in ('page', 'mirror'):
+                return 200, 'text/html; charset=utf-8', self._page_html(i), i
+            if parts[0] == 'download':
+                return 200, 'application/octet-stream', self._binary(i), None
+        return 404, 'text/plain; charset=utf-8', b'not found', None
+
+    # ------------------------------------------------------------ 统计
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._stats = {'requests': 0, 'bytes_sent': 0, 'errors_injected': 0, 'not_found': 0,
+                           'serp_fetches': 0, 'topic_fetches': 0}
+            self._page_fetches = Counter()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """服务端统计：请求数、发送字节数、结果页请求数、与主题相关的正文页请求数，
+        以及正文页被重复抓取（镜像或参数变体）的次数"""
+        with self._lock:
+            page_fetches = sum(self._page_fetches.values())
+            unique_pages = len(self._page_fetches)
+            return dict(self._stats, page_fetches=page_fetches, unique_pages=unique_pages,
+                        duplicate_fetches=page_fetches - unique_pages)
+
+    def _record(self, size: int, canonical: Optional[int], status: int, path: str = '') -> None:
+        topic = canonical is not None and self._is_topic_page(canonical)
+        with self._lock:
+            self._stats['requests'] += 1
+            self._stats['bytes_sent'] += size
+            if status == 404:
+                self._stats['not_found'] += 1
+            if path.startswith(('/search', '/serp/')):
+                self._stats['serp_fetches'] += 1
+            if canonical is not None:
+                self._page_fetches[canonical] += 1
+                self._stats['topic_fetches'] += topic
+
+    def _inject(self) -> bool:
+        """注入延迟；返回 True 表示这次请求应当返回 500"""
+        with self._lock:
+            delay = self.latency + (self._error_rng.uniform(0, self.jitter) if self.jitter else 0.0)
+            fail = self._error_rng.random() < self.error_rate
+            if fail:
+                self._stats['errors_injected'] += 1
+        if delay > 0:
+            time.sleep(delay)
+        return fail
+
+    # ------------------------------------------------------------ HTTP 服务
+
+    def _handler(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def handle(self):
+                try:
+                    super().handle()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # 客户端读到大小上限或发现是二进制内容后断开
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                if site._inject():
+                    status, content_type, body, canonical = 500, 'text/plain; charset=utf-8', b'error', None
+                else:
+                    status, content_type, body, canonical = site.resolve(parsed.path, parse_qs(parsed.query))
+                self.send_response(status)
+                if status == 302:
+                    self.send_header('Location', body.decode('utf-8'))
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                site._record(len(body), canonical, status, parsed.path)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """在后台线程中启动服务，返回站点地址"""
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fixture-site', daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def url(self, path: str) -> str:
+        return self.base_url + path
+
+    def search_url(self, query: str = None) -> str:
+        return self.url(f'/search?q={quote(query or self.topic)}')
+
+    def search_engines(self) -> Dict[str, str]:
+        """仿搜索引擎结果页的网址模板，可直接赋给 WebLearner.search_engines"""
+        return {engine: self.url(f'/serp/{engine}?q={{query}}') for engine in ('baidu', 'sogou', 'bing')}
+
+    def __enter__(self):
+        if self._server is None:
+            self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地爬虫测试站点')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--pages', type=int, default=500)
+    parser.add_argument('--fanout', type=int, default=8)
+    parser.add_argument('--page-size', type=int, default=4096)
+    parser.add_argument('--topic', default='机器学习')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--mirror-rate', type=float, default=0.1)
+    parser.add_argument('--binary-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    site = FixtureSite(pages=args.pages, fanout=args.fanout, page_size=args.page_size, topic=args.topic,
+                       latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                       mirror_rate=args.mirror_rate, binary_rate=args.binary_rate, seed=args.seed)
+    site.start(args.host, args.port)
+    print(f'测试站点已启动：{site.search_url()}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        site.stop()
+
+
+if __name__ == '__main__':
+    main()
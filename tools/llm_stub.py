@@ -0,0 +1,231 @@
+"""本地大模型模拟服务：实现 OpenAI 的 POST /v1/chat/completions，用于离线测试 llm_gateway
+
+    stub = LLMStub(latency=0.05, error_rate=0.1)
+    with stub:
+        gateway = LLMGateway(api_key='test', base_url=stub.base_url)
+
+也可以单独运行：python tools/llm_stub.py --port 8801 --latency 0.2
+然后设置 OPENAI_BASE_URL=http://127.0.0.1:8801/v1 OPENAI_API_KEY=test 启动机器人。
+
+回复内容是最后一条用户消息的前若干个字；可以注入延迟、500 错误和 429 限流，
+统计请求数、各状态码次数和最大并发数。请求中 stream 为 true 时以 Server-Sent Events
+每次返回 stream_chars 个字，片段之间间隔 stream_delay 秒。设置 retry_after 时 429 响应带上 Retry-After 头，
+rate_limit_first 为前若干个请求固定返回 429。
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict
+
+
+class LLMStub:
+    """模拟的 OpenAI 对话接口和它的 HTTP 服务"""
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, reply_chars: int = 60, stream_chars: int = 8,
+                 stream_delay: float = 0.0, retry_after: float = None, rate_limit_first: int = 0,
+                 seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.reply_chars = reply_chars
+        self.stream_chars = stream_chars
+        self.stream_delay = stream_delay
+        self.retry_after = retry_after
+        self.rate_limit_first = rate_limit_first
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self.reset_stats()
+
+    # ------------------------------------------------------------ 统计
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._stats = {'requests': 0, 'max_concurrency': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+            self._status = Counter()
+            self._active = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, status=dict(self._status))
+
+    # ------------------------------------------------------------ 请求处理
+
+    def _begin(self):
+        """记录并发数，决定这次请求的延迟和状态码"""
+        with self._lock:
+            self._stats['requests'] += 1
+            self._active += 1
+            self._stats['max_concurrency'] = max(self._stats['max_concurrency'], self._active)
+            delay = self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0.0)
+            roll = self._rng.random()
+            limited = self._stats['requests'] <= self.rate_limit_first
+        if limited:
+            status = 429
+        elif roll < self.error_rate:
+            status = 500
+        elif roll < self.error_rate + self.rate_limit_rate:
+            status = 429
+        else:
+            status = 200
+        return delay, status
+
+    def _end(self, status: int, usage: Dict[str, int] = None) -> None:
+        with self._lock:
+            self._active -= 1
+            self._status[status] += 1
+            if usage:
+                self._stats['prompt_tokens'] += usage['prompt_tokens']
+                self._stats['completion_tokens'] += usage['completion_tokens']
+
+    def completion(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """按 OpenAI 的格式生成回复"""
+        messages = request.get('messages') or []
+        prompt = ''.join(str(m.get('content', '')) for m in messages)
+        last = next((m.get('content', '') for m in reversed(messages) if m.get('role') == 'user'), '')
+        content = f'摘要：{str(last).strip()[:self.reply_chars]}'
+        usage = {'prompt_tokens': len(prompt), 'completion_tokens': len(content)}
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+        return {
+            'id': f'chatcmpl-stub-{self._stats["requests"]}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'stub'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content},
+                         'finish_reason': 'stop'}],
+            'usage': usage,
+        }
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # 响应头和正文分两次写出，不关闭 Nagle 算法时每个请求会多等一个延迟确认（约 40ms）
+            disable_nagle_algorithm = True
+
+            def _send(self, status: int, payload: Dict[str, Any]):
+                body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                if status == 429 and stub.retry_after is not None:
+                    self.send_header('Retry-After', str(stub.retry_after))
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_stream(self, payload: Dict[str, Any]):
+                # 没有 Content-Length，发送完毕后关闭连接
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                self.close_connection = True
+                content = payload['choices'][0]['message']['content']
+                for start in range(0, len(content), stub.stream_chars):
+                    if start and stub.stream_delay > 0:
+                        time.sleep(stub.stream_delay)
+                    chunk = {'id': payload['id'], 'object': 'chat.completion.chunk', 'created': payload['created'],
+                             'model': payload['model'],
+                             'choices': [{'index': 0, 'delta': {'content': content[start:start + stub.stream_chars]},
+                                          'finish_reason': None}]}
+                    self.wfile.write(f'data: {json.dumps(chunk, ensure_ascii=False)}\n\n'.encode('utf-8'))
+                    self.wfile.flush()
+                self.wfile.write(b'data: [DONE]\n\n')
+                self.wfile.flush()
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length)
+                if self.path.rstrip('/') not in ('/v1/chat/completions', '/chat/completions'):
+                    self._send(404, {'error': {'message': 'not found'}})
+                    return
+                delay, status = stub._begin()
+                usage = None
+                try:
+                    if delay > 0:
+                        time.sleep(delay)
+                    if status != 200:
+                        self._send(status, {'error': {'message': 'injected error', 'type': 'server_error'}})
+                        return
+                    request = json.loads(raw or b'{}')
+                    payload = stub.completion(request)
+                    usage = payload['usage']
+                    if request.get('stream'):
+                        self._send_stream(payload)
+                    else:
+                        self._send(200, payload)
+                except (BrokenPipeError, ConnectionResetError):
+                    status = 499  # 客户端已超时断开
+                finally:
+                    stub._end(status, usage)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """在后台线程中启动服务，返回 base_url（以 /v1 结尾）"""
+        # 默认的监听队列只有 5，大量并发连接时多余的连接要等 1 秒重发 SYN
+        server_class = type('StubServer', (ThreadingHTTPServer,), {'request_queue_size': 128})
+        self._server = server_class((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='llm-stub', daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def __enter__(self):
+        if self._server is None:
+            self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地大模型模拟服务（OpenAI 对话接口）')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8801)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    parser.add_argument('--reply-chars', type=int, default=60)
+    parser.add_argument('--stream-delay', type=float, default=0.0, help='流式回复的片段间隔秒数')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    stub = LLMStub(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                   rate_limit_rate=args.rate_limit_rate, reply_chars=args.reply_chars,
+                   stream_delay=args.stream_delay, seed=args.seed)
+    stub.start(args.host, args.port)
+    print(f'模拟服务已启动：OPENAI_BASE_URL={stub.base_url}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == '__main__':
+    main()
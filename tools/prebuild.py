@@ -0,0 +1,48 @@
+"""部署前的预构建：生成 jieba 词典缓存和（可选的）预热快照
+
+用法：
+    python tools/prebuild.py
+    python tools/prebuild.py --snapshot .cache/bot_snapshot.pickle
+
+jieba 缓存默认写入 .cache/jieba.pickle（或 BOT_JIEBA_CACHE 指定的路径），第一次分词时自动使用。
+预热快照从当前目录的状态文件生成，运行时设置 BOT_SNAPSHOT 指向它；状态文件改动后快照自动失效。
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成 jieba 词典缓存和预热快照')
+    parser.add_argument('--jieba-cache', help='jieba 缓存路径（默认 BOT_JIEBA_CACHE 或 .cache/jieba.pickle）')
+    parser.add_argument('--snapshot', help='生成预热快照的路径（不指定则不生成）')
+    args = parser.parse_args()
+
+    import tokenizer
+    started = time.perf_counter()
+    with contextlib.redirect_stderr(io.StringIO()):
+        path = tokenizer.build_jieba_cache(args.jieba_cache)
+    print(f'jieba 词典缓存：{path}（{os.path.getsize(path) / 2**20:.1f} MB，{time.perf_counter() - started:.2f}s）')
+
+    if args.snapshot:
+        os.environ['BOT_SELF_IMPROVE'] = '0'
+        os.environ.pop('BOT_SNAPSHOT', None)
+        from simple_bot import SimpleBot
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            bot = SimpleBot('小助手')
+            bot._owns_state = False  # 只读取状态文件，退出时不回写
+        os.makedirs(os.path.dirname(os.path.abspath(args.snapshot)), exist_ok=True)
+        bot.save_snapshot(args.snapshot)
+        print(f'预热快照：{args.snapshot}（{os.path.getsize(args.snapshot) / 1024:.1f} KB，'
+              f'{time.perf_counter() - started:.2f}s）')
+
+
+if __name__ == '__main__':
+    main()
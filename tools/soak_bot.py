@@ -0,0 +1,262 @@
+"""长时间运行测试：大量合成消息持续调用 SimpleBot.respond，检查内存是否随消息数增长
+
+用法：
+    python tools/soak_bot.py --messages 1000000 --sessions 64
+    python tools/soak_bot.py --messages 50000 --budget long_term=0.2 --budget rss=1024 -o soak.json
+
+每隔 --interval 条消息采样一次进程 RSS、tracemalloc 按模块统计的内存，以及各数据结构的条目数。
+预热阶段（前 --warmup 比例的消息）之后，用最小二乘法计算每条消息带来的增长，超出预算时以非零状态退出。
+
+预算单位：rss、traced 以及 "模块名.py" 为 字节/条消息，其余为 条目/条消息。
+有固定容量的结构（对话历史、反思日志、情感记忆、短期记忆、会话和各缓存）只检查是否超过容量。
+运行时不联网（BOT_OFFLINE=1），状态文件写入临时目录。
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('BOT_OFFLINE', '1')
+
+import corpus  # noqa: E402
+
+# 默认预算：按键分组的日志和改进日志在预热后应基本不再增长（每千条消息最多 1 条）；
+# 长期记忆和概念关联按设计会随重要消息增长
+BOUNDED = 0.001
+DEFAULT_BUDGETS = {
+    'rss': 2048,
+    'traced': 1024,
+    'learning_points': BOUNDED,
+    'improvement_suggestions': BOUNDED,
+    'performance_logs': BOUNDED,
+    'improvement_log': BOUNDED,
+    'long_term': 0.5,
+    'associations': 0.5,
+}
+
+
+def rss_bytes() -> int:
+    """当前进程的常驻内存"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        # 没有 /proc 时退化为峰值 RSS（Linux 单位为 KB，macOS 为字节）
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def structure_sizes(bot, sessions) -> Dict[str, int]:
+    """各数据结构的条目数（会话级结构为所有活跃会话之和）"""
+    from tokenizer import word_set
+    active = [entry[0] for entry in list(sessions._sessions.values())] + [bot]
+    store = bot.cognitive.memory.store
+    sizes = {
+        'sessions': len(sessions),
+        'chat_history': sum(len(s.chat_history) for s in active),
+        'reflection_log': sum(len(s.self_reflection.reflection_log) for s in active),
+        'learning_points': sum(
+            sum(len(log) for log in s.self_reflection.learning_points._logs.values()) for s in active),
+        'improvement_suggestions': sum(
+            sum(len(log) for log in s.self_reflection.improvement_suggestions._logs.values()) for s in active),
+        'emotional_memory': sum(len(s.emotional.emotional_memory) for s in active),
+        'short_term': sum(len(s.cognitive.memory.short_term) for s in active),
+        'long_term': sum(len(v) for v in store.memories.values()),
+        'associations': sum(len(v) for v in store.associations.values()),
+        'recall_cache': len(store.view[1]),
+        'word_set_cache': word_set.cache_info().currsize,
+        'performance_logs': len(bot.self_improvement.analyzer.performance_logs),
+        'improvement_log': len(bot.self_improvement.improvement_log),
+    }
+    return sizes
+
+
+def structure_limits(bot, sessions) -> Dict[str, int]:
+    """有固定容量的结构：只要不超过容量就算合格（填满之前会一直增长）"""
+    from tokenizer import word_set
+    instances = sessions.max_sessions + 1  # 会话加上主实例
+    return {
+        'sessions': sessions.max_sessions,
+        'chat_history': instances * bot.max_chat_history,
+        'reflection_log': instances * bot.self_reflection.reflection_log.capacity,
+        'emotional_memory': instances * bot.emotional.max_memory,
+        'short_term': instances * (bot.cognitive.memory.max_short_term + 1),
+        'recall_cache': bot.cognitive.memory.store.max_recall_cache,
+        'word_set_cache': word_set.cache_info().maxsize,
+    }
+
+
+def traced_by_module(snapshot) -> Dict[str, int]:
+    """tracemalloc 按分配所在的仓库模块统计内存（字节）"""
+    sizes = {'traced': 0}
+    for stat in snapshot.statistics('filename'):
+        sizes['traced'] += stat.size
+        filename = stat.traceback[0].filename
+        if filename.startswith(ROOT):
+            name = os.path.basename(filename)
+            sizes[name] = sizes.get(name, 0) + stat.size
+    return sizes
+
+
+def slope(points: List[tuple]) -> float:
+    """最小二乘斜率"""
+    n = len(points)
+    if n < 2:
+        return 0.0
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    var = sum((x - mean_x) ** 2 for x, _ in points)
+    if not var:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / var
+
+
+def run(messages: int, sessions_count: int, max_sessions: int, interval: int, warmup: float,
+        budgets: Dict[str, float], use_tracemalloc: bool, seed: int) -> Dict[str, Any]:
+    from simple_bot import SimpleBot
+    from session_store import SessionStore
+    logging.disable(logging.WARNING)
+
+    if use_tracemalloc:
+        tracemalloc.start()
+    rng = random.Random(seed)
+    with contextlib.redirect_stdout(io.StringIO()):
+        bot = SimpleBot('长时间运行测试')
+    # max_sessions 小于会话数时会持续触发会话的创建和淘汰
+    sessions = SessionStore(bot.new_session, max_sessions=max_sessions or sessions_count)
+    session_ids = [f'soak-session-{i:05d}' for i in range(sessions_count)]
+
+    samples = []
+
+    def sample(sent: int, elapsed: float):
+        point = {'messages': sent, 'elapsed': elapsed, 'rss': rss_bytes()}
+        point.update(structure_sizes(bot, sessions))
+        if use_tracemalloc:
+            point.update(traced_by_module(tracemalloc.take_snapshot()))
+        samples.append(point)
+        rate = sent / elapsed if elapsed else 0.0
+        print(f'{sent:>10} 条  {elapsed:8.1f}s  {rate:7.0f} 条/秒  RSS {point["rss"] / 2**20:8.1f} MB  '
+              f'长期记忆 {point["long_term"]:>8}  关联 {point["associations"]:>10}', flush=True)
+
+    # 预先生成一批消息循环使用，避免生成语料本身的开销和内存计入测试
+    pool = corpus.messages(min(messages, 50000), seed=seed)
+    started = time.perf_counter()
+    sample(0, 0.0)
+    sink = io.StringIO()
+    for sent in range(1, messages + 1):
+        with contextlib.redirect_stdout(sink):
+            sessions.get(rng.choice(session_ids)).respond(pool[sent % len(pool)])
+        if sink.tell() > 1 << 20:
+            sink.seek(0)
+            sink.truncate()
+        if sent % interval == 0 or sent == messages:
+            sample(sent, time.perf_counter() - started)
+
+    if use_tracemalloc:
+        tracemalloc.stop()
+    limits = structure_limits(bot, sessions)
+    return {'samples': samples, 'report': growth_report(samples, messages, warmup, budgets, limits)}
+
+
+def growth_report(samples: List[Dict[str, Any]], messages: int, warmup: float,
+                  budgets: Dict[str, float], limits: Dict[str, int] = None) -> List[Dict[str, Any]]:
+    """计算预热之后各指标每条消息的增长，并与预算（或固定容量）比较"""
+    limits = limits or {}
+    steady = [s for s in samples if s['messages'] >= messages * warmup] or samples[-2:]
+    keys = [k for k in samples[-1] if k not in ('messages', 'elapsed')]
+    report = []
+    for key in keys:
+        points = [(s['messages'], s.get(key, 0)) for s in steady]
+        growth = slope(points)
+        budget = budgets.get(key)
+        limit = limits.get(key)
+        end = samples[-1].get(key, 0)
+        if limit is not None:
+            ok = end <= limit
+        else:
+            ok = budget is None or growth <= budget
+        report.append({
+            'component': key,
+            'start': samples[0].get(key, 0),
+            'end': end,
+            'growth_per_message': growth,
+            'budget': budget,
+            'limit': limit,
+            'ok': ok,
+        })
+    return report
+
+
+def print_report(report: List[Dict[str, Any]]) -> int:
+    print(f'\n{"组件":<28}{"开始":>14}{"结束":>14}{"每条消息增长":>16}{"预算":>10}')
+    failures = 0
+    for row in sorted(report, key=lambda r: (r['ok'], r['component'])):
+        if row['limit'] is not None:
+            budget = f'<={row["limit"]}'
+        else:
+            budget = '-' if row['budget'] is None else f'{row["budget"]:g}'
+        status = '' if row['ok'] else '  超出预算'
+        print(f'{row["component"]:<30}{row["start"]:>14}{row["end"]:>14}'
+              f'{row["growth_per_message"]:>16.3f}{budget:>10}{status}')
+        failures += not row['ok']
+    return failures
+
+
+def parse_budget(text: str):
+    name, _, value = text.partition('=')
+    if not name or not value:
+        raise argparse.ArgumentTypeError('格式应为 名称=每条消息的增长上限')
+    return name, float(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SimpleBot 长时间运行内存增长测试')
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--sessions', type=int, default=64)
+    parser.add_argument('--max-sessions', type=int, default=None,
+                        help='内存中保留的最大会话数，小于 --sessions 时测试会话淘汰（默认不淘汰）')
+    parser.add_argument('--interval', type=int, default=None, help='每隔多少条消息采样一次（默认消息数的 1/50）')
+    parser.add_argument('--warmup', type=float, default=0.2, help='预热阶段占总消息数的比例')
+    parser.add_argument('--budget', type=parse_budget, action='append', default=[],
+                        help='增长预算，如 rss=2048 或 long_term=0.2，可重复指定')
+    parser.add_argument('--no-tracemalloc', action='store_true', help='不使用 tracemalloc（更快，但没有按模块统计）')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='把采样数据和增长报告保存为 JSON')
+    args = parser.parse_args()
+
+    budgets = dict(DEFAULT_BUDGETS, **dict(args.budget))
+    interval = args.interval or max(1, args.messages // 50)
+    output = os.path.abspath(args.output) if args.output else None
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)  # 状态文件写入临时目录
+        result = run(args.messages, args.sessions, args.max_sessions, interval, args.warmup, budgets,
+                     not args.no_tracemalloc, args.seed)
+        # 在临时目录删除之前停止后台任务并保存状态
+        from scheduler import SCHEDULER
+        SCHEDULER.shutdown()
+
+    failures = print_report(result['report'])
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if failures:
+        print(f'\n{failures} 项增长超出预算')
+        sys.exit(1)
+    print('\n所有组件的增长都在预算之内')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""并发压力测试：多个线程同时调用 SimpleBot.respond，结束后检查状态不变量
+
+用法：
+    python tools/stress_bot.py --threads 32 --messages 200 --sessions 8
+
+运行时不联网（BOT_OFFLINE=1），状态文件写入临时目录。任何不变量被破坏时以非零状态退出。
+"""
+import argparse
+import contextlib
+import io
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('BOT_OFFLINE', '1')
+
+MESSAGES = [
+    '你好', '帮助', '你的心情', '我今天很开心', '有点难过', '这件事很重要，必须记住',
+    '应该先学习还是先休息?', '如果下雨那么地面会湿吗?', '猫像老虎吗?', '自主学习机器学习',
+    '学习机器学习的进度', '我很生气', '关键 核心 重要 开心', '随便聊聊'
+]
+ERROR_REPLY = '抱歉，出现了一点问题。请稍后再试。'
+
+
+def run(threads: int, messages: int, sessions: int, seed: int) -> int:
+    from simple_bot import SimpleBot
+    from session_store import SessionStore
+    logging.getLogger().setLevel(logging.WARNING)
+
+    rng = random.Random(seed)
+    bot = SimpleBot('压力测试')
+    store = SessionStore(bot.new_session, max_sessions=sessions * 2)
+    session_ids = [f'stress-session-{i:04d}' for i in range(sessions)]
+
+    sent = Counter()              # 会话ID -> 发送的消息数
+    routed = Counter()            # 被意图路由处理的消息数
+    important = Counter()         # 会话ID -> 进入认知系统的重要消息数
+    errors = []
+    sent_lock = threading.Lock()
+    plans = [
+        [(rng.choice(session_ids), rng.choice(MESSAGES)) for _ in range(messages)]
+        for _ in range(threads)
+    ]
+    start_barrier = threading.Barrier(threads)
+
+    def worker(plan):
+        start_barrier.wait()
+        for session_id, message in plan:
+            try:
+                reply = store.get(session_id).respond(message)
+            except Exception as e:  # respond 本身不应该抛出异常
+                errors.append(f'{session_id}: {message!r} 抛出 {e!r}')
+                continue
+            if reply == ERROR_REPLY or not isinstance(reply, str):
+                errors.append(f'{session_id}: {message!r} 返回 {reply!r}')
+            with sent_lock:
+                sent[session_id] += 1
+                if bot.router.match(message) is not None:
+                    routed[message] += 1
+                elif bot.cognitive.memory._evaluate_importance(message) > 0.6:
+                    important[session_id] += 1
+
+    # 缩短线程切换间隔，让竞争条件更容易暴露
+    sys.setswitchinterval(1e-6)
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(plan,)) for plan in plans]
+    with contextlib.redirect_stdout(io.StringIO()):
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+    elapsed = time.perf_counter() - started
+
+    # 检查不变量
+    failures = list(errors[:20])
+    total = threads * messages
+    if sum(sent.values()) + len(errors) < total:
+        failures.append(f'消息丢失：发送 {total} 条，完成 {sum(sent.values())} 条')
+
+    think_calls = 0
+    pending_important = 0
+    for session_id in session_ids:
+        session = store.get(session_id)
+        history = session.chat_history
+        if history.total != sent[session_id]:
+            failures.append(f'{session_id}: chat_history 记录 {history.total} 条，实际发送 {sent[session_id]} 条')
+        if len(session.cognitive.memory.short_term) > session.cognitive.memory.max_short_term:
+            failures.append(f'{session_id}: 短期记忆超出容量')
+        for dim, value in session.emotional.get_emotional_state().items():
+            if not -1 <= value <= 1:
+                failures.append(f'{session_id}: 情感维度 {dim}={value} 越界')
+        if len(session.emotional.emotional_memory) > session.emotional.max_memory:
+            failures.append(f'{session_id}: 情感记忆超出容量')
+        think_calls += session.self_reflection.reflection_log.total
+        pending_important += sum(
+            1 for m in session.cognitive.memory.short_term if m['importance'] > 0.6
+        )
+
+    expected_think = sum(sent.values()) - sum(routed.values())
+    if think_calls != expected_think:
+        failures.append(f'反思次数 {think_calls} 与未路由消息数 {expected_think} 不一致')
+
+    router_hits = sum(stats['hits'] for stats in bot.router.get_stats().values())
+    if router_hits != sum(routed.values()):
+        failures.append(f'路由命中计数 {router_hits} 与实际 {sum(routed.values())} 不一致')
+
+    store_memories = bot.cognitive.memory.store
+    snapshot_count = sum(len(v) for v in store_memories.snapshot.values())
+    memory_count = sum(len(v) for v in store_memories.memories.values())
+    if snapshot_count != memory_count:
+        failures.append(f'长期记忆快照 {snapshot_count} 条与存储 {memory_count} 条不一致')
+    # 每条重要消息要么已经进入长期记忆，要么还在短期记忆中
+    if memory_count + pending_important != sum(important.values()):
+        failures.append(
+            f'长期记忆 {memory_count} 条 + 待整合 {pending_important} 条，'
+            f'与重要消息数 {sum(important.values())} 不一致'
+        )
+    for category, items in store_memories.memories.items():
+        if any(not isinstance(m, dict) or 'content' not in m for m in items):
+            failures.append(f'长期记忆类别 {category} 中有损坏的记录')
+
+    print(f'{total} 条消息，{threads} 个线程，{sessions} 个会话，用时 {elapsed:.2f}s '
+          f'（{total / elapsed:.0f} 条/秒）')
+    print(f'长期记忆 {memory_count} 条，路由命中 {router_hits} 次，反思 {think_calls} 次')
+    if failures:
+        print('不变量检查失败：')
+        for failure in failures:
+            print(f'- {failure}')
+        return 1
+    print('不变量检查通过')
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SimpleBot 并发压力测试')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--messages', type=int, default=200, help='每个线程发送的消息数')
+    parser.add_argument('--sessions', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)  # 状态文件写入临时目录
+        status = run(args.threads, args.messages, args.sessions, args.seed)
+        # 在临时目录删除之前停止后台任务并保存状态
+        from scheduler import SCHEDULER
+        SCHEDULER.shutdown()
+    sys.exit(status)
+
+
+if __name__ == '__main__':
+    main()
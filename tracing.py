@@ -0,0 +1,382 @@
+"""请求追踪和采样分析
+
+追踪：在 start_trace() 范围内，metrics.timed/track 统计的每个阶段都会记录为一个嵌套的 span，
+没有开启追踪时只多一次 ContextVar 读取。
+
+    with start_trace('respond') as trace:
+        bot.respond(message)
+    trace.to_dict()
+
+采样分析：SamplingProfiler 按固定间隔采集所有线程的调用栈，输出 flamegraph.pl /
+speedscope 可以直接读取的折叠栈格式（每行 "帧;帧;帧 次数"）。
+FunctionProfiler 在同样的采样上按机器人模块中的函数汇总墙钟时间、CPU 时间和内存分配，
+供 SelfImprovement 找出真正耗时的函数。
+"""
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+TRACE_HEADER = 'X-Debug-Trace'
+ADMIN_TOKEN_HEADER = 'X-Admin-Token'
+
+_current_span: ContextVar[Optional['Span']] = ContextVar('current_span', default=None)
+
+
+class Span:
+    """一个处理阶段，记录相对追踪开始的起止时间和子阶段"""
+    __slots__ = ('name', 'start', 'end', 'children', 'error', '_token')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start = time.perf_counter()
+        self.end = None
+        self.children = []
+        self.error = None
+
+    def to_dict(self, origin: float) -> Dict[str, Any]:
+        end = self.end if self.end is not None else time.perf_counter()
+        data = {
+            'name': self.name,
+            'start_ms': round((self.start - origin) * 1000, 3),
+            'duration_ms': round((end - self.start) * 1000, 3),
+        }
+        if self.error:
+            data['error'] = self.error
+        if self.children:
+            data['children'] = [child.to_dict(origin) for child in self.children]
+        return data
+
+
+class Trace(Span):
+    """一次请求的追踪（根 span）"""
+    __slots__ = ()
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.perf_counter()
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        _current_span.reset(self._token)
+        return False
+
+    def to_dict(self, origin: float = None) -> Dict[str, Any]:
+        return super().to_dict(self.start if origin is None else origin)
+
+
+def start_trace(name: str = 'request') -> Trace:
+    """开始追踪当前请求，用作 with 语句"""
+    return Trace(name)
+
+
+def tracing_active() -> bool:
+    return _current_span.get() is not None
+
+
+def enter_span(name: str):
+    """在当前追踪中开始一个子阶段，没有追踪时返回 None"""
+    parent = _current_span.get()
+    if parent is None:
+        return None
+    span = Span(name)
+    parent.children.append(span)
+    span._token = _current_span.set(span)
+    return span
+
+
+def exit_span(span: Span, exc_type=None) -> None:
+    span.end = time.perf_counter()
+    if exc_type is not None:
+        span.error = exc_type.__name__
+    _current_span.reset(span._token)
+
+
+class span:
+    """在当前追踪中记录一个阶段（不计入指标），用作 with 语句"""
+    __slots__ = ('name', '_span')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self._span = enter_span(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._span is not None:
+            exit_span(self._span, exc_type)
+        return False
+
+
+class SamplingProfiler:
+    """采样分析器：按间隔读取 sys._current_frames()，统计各线程调用栈出现的次数"""
+    def __init__(self, interval: float = 0.005, include_idle: bool = False):
+        self.interval = interval
+        self.include_idle = include_idle
+        self.stacks = Counter()
+        self.samples = 0
+
+    @staticmethod
+    def _frame_label(frame) -> str:
+        code = frame.f_code
+        return f'{os.path.basename(code.co_filename)}:{code.co_name}'
+
+    def _is_idle(self, frame) -> bool:
+        """线程是否停在等待锁、队列或 socket 上（这些栈通常只是噪声）"""
+        return frame.f_code.co_name in ('wait', 'acquire', 'get', 'select', 'accept', 'poll', 'sleep',
+                                        '_wait_for_tstate_lock', 'serve_forever', 'readinto')
+
+    def sample(self, exclude=()) -> None:
+        """采集一次所有线程的调用栈"""
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id in exclude:
+                continue
+            if not self.include_idle and self._is_idle(frame):
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, f'thread-{thread_id}'))
+            self.stacks[';'.join(reversed(stack))] += 1
+        self.samples += 1
+
+    def run(self, duration: float) -> None:
+        """在当前线程中采样 duration 秒"""
+        me = {threading.get_ident()}
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            self.sample(exclude=me)
+            time.sleep(self.interval)
+
+    def collapsed(self) -> str:
+        """折叠栈格式输出，按次数从多到少排序"""
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+# 按函数统计时不计入的基础设施模块（统计装饰器和采样器自身）
+PROFILE_EXCLUDE = ('metrics.py', 'tracing.py')
+
+
+def _line_index(filename: str):
+    """源文件中每个函数的 (起始行, 结束行, 限定名)，用于把 tracemalloc 的行号归到函数"""
+    import ast
+    with open(filename, 'rb') as f:
+        tree = ast.parse(f.read())
+    index = []
+
+    def visit(node, prefix):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                name = f'{prefix}{child.name}'
+                start = min([d.lineno for d in child.decorator_list] + [child.lineno])
+                index.append((start, child.end_lineno, name))
+                visit(child, f'{name}.<locals>.')
+            elif isinstance(child, ast.ClassDef):
+                visit(child, f'{prefix}{child.name}.')
+            else:
+                visit(child, prefix)
+    visit(tree, '')
+    return index
+
+
+class FunctionProfiler(SamplingProfiler):
+    """按函数汇总的采样分析：只统计 root 目录下的模块（机器人自身的代码）
+
+    - wall：函数出现在调用栈上的时间（采样间隔内没有占用 CPU 的线程视为在等待，不计入，除非 include_idle）
+    - cpu：线程的 CPU 时间（Linux 上按线程读取 CPU 时钟），分摊给采样时栈上的函数
+    - self_wall / self_cpu：只计入栈上最内层的机器人函数（相当于 cProfile 的 tottime）
+    - alloc_bytes：memory=True 时用 tracemalloc 统计窗口内新分配且仍存活的内存
+    """
+    def __init__(self, root: str = None, interval: float = 0.005, include_idle: bool = False,
+                 memory: bool = False):
+        super().__init__(interval, include_idle)
+        self.root = root or os.path.dirname(os.path.abspath(__file__))
+        self.memory = memory
+        self.functions = {}
+        self.duration = 0.0
+        self._modules = {}  # 文件名 -> 模块名（不统计的文件为 None）
+        self._indexes = {}  # 文件名 -> 函数行号索引
+        self._keys = {}  # 代码对象 -> 函数名（不统计的为 None）
+        self._cpu_clocks = {}  # 线程 -> 上次采样时的 CPU 时间
+        self._last = None
+
+    def _module_of(self, filename: str) -> Optional[str]:
+        module = self._modules.get(filename, '')
+        if module == '':
+            base = os.path.basename(filename)
+            inside = os.path.dirname(os.path.abspath(filename)) == self.root
+            module = base[:-3] if inside and base.endswith('.py') and base not in PROFILE_EXCLUDE else None
+            self._modules[filename] = module
+        return module
+
+    def _index(self, filename: str):
+        index = self._indexes.get(filename)
+        if index is None:
+            try:
+                index = _line_index(filename)
+            except (OSError, SyntaxError, ValueError):
+                index = []
+            self._indexes[filename] = index
+        return index
+
+    def _function_at(self, filename: str, lineno: int) -> str:
+        """包含该行的最内层函数"""
+        name = '<module>'
+        for start, end, qualname in self._index(filename):
+            if start <= lineno <= end:
+                name = qualname  # 嵌套函数排在外层函数之后，取最后一个
+        return name
+
+    def _key(self, code) -> Optional[str]:
+        key = self._keys.get(code, '')
+        if key == '':
+            module = self._module_of(code.co_filename)
+            if module is None:
+                key = None
+            else:
+                # Python 3.11 之前没有 co_qualname，按定义所在的行查找
+                qualname = getattr(code, 'co_qualname', None)
+                if qualname is None:
+                    qualname = self._function_at(code.co_filename, code.co_firstlineno)
+                key = f'{module}.{qualname}'
+            self._keys[code] = key
+        return key
+
+    def _stats(self, key: str) -> Dict[str, float]:
+        stats = self.functions.get(key)
+        if stats is None:
+            stats = self.functions[key] = {'samples': 0, 'wall': 0.0, 'cpu': 0.0,
+                                           'self_wall': 0.0, 'self_cpu': 0.0, 'alloc_bytes': 0}
+        return stats
+
+    def _thread_cpu(self, thread_id: int) -> Optional[float]:
+        try:
+            return time.clock_gettime(time.pthread_getcpuclockid(thread_id))
+        except (AttributeError, OSError, ValueError):
+            return None
+
+    def sample(self, exclude=()) -> None:
+        now = time.perf_counter()
+        elapsed = now - self._last if self._last is not None else self.interval
+        self._last = now
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id in exclude:
+                continue
+            cpu_now = self._thread_cpu(thread_id)
+            first = thread_id not in self._cpu_clocks
+            cpu_before = self._cpu_clocks.get(thread_id)
+            self._cpu_clocks[thread_id] = cpu_now
+            if first:
+                continue  # 第一次采样只记录线程的 CPU 时间起点
+            cpu = cpu_now - cpu_before if cpu_now is not None and cpu_before is not None else 0.0
+            # 停在 C 函数里的等待（time.sleep、锁）看不到等待函数的栈帧，用 CPU 时间是否增长来判断
+            idle = not self.include_idle and (self._is_idle(frame) or (cpu_now is not None and cpu <= 0))
+            wall = 0.0 if idle else elapsed
+            if not wall and not cpu:
+                continue
+            seen = set()
+            innermost = True
+            while frame is not None:
+                key = self._key(frame.f_code)
+                if key is not None:
+                    if key not in seen:  # 递归调用只计一次
+                        seen.add(key)
+                        stats = self._stats(key)
+                        stats['samples'] += 1
+                        stats['wall'] += wall
+                        stats['cpu'] += cpu
+                        if innermost:
+                            stats['self_wall'] += wall
+                            stats['self_cpu'] += cpu
+                            innermost = False
+                frame = frame.f_back
+        self.samples += 1
+
+    def run(self, duration: float) -> None:
+        import tracemalloc
+        started_tracing = self.memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(25)
+        before = tracemalloc.take_snapshot() if self.memory and not started_tracing else None
+        started = time.perf_counter()
+        try:
+            super().run(duration)
+        finally:
+            self.duration += time.perf_counter() - started
+            if self.memory:
+                after = tracemalloc.take_snapshot()
+                if started_tracing:
+                    tracemalloc.stop()
+                self._attribute_allocations(after, before)
+
+    def _attribute_allocations(self, after, before=None) -> None:
+        """把新分配的内存归到调用栈中最内层的机器人函数"""
+        if before is not None:
+            stats = [(s.traceback, s.size_diff) for s in after.compare_to(before, 'traceback')]
+        else:
+            stats = [(s.traceback, s.size) for s in after.statistics('traceback')]
+        for traceback, size in stats:
+            if size <= 0:
+                continue
+            for frame in reversed(traceback):  # 最新的帧在最后
+                module = self._module_of(frame.filename)
+                if module is not None:
+                    name = self._function_at(frame.filename, frame.lineno)
+                    self._stats(f'{module}.{name}')['alloc_bytes'] += size
+                    break
+
+    def result(self) -> Dict[str, Any]:
+        """窗口时长和各函数的统计（按 self_wall 从高到低排序）"""
+        ranked = sorted(self.functions.items(), key=lambda item: item[1]['self_wall'], reverse=True)
+        return {'duration': self.duration, 'samples': self.samples, 'functions': dict(ranked)}
+
+
+_profile_lock = threading.Lock()
+
+
+def profile(duration: float, interval: float = 0.005, include_idle: bool = False) -> Optional[str]:
+    """对整个进程采样 duration 秒并返回折叠栈；已有采样在进行时返回 None"""
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    try:
+        profiler = SamplingProfiler(interval, include_idle)
+        profiler.run(duration)
+        return profiler.collapsed()
+    finally:
+        _profile_lock.release()
+
+
+def profile_functions(duration: float, interval: float = 0.005, memory: bool = False,
+                      root: str = None) -> Optional[Dict[str, Any]]:
+    """对整个进程采样 duration 秒，按函数汇总时间和内存；已有采样在进行时返回 None"""
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    try:
+        profiler = FunctionProfiler(root, interval, memory=memory)
+        profiler.run(duration)
+        return profiler.result()
+    finally:
+        _profile_lock.release()
+
+
+def trace_requested(headers) -> bool:
+    """请求是否带有追踪调试头"""
+    return headers.get(TRACE_HEADER, '').lower() in ('1', 'true', 'yes')
+
+
+def admin_authorized(headers) -> bool:
+    """校验管理接口令牌；未设置 BOT_ADMIN_TOKEN 时管理接口关闭"""
+    expected = os.environ.get('BOT_ADMIN_TOKEN')
+    provided = headers.get(ADMIN_TOKEN_HEADER)
+    if not expected or not provided:
+        return False
+    return hmac.compare_digest(expected.encode('utf-8'), provided.encode('utf-8'))